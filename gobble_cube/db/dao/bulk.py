@@ -0,0 +1,83 @@
+from typing import Any, Sequence, Tuple, Type
+
+from tortoise import Model, Tortoise
+
+from gobble_cube.db.models import table_name
+
+
+def build_insert_query(
+    model: Type[Model],
+    columns: Sequence[str],
+    ignore_conflicts: bool = False,
+) -> str:
+    """
+    Build a parameterized single-row insert for the model table.
+
+    :param model: model whose table is written.
+    :param columns: database columns, in the order of the row values.
+    :param ignore_conflicts: skip rows violating a unique constraint.
+
+    :return: SQL query.
+    """
+    quoted_columns = ", ".join(f'"{column}"' for column in columns)
+    placeholders = ", ".join("?" for _ in columns)
+    verb = "INSERT OR IGNORE" if ignore_conflicts else "INSERT"
+
+    return (
+        f'{verb} INTO "{table_name(model)}" ({quoted_columns}) '
+        f"VALUES ({placeholders})"
+    )
+
+
+async def bulk_insert(
+    model: Type[Model],
+    columns: Sequence[str],
+    rows: Sequence[Tuple[Any, ...]],
+    ignore_conflicts: bool = False,
+) -> None:
+    """
+    Insert already converted rows without building model instances.
+
+    Values are passed to the driver as they are, so they must already be
+    in the form the model fields would store (see the converters in
+    ``gobble_cube.services.ingest``). The same statement is executed for
+    the whole batch, so SQLite prepares it only once.
+
+    :param model: model whose table is written.
+    :param columns: database columns, in the order of the row values.
+    :param rows: parameter tuples.
+    :param ignore_conflicts: skip rows violating a unique constraint.
+    """
+
+    if not rows:
+        return
+
+    query = build_insert_query(model, columns, ignore_conflicts)
+    await Tortoise.get_connection("default").execute_many(
+        query,
+        [list(row) for row in rows],
+    )
+
+
+async def bulk_delete(
+    model: Type[Model],
+    columns: Sequence[str],
+    keys: Sequence[Tuple[Any, ...]],
+) -> None:
+    """
+    Delete the rows matching any of the given keys.
+
+    :param model: model whose table is written.
+    :param columns: database columns making up the key.
+    :param keys: key values, in the order of the columns.
+    """
+
+    if not keys:
+        return
+
+    conditions = " AND ".join(f'"{column}" = ?' for column in columns)
+    query = f'DELETE FROM "{table_name(model)}" WHERE {conditions}'  # noqa: S608
+    await Tortoise.get_connection("default").execute_many(
+        query,
+        [list(key) for key in keys],
+    )
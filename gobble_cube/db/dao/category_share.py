@@ -1,6 +1,30 @@
 from typing import List
 
-from tortoise import Tortoise
+from gobble_cube.db.dao.duckdb_mirror import duckdb_mirror, use_duckdb
+from gobble_cube.db.dao.queries import queries
+
+NO_LIMIT = 2**63 - 1
+
+# Market shares are stored in basis points
+CATEGORY_SHARE_CHANGES = queries.register(
+    "category_share_changes",
+    """
+    SELECT
+        c.category_id AS category_id,
+        (MAX(cs.market_share) - MIN(cs.market_share)) / 100.0 AS market_share_change
+    FROM
+        product_categories c
+    JOIN
+        category_shares cs ON cs.product_id = c.product_id
+    WHERE
+        cs.date BETWEEN ? AND ?
+    GROUP BY
+        c.category_id
+    ORDER BY
+        market_share_change DESC, c.category_id
+    LIMIT ?
+    """,
+)
 
 
 async def fetch_category_share_data_for_period(
@@ -9,56 +33,18 @@ async def fetch_category_share_data_for_period(
     """
     Custom query to fetch category share data for a given period.
 
+    Computed from the raw category shares, the significance endpoint
+    reads the category share summary instead.
+
     :param start_date: start date.
     :param end_date: end date.
-    :param limit: limit the number of results.
+    :param limit: limit the number of results, every category when 0.
 
     :return: category share data.
     """
 
-    query = f"""
-        SELECT
-            c.category_id AS category_id,
-            MAX(cs.market_share) - MIN(cs.market_share) AS market_share_change
-        FROM
-            product_categories c
-        JOIN
-            category_shares cs ON cs.product_id = c.product_id
-        WHERE
-            cs.date BETWEEN '{start_date}' AND '{end_date}'
-        GROUP BY
-            c.category_id
-        ORDER BY
-            market_share_change DESC
-    """
-
-    if limit:
-        query += f" LIMIT {limit};"
-
-    """
-
-    query if you want to fetch the category names as well
-
-    query =
-        SELECT
-            c.id AS category_id,
-            c.name AS category_name,
-            MAX(cs.market_share) - MIN(cs.market_share) AS market_share_change
-        FROM
-            categories c
-        JOIN
-            product_categories p ON p.category_id = c.id
-        JOIN
-            category_shares cs ON cs.product_id = p.product_id
-        WHERE
-            cs.date BETWEEN '2024-01-01' AND '2024-12-31'
-        GROUP BY
-            c.id, c.name
-        ORDER BY
-            market_share_change DESC
-        LIMIT 5;
-    """
-
-    category_shares = await Tortoise.get_connection("default").execute_query_dict(query)
-
-    return category_shares
+    # The largest limit, as DuckDB refuses a negative one where SQLite does not
+    params = [start_date, end_date, limit or NO_LIMIT]
+    if use_duckdb():
+        return await duckdb_mirror.fetch_dicts(CATEGORY_SHARE_CHANGES, params)
+    return await queries.fetch_dicts(CATEGORY_SHARE_CHANGES, params)
@@ -0,0 +1,283 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from tortoise import Tortoise
+
+from gobble_cube.db.dao.queries import queries
+
+# Columns of the summary, statements only format in such constants, never values
+SUMMARY_COLUMNS = '"category_id", "date", "min_share_bp", "max_share_bp"'
+
+ADD_TO_CATEGORY_DAILY_SHARE = f"""
+    INSERT INTO "category_daily_share" ({SUMMARY_COLUMNS})
+    SELECT pc.category_id, ?, ?, ? FROM product_categories pc WHERE pc.product_id = ?
+    ON CONFLICT ("category_id", "date") DO UPDATE SET
+        "min_share_bp" = MIN("min_share_bp", excluded."min_share_bp"),
+        "max_share_bp" = MAX("max_share_bp", excluded."max_share_bp")
+"""  # noqa: S608
+
+AGGREGATE_CATEGORY_SHARES_BY_DAY = """
+    SELECT pc.category_id, cs.date, MIN(cs.market_share), MAX(cs.market_share)
+    FROM category_shares cs
+    JOIN product_categories pc ON pc.product_id = cs.product_id
+"""
+
+# Categories of a product, as a subquery
+CATEGORIES_OF_PRODUCT = (
+    "SELECT category_id FROM product_categories WHERE product_id = ?"
+)
+
+CATEGORY_DAILY_SHARE = queries.register(
+    "category_daily_share",
+    f'SELECT {SUMMARY_COLUMNS} FROM "category_daily_share" '  # noqa: S608
+    'ORDER BY "category_id", "date"',
+    scans=["category_daily_share"],
+)
+
+# Lists of values are given as a single JSON array, so the text is fixed
+CATEGORY_DAILY_SHARE_OF_CATEGORIES = queries.register(
+    "category_daily_share_of_categories",
+    f'SELECT {SUMMARY_COLUMNS} FROM "category_daily_share" '  # noqa: S608
+    'WHERE "category_id" IN (SELECT value FROM json_each(?)) '
+    'ORDER BY "category_id", "date"',
+)
+
+CATEGORY_DAILY_SHARE_OF_PRODUCTS = queries.register(
+    "category_daily_share_of_products",
+    """
+    SELECT DISTINCT cds.category_id, cds.date, cds.min_share_bp, cds.max_share_bp
+    FROM category_daily_share cds
+    JOIN product_categories pc ON pc.category_id = cds.category_id
+    JOIN (
+        SELECT json_extract(value, '$[0]') AS product_id,
+            json_extract(value, '$[1]') AS date
+        FROM json_each(?)
+    ) k ON k.product_id = pc.product_id AND k.date = cds.date
+    ORDER BY cds.category_id, cds.date
+    """,
+)
+
+CATEGORIES_OF_PRODUCTS = queries.register(
+    "categories_of_products",
+    "SELECT DISTINCT category_id FROM product_categories "
+    "WHERE product_id IN (SELECT value FROM json_each(?))",
+)
+
+SHARE_CHANGES_FOR_PERIOD = queries.register(
+    "share_changes_for_period",
+    """
+    SELECT "category_id", MAX("max_share_bp") - MIN("min_share_bp") AS change
+    FROM "category_daily_share"
+    WHERE "date" BETWEEN ? AND ?
+    GROUP BY "category_id"
+    ORDER BY change DESC, "category_id"
+    LIMIT ?
+    """,
+)
+
+CategoryShareSummaryRow = Tuple[int, str, int, int]
+
+
+async def add_to_category_daily_share(
+    rows: Sequence[Tuple[int, str, int, int]],
+) -> None:
+    """
+    Add aggregated category shares to the summary of their categories.
+
+    :param rows: product id, date, lowest and highest market share in
+        basis points, at most one row per product and day.
+    """
+
+    if not rows:
+        return
+
+    await Tortoise.get_connection("default").execute_many(
+        ADD_TO_CATEGORY_DAILY_SHARE,
+        [[day, low, high, product_id] for product_id, day, low, high in rows],
+    )
+
+
+async def refresh_category_daily_share(keys: Sequence[Tuple[int, str]]) -> None:
+    """
+    Recompute the summary of the categories of some products on some days.
+
+    Used when shares were deleted, for example by an upload replacing them.
+
+    :param keys: product id and date pairs.
+    """
+
+    if not keys:
+        return
+
+    params = [[day, product_id] for product_id, day in keys]
+    connection = Tortoise.get_connection("default")
+    await connection.execute_many(
+        'DELETE FROM "category_daily_share" '  # noqa: S608
+        f'WHERE "date" = ? AND "category_id" IN ({CATEGORIES_OF_PRODUCT})',
+        params,
+    )
+    # Products sharing a category compute the same row again
+    await connection.execute_many(
+        f'INSERT OR REPLACE INTO "category_daily_share" ({SUMMARY_COLUMNS})'
+        f"{AGGREGATE_CATEGORY_SHARES_BY_DAY}"
+        f"WHERE cs.date = ? AND pc.category_id IN ({CATEGORIES_OF_PRODUCT}) "
+        "GROUP BY pc.category_id, cs.date",
+        params,
+    )
+
+
+async def refresh_category_daily_share_of_categories(categories: Iterable[int]) -> None:
+    """
+    Recompute the summary of some categories, after their products changed.
+
+    :param categories: category ids.
+    """
+
+    params = [[category_id] for category_id in categories]
+    if not params:
+        return
+
+    connection = Tortoise.get_connection("default")
+    await connection.execute_many(
+        'DELETE FROM "category_daily_share" WHERE "category_id" = ?',
+        params,
+    )
+    await connection.execute_many(
+        f'INSERT INTO "category_daily_share" ({SUMMARY_COLUMNS})'
+        f"{AGGREGATE_CATEGORY_SHARES_BY_DAY}"
+        "WHERE pc.category_id = ? GROUP BY pc.category_id, cs.date",
+        params,
+    )
+
+
+async def rebuild_category_daily_share() -> None:
+    """
+    Recompute the summary from the whole category shares table.
+
+    Run it in a transaction, so the summary is never seen half built.
+    """
+
+    connection = Tortoise.get_connection("default")
+    await connection.execute_query('DELETE FROM "category_daily_share"')
+    await connection.execute_query(
+        f'INSERT INTO "category_daily_share" ({SUMMARY_COLUMNS})'
+        f"{AGGREGATE_CATEGORY_SHARES_BY_DAY} GROUP BY pc.category_id, cs.date",
+    )
+
+
+async def category_daily_share_is_missing() -> bool:
+    """
+    Check whether category shares were stored without their summary.
+
+    This is the case of databases created before the summary existed.
+
+    :return: whether the summary must be rebuilt.
+    """
+
+    _, rows = await Tortoise.get_connection("default").execute_query(
+        "SELECT EXISTS ("
+        "SELECT 1 FROM category_shares cs "
+        "JOIN product_categories pc ON pc.product_id = cs.product_id"
+        ') AND NOT EXISTS (SELECT 1 FROM "category_daily_share")',
+    )
+    return bool(rows[0][0])
+
+
+async def find_category_daily_share_differences() -> List[Dict[str, Any]]:
+    """
+    Compare the summary with the raw category shares.
+
+    Rows that are missing, extra or different show up twice, as
+    ``expected`` and as ``stored``, see ``find_sales_rollup_differences``.
+
+    :return: differing rows, empty when the summary is consistent.
+    """
+
+    expected = f"{AGGREGATE_CATEGORY_SHARES_BY_DAY} GROUP BY pc.category_id, cs.date"
+    stored = f'SELECT {SUMMARY_COLUMNS} FROM "category_daily_share"'  # noqa: S608
+    connection = Tortoise.get_connection("default")
+    differences: List[Dict[str, Any]] = []
+    for side, query in (
+        ("expected", f"{expected} EXCEPT {stored}"),
+        ("stored", f"{stored} EXCEPT {expected}"),
+    ):
+        _, rows = await connection.execute_query(query)
+        differences.extend(
+            {"table": "category_daily_share", "side": side, "row": list(row)}
+            for row in rows
+        )
+    return differences
+
+
+async def fetch_category_daily_share(
+    categories: Optional[Iterable[int]] = None,
+) -> List[CategoryShareSummaryRow]:
+    """
+    Read the category share summary.
+
+    :param categories: categories to read, every category by default.
+    :return: category id, date, lowest and highest market share in basis
+        points, by category and date.
+    """
+
+    if categories is None:
+        rows = await queries.fetch(CATEGORY_DAILY_SHARE)
+    else:
+        rows = await queries.fetch(
+            CATEGORY_DAILY_SHARE_OF_CATEGORIES,
+            [json.dumps(list(categories))],
+        )
+    return rows
+
+
+async def fetch_category_daily_share_of_products(
+    keys: Iterable[Tuple[int, str]],
+) -> List[CategoryShareSummaryRow]:
+    """
+    Read the summary of the categories of some products on some days.
+
+    :param keys: product id and date pairs.
+    :return: category id, date, lowest and highest market share in basis
+        points, by category and date.
+    """
+
+    return await queries.fetch(
+        CATEGORY_DAILY_SHARE_OF_PRODUCTS,
+        [json.dumps([list(key) for key in keys])],
+    )
+
+
+async def fetch_categories_of_products(product_ids: Iterable[int]) -> Set[int]:
+    """
+    Read the categories of some products.
+
+    :param product_ids: product ids.
+    :return: category ids.
+    """
+
+    rows = await queries.fetch(
+        CATEGORIES_OF_PRODUCTS,
+        [json.dumps(list(product_ids))],
+    )
+    return {row[0] for row in rows}
+
+
+async def fetch_share_changes_for_period(
+    start_date: str,
+    end_date: str,
+    limit: Optional[int] = None,
+) -> List[Tuple[int, int]]:
+    """
+    Compute the market share change of every category over a period.
+
+    :param start_date: first day.
+    :param end_date: last day.
+    :param limit: return the categories with the largest changes only.
+    :return: category id and change in basis points, largest change first.
+    """
+
+    # A negative limit is no limit for SQLite
+    return await queries.fetch(
+        SHARE_CHANGES_FOR_PERIOD,
+        [start_date, end_date, limit or -1],
+    )
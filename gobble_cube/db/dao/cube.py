@@ -0,0 +1,255 @@
+import json
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from gobble_cube.db.dao.duckdb_mirror import duckdb_mirror, use_duckdb
+from gobble_cube.db.dao.queries import connect_read_only, queries
+
+# Column of every cube dimension in the sales transactions query
+DIMENSION_COLUMNS = {
+    "category": "pc.category_id",
+    "product": "st.product_id",
+    "quantity": "st.quantity",
+    "revenue": "st.revenue",
+    "date": "st.date",
+}
+
+# Products without category are grouped under a NULL category
+NULLABLE_DIMENSIONS = {"category"}
+
+CUBE_ROW_STATISTICS = queries.register(
+    "cube_row_statistics",
+    """
+    SELECT
+        COUNT(*),
+        COUNT(DISTINCT product_id),
+        COUNT(DISTINCT quantity),
+        COUNT(DISTINCT revenue),
+        COUNT(DISTINCT date)
+    FROM sales_transactions
+    """,
+    scans=["sales_transactions"],
+)
+
+CUBE_CATEGORY_STATISTICS = queries.register(
+    "cube_category_statistics",
+    """
+    SELECT
+        (SELECT COUNT(DISTINCT category_id) FROM product_categories),
+        (
+            SELECT COALESCE(SUM(s.sales * MAX(COALESCE(l.links, 0), 1)), 0)
+            FROM (
+                SELECT product_id, COUNT(*) AS sales
+                FROM sales_transactions GROUP BY product_id
+            ) s
+            LEFT JOIN (
+                SELECT product_id, COUNT(*) AS links
+                FROM product_categories GROUP BY product_id
+            ) l ON l.product_id = s.product_id
+        )
+    """,
+    scans=["sales_transactions", "product_categories"],
+)
+
+PRODUCT_CATEGORIES = queries.register(
+    "product_categories",
+    "SELECT product_id, category_id FROM product_categories",
+    scans=["product_categories"],
+)
+
+PRODUCT_CATEGORIES_OF_PRODUCTS = queries.register(
+    "product_categories_of_products",
+    "SELECT product_id, category_id FROM product_categories "
+    "WHERE product_id IN (SELECT value FROM json_each(?))",
+)
+
+
+async def fetch_cube_statistics() -> Dict[str, int]:
+    """
+    Count the sales transactions and the distinct values of every dimension.
+
+    :return: ``rows``, ``products``, ``quantities``, ``revenues``, ``dates``,
+        ``categories`` and ``category_links``, the number of sales
+        transaction rows once joined with their categories.
+    """
+
+    rows = await queries.fetch(CUBE_ROW_STATISTICS)
+    total, products, quantities, revenues, dates = rows[0]
+    rows = await queries.fetch(CUBE_CATEGORY_STATISTICS)
+    categories, category_links = rows[0]
+    return {
+        "rows": total,
+        "products": products,
+        "quantities": quantities,
+        "revenues": revenues,
+        "dates": dates,
+        "categories": categories,
+        "category_links": category_links,
+    }
+
+
+def build_cuboid_query(
+    dimensions: Sequence[str],
+    after: Optional[Sequence[Any]] = None,
+    limit: Optional[int] = None,
+    sort: bool = False,
+) -> Tuple[str, List[Any]]:
+    """
+    Build the query grouping the sales transactions by some dimensions.
+
+    The query is registered under a name of its dimensions and clauses,
+    its text does not depend on the values, see ``QueryRegistry``.
+
+    :param dimensions: dimensions to group by, in cube order.
+    :param after: only return the groups after these values of the dimensions.
+    :param limit: return at most this number of groups.
+    :param sort: sort the groups by the values of the dimensions.
+    :return: name of the query and its parameters.
+    """
+
+    columns = [DIMENSION_COLUMNS[dimension] for dimension in dimensions]
+    nullable = [dimension in NULLABLE_DIMENSIONS for dimension in dimensions]
+    name = f"cuboid:{','.join(dimensions)}"
+    query = f"SELECT {', '.join([*columns, 'SUM(st.revenue)'])} "
+    query += "FROM sales_transactions st "
+    if "category" in dimensions:
+        query += "LEFT JOIN product_categories pc ON pc.product_id = st.product_id "
+    params: List[Any] = []
+    if after is not None:
+        name += ":after"
+        query += f"WHERE {keyset_condition(columns, nullable)} "
+        params = keyset_params(after, nullable)
+    if columns:
+        query += f"GROUP BY {', '.join(columns)} "
+        if sort or after is not None or limit is not None:
+            name += ":sorted"
+            query += f"ORDER BY {', '.join(columns)} "
+    if limit is not None:
+        name += ":limit"
+        query += "LIMIT ?"
+        params.append(limit)
+    # Every transaction is grouped
+    return queries.register(name, query, scans=["sales_transactions"]), params
+
+
+def keyset_condition(columns: Sequence[str], nullable: Sequence[bool]) -> str:
+    """
+    Build the condition selecting the rows sorted after some values.
+
+    Rows are compared column by column, NULL coming first as in ORDER BY.
+    The values are parameters, given by :func:`keyset_params`, so the
+    condition is the same whatever the values.
+
+    :param columns: sort columns.
+    :param nullable: whether each column can be NULL.
+    :return: condition.
+    """
+
+    if not columns:
+        # The only group of a query without columns comes after nothing
+        return "0"
+    alternatives = []
+    for position, column in enumerate(columns):
+        terms = [
+            f"{previous} IS ?" if previous_nullable else f"{previous} = ?"
+            for previous, previous_nullable in zip(columns, nullable[:position])
+        ]
+        if nullable[position]:
+            # Any value comes after NULL
+            terms.append(f"((? IS NULL AND {column} IS NOT NULL) OR {column} > ?)")
+        else:
+            terms.append(f"{column} > ?")
+        alternatives.append(f"({' AND '.join(terms)})")
+    return f"({' OR '.join(alternatives)})"
+
+
+def keyset_params(values: Sequence[Any], nullable: Sequence[bool]) -> List[Any]:
+    """
+    Get the parameters of :func:`keyset_condition`.
+
+    :param values: values of the sort columns of the last row seen.
+    :param nullable: whether each column can be NULL.
+    :return: parameters.
+    """
+
+    params: List[Any] = []
+    for position, value in enumerate(values):
+        params.extend(values[:position])
+        params.extend([value, value] if nullable[position] else [value])
+    return params
+
+
+async def fetch_cuboid(
+    dimensions: Sequence[str],
+    after: Optional[Sequence[Any]] = None,
+    limit: Optional[int] = None,
+) -> List[Tuple[Any, ...]]:
+    """
+    Group the sales transactions by some dimensions.
+
+    Transactions of a product listed in several categories count in each
+    of them, products without category are grouped under a NULL category.
+
+    :param dimensions: dimensions to group by, in cube order.
+    :param after: only return the groups after these values of the
+        dimensions, groups are then sorted.
+    :param limit: return at most this number of groups, sorted.
+    :return: values of the dimensions followed by the revenue in cents.
+    """
+
+    name, params = build_cuboid_query(dimensions, after, limit)
+    # Pages compare NULL with ``IS ?``, which DuckDB does not parse
+    if after is None and use_duckdb():
+        rows = await duckdb_mirror.fetch(name, params)
+    else:
+        rows = await queries.fetch(name, params)
+    return [row for row in rows if row[-1] is not None]
+
+
+async def stream_cuboid(
+    dimensions: Sequence[str],
+    chunk_size: int,
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    """
+    Group the sales transactions by some dimensions, chunk by chunk.
+
+    Groups are sorted, and read from the database cursor as they are
+    sent, so they are never all held in memory. A read-only connection
+    of its own is used, so the stream does not hold back other queries,
+    and writers are not blocked in WAL mode. In-memory databases are
+    read through the shared connection instead.
+
+    :param dimensions: dimensions to group by, in cube order.
+    :param chunk_size: number of groups read at a time.
+    :yields: values of the dimensions followed by the revenue in cents.
+    """
+
+    name, params = build_cuboid_query(dimensions, sort=True)
+    async with connect_read_only() as connection:
+        with queries.timed(name) as timing:
+            async with connection.execute(queries.sql(name), params) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    timing.rows += len(rows)
+                    yield [tuple(row) for row in rows if row[-1] is not None]
+
+
+async def fetch_product_categories(
+    product_ids: Optional[Iterable[int]] = None,
+) -> List[Tuple[int, int]]:
+    """
+    Read the product to category links.
+
+    :param product_ids: products to read the links of, every product by default.
+    :return: product id and category id pairs.
+    """
+
+    if product_ids is None:
+        rows = await queries.fetch(PRODUCT_CATEGORIES)
+    else:
+        rows = await queries.fetch(
+            PRODUCT_CATEGORIES_OF_PRODUCTS,
+            [json.dumps(list(product_ids))],
+        )
+    return rows
@@ -0,0 +1,61 @@
+import json
+from typing import Dict, Sequence, Tuple
+
+from tortoise import Tortoise
+
+from gobble_cube.db.dao.queries import queries
+
+# Version and version of the last rewrite of a table
+TableVersion = Tuple[int, int]
+
+BUMP_DATA_VERSION = """
+    INSERT INTO "data_versions" ("name", "version", "rewritten") VALUES (?, 1, ?)
+    ON CONFLICT ("name") DO UPDATE SET
+        "version" = "version" + 1,
+        "rewritten" = CASE
+            WHEN excluded."rewritten" THEN "version" + 1 ELSE "rewritten"
+        END
+"""
+
+DATA_VERSIONS = queries.register(
+    "data_versions",
+    'SELECT "name", "version", "rewritten" FROM "data_versions"',
+    scans=["data_versions"],
+)
+
+
+async def bump_data_versions(
+    tables: Sequence[str],
+    rewritten: bool = False,
+) -> Dict[str, int]:
+    """
+    Record that tables were written to, in the transaction writing them.
+
+    The versions are committed or rolled back with the rows, so another
+    process reading a version also reads the rows written up to it.
+
+    :param tables: names of the tables.
+    :param rewritten: whether rows were deleted or changed, not only added.
+    :return: new version of every table.
+    """
+    connection = Tortoise.get_connection("default")
+    await connection.execute_many(
+        BUMP_DATA_VERSION,
+        [[table, int(rewritten)] for table in tables],
+    )
+    _, rows = await connection.execute_query(
+        'SELECT "name", "version" FROM "data_versions" '
+        'WHERE "name" IN (SELECT value FROM json_each(?))',
+        [json.dumps(list(tables))],
+    )
+    return {row[0]: row[1] for row in rows}
+
+
+async def fetch_data_versions() -> Dict[str, TableVersion]:
+    """
+    Read the committed version of every table written to.
+
+    :return: version and version of the last rewrite, by table name.
+    """
+    rows = await queries.fetch(DATA_VERSIONS)
+    return {name: (version, rewritten) for name, version, rewritten in rows}
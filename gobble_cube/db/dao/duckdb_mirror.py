@@ -0,0 +1,218 @@
+import asyncio
+from typing import Any, Dict, List, Sequence, Tuple
+
+from gobble_cube.db.dao.data_versions import TableVersion, fetch_data_versions
+from gobble_cube.db.dao.queries import connect_read_only, queries
+from gobble_cube.settings import AnalyticsEngine, settings
+from gobble_cube.state import on_reset
+
+try:
+    import duckdb
+    import pyarrow as pa
+
+    DUCKDB_AVAILABLE = True
+except ImportError:  # pragma: no cover
+    DUCKDB_AVAILABLE = False
+
+# Columns of the mirrored tables and their DuckDB types. Dates are kept as
+# the text SQLite stores and compares
+MIRRORED_TABLES = {
+    "sales_transactions": {
+        "id": "BIGINT",
+        "date": "VARCHAR",
+        "quantity": "BIGINT",
+        "revenue": "BIGINT",
+        "product_id": "BIGINT",
+    },
+    "category_shares": {
+        "id": "BIGINT",
+        "date": "VARCHAR",
+        "market_share": "BIGINT",
+        "product_id": "BIGINT",
+    },
+    "product_categories": {
+        "id": "BIGINT",
+        "product_id": "BIGINT",
+        "category_id": "BIGINT",
+    },
+}
+
+# Rows copied from SQLite at a time
+COPY_CHUNK_SIZE = 100_000
+
+# Rows of a table after an id, ids only grow as the tables are AUTOINCREMENT.
+# Only the names of MIRRORED_TABLES are formatted into the statements.
+COPY_QUERIES = {
+    table: queries.register(
+        f"mirror:{table}",
+        f'SELECT {", ".join(columns)} FROM "{table}" '  # noqa: S608
+        'WHERE "id" > ? ORDER BY "id" LIMIT ?',
+    )
+    for table, columns in MIRRORED_TABLES.items()
+}
+
+
+def use_duckdb() -> bool:
+    """
+    Check whether the wide aggregations run on DuckDB.
+
+    :return: whether ``settings.analytics_engine`` is DuckDB.
+    """
+    return settings.analytics_engine == AnalyticsEngine.DUCKDB
+
+
+class DuckDBMirror:
+    """
+    Copy of the tables the wide aggregations read, in an embedded DuckDB.
+
+    SQLite keeps taking the uploads, DuckDB answers the GROUP BYs over
+    every row with its columnar, vectorized execution. The registered
+    queries run on it unchanged, as their SQL is valid for both.
+
+    Tables are copied on first use, through a read-only connection that
+    only sees committed rows, and every worker process holds its own copy.
+    Before every query, the data versions the uploads of any process bump
+    are compared with the ones of the copy, see
+    ``gobble_cube.db.dao.data_versions``. Rows appended since are copied
+    by id, and tables rewritten since are copied again whole.
+    """
+
+    def __init__(self) -> None:
+        self._connection: Any = None
+        self._last_ids: Dict[str, int] = {}
+        # Data versions of the copied tables
+        self._versions: Dict[str, TableVersion] = {}
+        self._lock = asyncio.Lock()
+
+    async def fetch(
+        self,
+        name: str,
+        params: Sequence[Any] = (),
+    ) -> List[Tuple[Any, ...]]:
+        """
+        Run a registered query on DuckDB.
+
+        :param name: name of the query.
+        :param params: values of its parameters.
+        :return: rows.
+        """
+        _, rows = await self._execute(name, params)
+        return rows
+
+    async def fetch_dicts(
+        self,
+        name: str,
+        params: Sequence[Any] = (),
+    ) -> List[Dict[str, Any]]:
+        """
+        Run a registered query on DuckDB, rows being dictionaries.
+
+        :param name: name of the query.
+        :param params: values of its parameters.
+        :return: rows by column name.
+        """
+        columns, rows = await self._execute(name, params)
+        return [dict(zip(columns, row)) for row in rows]
+
+    async def sync(self) -> None:
+        """Copy the tables on first use, then the changes of the uploads."""
+        async with self._lock:
+            if self._connection is None:
+                connection = _require_duckdb().connect()
+                # As in SQLite, NULL comes first in ascending order
+                connection.execute("SET default_null_order = 'nulls_first'")
+                self._connection = connection
+                self._versions = {}
+            # Versions are read first, rows committed meanwhile get a new one
+            versions = await fetch_data_versions()
+            for table in MIRRORED_TABLES:
+                version = versions.get(table, (0, 0))
+                copied = self._versions.pop(table, None)
+                if copied == version:
+                    self._versions[table] = version
+                    continue
+                # A failed copy is made again whole, its version being dropped
+                await self._copy(table, copied is None or copied[1] != version[1])
+                self._versions[table] = version
+
+    def reset(self) -> None:
+        """Drop the copy, it is made again on next use."""
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = None
+        self._last_ids, self._versions = {}, {}
+
+    async def _execute(
+        self,
+        name: str,
+        params: Sequence[Any],
+    ) -> Tuple[List[str], List[Tuple[Any, ...]]]:
+        await self.sync()
+        # A cursor is a connection of its own, for the worker thread
+        cursor = self._connection.cursor()
+        with queries.timed(f"duckdb:{name}") as timing:
+            try:
+                rows = await asyncio.to_thread(
+                    lambda: cursor.execute(queries.sql(name), list(params)).fetchall(),
+                )
+                columns = [column[0] for column in cursor.description]
+            finally:
+                cursor.close()
+            timing.rows += len(rows)
+        return columns, rows
+
+    async def _copy(self, table: str, replaced: bool) -> None:
+        columns = MIRRORED_TABLES[table]
+        if replaced:
+            definition = ", ".join(f"{name} {kind}" for name, kind in columns.items())
+            await asyncio.to_thread(
+                self._connection.execute,
+                f"CREATE OR REPLACE TABLE {table} ({definition})",
+            )
+            self._last_ids[table] = 0
+
+        types = [
+            pa.string() if kind == "VARCHAR" else pa.int64()
+            for kind in columns.values()
+        ]
+        name = COPY_QUERIES[table]
+        async with connect_read_only() as connection:
+            while True:
+                with queries.timed(name) as timing:
+                    cursor = await connection.execute(
+                        queries.sql(name),
+                        [self._last_ids[table], COPY_CHUNK_SIZE],
+                    )
+                    rows = await cursor.fetchall()
+                    await cursor.close()
+                    timing.rows += len(rows)
+                if not rows:
+                    break
+                chunk = pa.Table.from_arrays(
+                    [pa.array(values, kind) for values, kind in zip(zip(*rows), types)],
+                    names=list(columns),
+                )
+                await asyncio.to_thread(self._append, table, chunk)
+                self._last_ids[table] = rows[-1][0]
+                if len(rows) < COPY_CHUNK_SIZE:
+                    break
+
+    def _append(self, table: str, chunk: Any) -> None:
+        self._connection.register("mirror_chunk", chunk)
+        try:
+            self._connection.execute(f"INSERT INTO {table} SELECT * FROM mirror_chunk")  # noqa: S608
+        finally:
+            self._connection.unregister("mirror_chunk")
+
+
+def _require_duckdb() -> Any:
+    if not DUCKDB_AVAILABLE:
+        raise ValueError(
+            "The DuckDB analytics engine needs duckdb and pyarrow, "
+            "install gobble_cube with the `analytics` extra.",
+        )
+    return duckdb
+
+
+duckdb_mirror = DuckDBMirror()
+on_reset(duckdb_mirror.reset)
@@ -0,0 +1,61 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from tortoise import Tortoise
+
+from gobble_cube.db.dao.queries import queries
+
+INGEST_JOB = queries.register(
+    "ingest_job",
+    'SELECT "id", "kind", "mode", "fingerprint", "status", "rows_processed", '
+    '"error", "created_at", "started_at", "finished_at" '
+    'FROM "ingest_jobs" WHERE "id" = ?',
+)
+
+INGEST_JOBS_WITH_STATUS = queries.register(
+    "ingest_jobs_with_status",
+    'SELECT "id", "worker" FROM "ingest_jobs" WHERE "status" = ? '
+    'ORDER BY "created_at" LIMIT ?',
+)
+
+
+async def fetch_ingest_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Read the committed state of a background upload.
+
+    Read on the read-only connections, so it does not wait for the
+    upload holding the write transaction.
+
+    :param job_id: id of the job.
+    :return: columns of the job, None if it is unknown.
+    """
+    rows = await queries.fetch_dicts(INGEST_JOB, [job_id])
+    return rows[0] if rows else None
+
+
+async def fetch_ingest_jobs_with_status(
+    status: str,
+    limit: int,
+) -> List[Tuple[str, Optional[str]]]:
+    """
+    Read the oldest background uploads of a status, such as pending.
+
+    :param status: status of the jobs.
+    :param limit: most jobs returned.
+    :return: id and worker of every job, oldest first.
+    """
+    rows = await queries.fetch(INGEST_JOBS_WITH_STATUS, [status, limit])
+    return [(row[0], row[1]) for row in rows]
+
+
+async def delete_finished_ingest_jobs(keep: int) -> None:
+    """
+    Forget the finished background uploads but the latest ones.
+
+    :param keep: finished jobs kept for the status endpoint.
+    """
+    await Tortoise.get_connection("default").execute_query(
+        'DELETE FROM "ingest_jobs" WHERE "id" IN ('
+        'SELECT "id" FROM "ingest_jobs" WHERE "finished_at" IS NOT NULL '
+        'ORDER BY "finished_at" DESC LIMIT -1 OFFSET ?)',
+        [keep],
+    )
@@ -0,0 +1,329 @@
+import asyncio
+import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+
+import aiosqlite
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient, BaseTransactionWrapper
+from tortoise.backends.sqlite.client import SqliteClient
+
+from gobble_cube.settings import settings
+from gobble_cube.state import on_reset
+
+# PRAGMAs of the read-only connections, the others only matter to writers
+READ_PRAGMAS = ("busy_timeout", "cache_size", "mmap_size", "temp_store")
+
+
+@dataclass
+class QueryTiming:
+    """Calls of a named query and the time they took."""
+
+    calls: int = 0
+    rows: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+class QueryRegistry:
+    """
+    Registry of the named, parameterized analytics queries.
+
+    Every read query of the analytics DAOs is registered once under a
+    name, with a fixed SQL text taking its values as parameters. The
+    sqlite3 driver keeps the statements it compiled in a per-connection
+    cache keyed by their text, so a registered query is compiled once per
+    connection and reused by every call, and no value is ever spliced
+    into the SQL. Calls are timed by name, see :meth:`stats`, and run on
+    the read-only connections of :class:`ReadConnectionPool`.
+
+    Queries reading a whole table declare it, every other table must be
+    read through an index, which the tests check on the query plans.
+    """
+
+    def __init__(self) -> None:
+        self._queries: Dict[str, str] = {}
+        self._scans: Dict[str, FrozenSet[str]] = {}
+        self.timings: Dict[str, QueryTiming] = {}
+
+    def register(self, name: str, sql: str, scans: Sequence[str] = ()) -> str:
+        """
+        Register a query under a name.
+
+        Registering the same query again is allowed, so queries can be
+        registered on first use.
+
+        :param name: unique name of the query.
+        :param sql: SQL text, values are ``?`` parameters.
+        :param scans: tables the query reads whole, such as the fact table
+            of an aggregation over every row.
+        :raises ValueError: if another query has the name.
+        :return: the name.
+        """
+        registered = self._queries.setdefault(name, sql)
+        if registered != sql:
+            raise ValueError(f"Another query is named {name}")
+        self._scans[name] = frozenset(scans)
+        return name
+
+    def names(self) -> List[str]:
+        """
+        List the registered queries.
+
+        :return: names, sorted.
+        """
+        return sorted(self._queries)
+
+    def scans(self, name: str) -> FrozenSet[str]:
+        """
+        Get the tables a query reads whole.
+
+        :param name: name of the query.
+        :return: table names.
+        """
+        return self._scans[name]
+
+    def sql(self, name: str) -> str:
+        """
+        Get the SQL text of a query.
+
+        :param name: name of the query.
+        :return: SQL text.
+        """
+        return self._queries[name]
+
+    async def fetch(
+        self,
+        name: str,
+        params: Sequence[Any] = (),
+    ) -> List[Tuple[Any, ...]]:
+        """
+        Run a query, on the read-only connections when they serve it.
+
+        :param name: name of the query.
+        :param params: values of its parameters.
+        :return: rows.
+        """
+        with self.timed(name) as timing:
+            rows = await self._execute(name, params)
+            timing.rows += len(rows)
+        return [tuple(row) for row in rows]
+
+    async def fetch_dicts(
+        self,
+        name: str,
+        params: Sequence[Any] = (),
+    ) -> List[Dict[str, Any]]:
+        """
+        Run a query, rows being dictionaries.
+
+        :param name: name of the query.
+        :param params: values of its parameters.
+        :return: rows by column name.
+        """
+        with self.timed(name) as timing:
+            rows = await self._execute(name, params)
+            timing.rows += len(rows)
+        return [dict(row) for row in rows]
+
+    async def _execute(self, name: str, params: Sequence[Any]) -> Sequence[Any]:
+        client = Tortoise.get_connection("default")
+        sql, values = self._queries[name], list(params)
+        if not read_pool.serves(client):
+            _, rows = await client.execute_query(sql, values)
+            return rows
+        client.log.debug("%s: %s", sql, values)
+        pool = read_pool.acquire(database_file(client))
+        async with pool as connection, connection.execute(sql, values) as cursor:
+            return list(await cursor.fetchall())
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[QueryTiming]:
+        """
+        Time a call of a query run by other means, such as a stream.
+
+        :param name: name of the query.
+        :yields: timing of the query, to add the rows read to.
+        """
+        timing = self.timings.setdefault(name, QueryTiming())
+        started = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            elapsed = time.perf_counter() - started
+            timing.calls += 1
+            timing.total_seconds += elapsed
+            timing.max_seconds = max(timing.max_seconds, elapsed)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the timings of the queries that ran.
+
+        :return: calls, rows, and total, mean and max milliseconds by name.
+        """
+        return {
+            name: {
+                "calls": timing.calls,
+                "rows": timing.rows,
+                "total_ms": timing.total_seconds * 1000,
+                "mean_ms": timing.total_seconds * 1000 / timing.calls,
+                "max_ms": timing.max_seconds * 1000,
+            }
+            for name, timing in sorted(self.timings.items())
+            if timing.calls
+        }
+
+    def reset_timings(self) -> None:
+        """Forget the timings."""
+        self.timings.clear()
+
+
+def database_file(client: BaseDBAsyncClient) -> str:
+    """
+    Get the file of the database a Tortoise connection is open on.
+
+    :param client: connection of the SQLite backend.
+    :return: file name, ``:memory:`` for an in-memory database.
+    """
+    return cast(SqliteClient, client).filename
+
+
+async def open_read_only(filename: str) -> aiosqlite.Connection:
+    """
+    Open a read-only connection to a database file.
+
+    :param filename: database file.
+    :return: aiosqlite connection, with the read PRAGMAs of the settings.
+    """
+    path = Path(os.path.realpath(filename))
+    connection = await aiosqlite.connect(f"{path.as_uri()}?mode=ro", uri=True)
+    try:
+        pragmas = settings.db_pragmas
+        for pragma in READ_PRAGMAS:
+            await connection.execute(f"PRAGMA {pragma}={pragmas[pragma]}")
+    except BaseException:
+        await connection.close()
+        raise
+    return connection
+
+
+@asynccontextmanager
+async def connect_read_only() -> AsyncIterator[Any]:
+    """
+    Open a read-only connection of its own to the database.
+
+    It only sees committed rows, and does not hold back the queries of the
+    shared connection. In-memory databases are read through the shared
+    connection instead.
+
+    :yields: aiosqlite connection.
+    """
+    client = Tortoise.get_connection("default")
+    if database_file(client) == ":memory:":
+        # Other connections would open another database
+        async with client.acquire_connection() as connection:
+            yield connection
+        return
+    connection = await open_read_only(database_file(client))
+    try:
+        yield connection
+    finally:
+        await connection.close()
+
+
+class ReadConnectionPool:
+    """
+    Read-only connections the registered queries run on.
+
+    Tortoise runs every query on one shared connection, which an upload
+    transaction holds until it commits. In WAL mode readers do not wait
+    for the writer, so the registered queries run on connections of their
+    own instead. They are opened on first use and kept for the next
+    queries, at most ``settings.db_read_pool_size`` of them, and every
+    query sees the rows committed when it starts.
+
+    Queries run inside a transaction stay on its connection, to see the
+    rows it wrote, as do the queries of an in-memory database.
+    """
+
+    def __init__(self) -> None:
+        self._idle: List[aiosqlite.Connection] = []
+        self._filename: Optional[str] = None
+        self._available: Optional[asyncio.Semaphore] = None
+
+    def serves(self, client: BaseDBAsyncClient) -> bool:
+        """
+        Check whether the queries of a client run on the pool.
+
+        :param client: connection Tortoise gives for the current context.
+        :return: whether to acquire a read-only connection.
+        """
+        return (
+            settings.db_read_pool_size > 0
+            and not isinstance(client, BaseTransactionWrapper)
+            and database_file(client) != ":memory:"
+        )
+
+    @asynccontextmanager
+    async def acquire(self, filename: str) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Borrow a connection, waiting while they are all in use.
+
+        :param filename: database file.
+        :yields: read-only connection, rows being ``sqlite3.Row``.
+        """
+        if self._available is None:
+            self._available = asyncio.Semaphore(settings.db_read_pool_size)
+        async with self._available:
+            if filename != self._filename:
+                await self._close_idle()
+                self._filename = filename
+            if self._idle:
+                connection = self._idle.pop()
+            else:
+                connection = await open_read_only(filename)
+                connection.row_factory = sqlite3.Row
+            try:
+                yield connection
+            except BaseException:
+                # A cancelled query may still be running on it
+                await connection.close()
+                raise
+            if filename == self._filename:
+                self._idle.append(connection)
+            else:
+                await connection.close()
+
+    async def close(self) -> None:
+        """Close the idle connections, others are opened on next use."""
+        await self._close_idle()
+        self._filename = None
+        self._available = None
+
+    async def _close_idle(self) -> None:
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await connection.close()
+
+
+read_pool = ReadConnectionPool()
+on_reset(read_pool.close)
+
+
+queries = QueryRegistry()
+on_reset(queries.reset_timings)
@@ -0,0 +1,279 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from tortoise import Tortoise
+
+from gobble_cube.db.dao.queries import queries
+
+# Columns of both rollup tables, the only text formatted into their statements
+ROLLUP_COLUMNS = '"revenue_cents", "quantity", "transactions"'
+
+ADD_TO_PRODUCT_DAILY_REVENUE = f"""
+    INSERT INTO "product_daily_revenue" ("product_id", "date", {ROLLUP_COLUMNS})
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT ("product_id", "date") DO UPDATE SET
+        "revenue_cents" = "revenue_cents" + excluded."revenue_cents",
+        "quantity" = "quantity" + excluded."quantity",
+        "transactions" = "transactions" + excluded."transactions"
+"""  # noqa: S608
+
+ADD_TO_DAILY_REVENUE = f"""
+    INSERT INTO "daily_revenue" ("date", {ROLLUP_COLUMNS})
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT ("date") DO UPDATE SET
+        "revenue_cents" = "revenue_cents" + excluded."revenue_cents",
+        "quantity" = "quantity" + excluded."quantity",
+        "transactions" = "transactions" + excluded."transactions"
+"""  # noqa: S608
+
+AGGREGATE_SALES_BY_PRODUCT_AND_DAY = """
+    SELECT product_id, date, SUM(revenue), SUM(quantity), COUNT(*)
+    FROM sales_transactions
+"""
+
+AGGREGATE_PRODUCT_DAILY_REVENUE_BY_DAY = """
+    SELECT date, SUM(revenue_cents), SUM(quantity), SUM(transactions)
+    FROM product_daily_revenue
+"""
+
+REVENUE_CENTS_FOR_PERIOD = queries.register(
+    "revenue_cents_for_period",
+    'SELECT SUM("revenue_cents") FROM "daily_revenue" WHERE "date" BETWEEN ? AND ?',
+)
+
+DAILY_REVENUE = queries.register(
+    "daily_revenue",
+    'SELECT "date", "revenue_cents", "transactions" FROM "daily_revenue" '
+    'ORDER BY "date"',
+    scans=["daily_revenue"],
+)
+
+# Days are given as a single JSON array, so the text is fixed
+DAILY_REVENUE_OF_DAYS = queries.register(
+    "daily_revenue_of_days",
+    'SELECT "date", "revenue_cents", "transactions" FROM "daily_revenue" '
+    'WHERE "date" IN (SELECT value FROM json_each(?)) ORDER BY "date"',
+)
+
+PRODUCT_DAILY_REVENUE_FOR_PERIOD = queries.register(
+    "product_daily_revenue_for_period",
+    'SELECT "date", "revenue_cents", "transactions" FROM "product_daily_revenue" '
+    'WHERE "product_id" = ? AND "date" BETWEEN ? AND ? ORDER BY "date"',
+)
+
+CATEGORY_DAILY_REVENUE_FOR_PERIOD = queries.register(
+    "category_daily_revenue_for_period",
+    """
+    SELECT date, SUM(revenue_cents), SUM(transactions)
+    FROM product_daily_revenue
+    WHERE product_id IN (
+        SELECT product_id FROM product_categories WHERE category_id = ?
+    ) AND date BETWEEN ? AND ?
+    GROUP BY date
+    ORDER BY date
+    """,
+)
+
+SalesRollupRow = Tuple[int, str, int, int, int]
+
+
+async def add_to_sales_rollups(rows: Sequence[SalesRollupRow]) -> None:
+    """
+    Add aggregated sales transactions to the daily rollups.
+
+    :param rows: product id, date, revenue in cents, quantity and number
+        of transactions, at most one row per product and day.
+    """
+
+    if not rows:
+        return
+
+    days: Dict[str, List[int]] = {}
+    for _, day, revenue_cents, quantity, transactions in rows:
+        totals = days.setdefault(day, [0, 0, 0])
+        totals[0] += revenue_cents
+        totals[1] += quantity
+        totals[2] += transactions
+
+    connection = Tortoise.get_connection("default")
+    await connection.execute_many(
+        ADD_TO_PRODUCT_DAILY_REVENUE,
+        [list(row) for row in rows],
+    )
+    await connection.execute_many(
+        ADD_TO_DAILY_REVENUE,
+        [[day, *totals] for day, totals in days.items()],
+    )
+
+
+async def refresh_sales_rollups(keys: Sequence[Tuple[int, str]]) -> None:
+    """
+    Recompute the rollups of some products and days from the raw rows.
+
+    Used when rows were deleted, for example by an upload replacing them.
+
+    :param keys: product id and date pairs.
+    """
+
+    if not keys:
+        return
+
+    key_params = [list(key) for key in keys]
+    days = [[day] for day in {day for _, day in keys}]
+    connection = Tortoise.get_connection("default")
+    await connection.execute_many(
+        'DELETE FROM "product_daily_revenue" WHERE "product_id" = ? AND "date" = ?',
+        key_params,
+    )
+    await connection.execute_many(
+        f'INSERT INTO "product_daily_revenue" ("product_id", "date", {ROLLUP_COLUMNS})'
+        f"{AGGREGATE_SALES_BY_PRODUCT_AND_DAY}"
+        "WHERE product_id = ? AND date = ? GROUP BY product_id, date",
+        key_params,
+    )
+    await connection.execute_many('DELETE FROM "daily_revenue" WHERE "date" = ?', days)
+    await connection.execute_many(
+        f'INSERT INTO "daily_revenue" ("date", {ROLLUP_COLUMNS})'
+        f"{AGGREGATE_PRODUCT_DAILY_REVENUE_BY_DAY}"
+        "WHERE date = ? GROUP BY date",
+        days,
+    )
+
+
+async def rebuild_sales_rollups() -> None:
+    """
+    Recompute both rollups from the whole sales transactions table.
+
+    Run it in a transaction, so the rollups are never seen half built.
+    """
+
+    connection = Tortoise.get_connection("default")
+    await connection.execute_query('DELETE FROM "product_daily_revenue"')
+    await connection.execute_query(
+        f'INSERT INTO "product_daily_revenue" ("product_id", "date", {ROLLUP_COLUMNS})'
+        f"{AGGREGATE_SALES_BY_PRODUCT_AND_DAY} GROUP BY product_id, date",
+    )
+    await connection.execute_query('DELETE FROM "daily_revenue"')
+    await connection.execute_query(
+        f'INSERT INTO "daily_revenue" ("date", {ROLLUP_COLUMNS})'
+        f"{AGGREGATE_PRODUCT_DAILY_REVENUE_BY_DAY} GROUP BY date",
+    )
+
+
+async def rollups_are_missing() -> bool:
+    """
+    Check whether sales transactions were stored without their rollups.
+
+    This is the case of databases created before the rollups existed.
+
+    :return: whether the rollups must be rebuilt.
+    """
+
+    _, rows = await Tortoise.get_connection("default").execute_query(
+        'SELECT EXISTS (SELECT 1 FROM "sales_transactions") '
+        'AND NOT EXISTS (SELECT 1 FROM "daily_revenue")',
+    )
+    return bool(rows[0][0])
+
+
+async def find_sales_rollup_differences() -> List[Dict[str, Any]]:
+    """
+    Compare the rollups with the raw sales transactions.
+
+    Rows of the rollups that are missing, extra or different show up
+    twice: once as ``expected`` with the values computed from the raw
+    table, once as ``stored`` with the values of the rollup.
+
+    :return: differing rows, empty when the rollups are consistent.
+    """
+
+    product_daily = (
+        f"{AGGREGATE_SALES_BY_PRODUCT_AND_DAY} GROUP BY product_id, date",
+        f"SELECT product_id, date, {ROLLUP_COLUMNS} FROM product_daily_revenue",  # noqa: S608
+    )
+    daily = (
+        """
+        SELECT date, SUM(revenue), SUM(quantity), COUNT(*)
+        FROM sales_transactions GROUP BY date
+        """,
+        f"SELECT date, {ROLLUP_COLUMNS} FROM daily_revenue",  # noqa: S608
+    )
+
+    connection = Tortoise.get_connection("default")
+    differences: List[Dict[str, Any]] = []
+    for table, (expected, stored) in (
+        ("product_daily_revenue", product_daily),
+        ("daily_revenue", daily),
+    ):
+        for side, query in (
+            ("expected", f"{expected} EXCEPT {stored}"),
+            ("stored", f"{stored} EXCEPT {expected}"),
+        ):
+            _, rows = await connection.execute_query(query)
+            differences.extend(
+                {"table": table, "side": side, "row": list(row)} for row in rows
+            )
+    return differences
+
+
+async def fetch_revenue_cents_for_period(
+    start_date: str,
+    end_date: str,
+) -> Optional[int]:
+    """
+    Sum the daily revenue rollup over a period.
+
+    :param start_date: first day.
+    :param end_date: last day.
+    :return: revenue in cents, None when no transaction was made.
+    """
+
+    rows = await queries.fetch(REVENUE_CENTS_FOR_PERIOD, [start_date, end_date])
+    return rows[0][0]
+
+
+async def fetch_daily_revenue(
+    days: Optional[Iterable[str]] = None,
+) -> List[Tuple[str, int, int]]:
+    """
+    Read the daily revenue rollup.
+
+    :param days: days to read, every day by default.
+    :return: date, revenue in cents and number of transactions, by date.
+    """
+
+    if days is None:
+        rows = await queries.fetch(DAILY_REVENUE)
+    else:
+        rows = await queries.fetch(DAILY_REVENUE_OF_DAYS, [json.dumps(list(days))])
+    return rows
+
+
+async def fetch_product_daily_revenue_for_period(
+    start_date: str,
+    end_date: str,
+    product_id: Optional[int] = None,
+    category_id: Optional[int] = None,
+) -> List[Tuple[str, int, int]]:
+    """
+    Read the product rollup of a product or of the products of a category.
+
+    :param start_date: first day.
+    :param end_date: last day.
+    :param product_id: product to read.
+    :param category_id: category to read, when no product is given.
+    :return: date, revenue in cents and number of transactions, by date,
+        only for days with sales.
+    """
+
+    if product_id is not None:
+        rows = await queries.fetch(
+            PRODUCT_DAILY_REVENUE_FOR_PERIOD,
+            [product_id, start_date, end_date],
+        )
+    else:
+        rows = await queries.fetch(
+            CATEGORY_DAILY_REVENUE_FOR_PERIOD,
+            [category_id, start_date, end_date],
+        )
+    return rows
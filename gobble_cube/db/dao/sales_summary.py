@@ -0,0 +1,329 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from tortoise import Tortoise
+
+from gobble_cube.db.dao.queries import queries
+
+# Columns of the sketches, statements only format in such constants, never values
+SKETCH_COLUMNS = (
+    '"date", "transactions", "products", "categories", "revenue", "quantity", '
+    '"top_products", "top_categories"'
+)
+
+SAVE_DAILY_SALES_SKETCH = f"""
+    INSERT INTO "daily_sales_sketch" ({SKETCH_COLUMNS})
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT ("date") DO UPDATE SET
+        "transactions" = excluded."transactions",
+        "products" = excluded."products",
+        "categories" = excluded."categories",
+        "revenue" = excluded."revenue",
+        "quantity" = excluded."quantity",
+        "top_products" = excluded."top_products",
+        "top_categories" = excluded."top_categories"
+"""  # noqa: S608
+
+DAILY_SALES_SKETCHES = queries.register(
+    "daily_sales_sketches",
+    f'SELECT {SKETCH_COLUMNS} FROM "daily_sales_sketch" ORDER BY "date"',  # noqa: S608
+    scans=["daily_sales_sketch"],
+)
+
+DAILY_SALES_SKETCHES_OF_DAYS = queries.register(
+    "daily_sales_sketches_of_days",
+    f'SELECT {SKETCH_COLUMNS} FROM "daily_sales_sketch" '  # noqa: S608
+    'WHERE "date" IN (SELECT value FROM json_each(?)) ORDER BY "date"',
+)
+
+SALES_OF_DAYS = queries.register(
+    "sales_of_days",
+    """
+    SELECT date, revenue, quantity FROM sales_transactions
+    WHERE date IN (SELECT value FROM json_each(?))
+    """,
+)
+
+# Products and categories sold on some days, from the product rollup
+PRODUCTS_OF_DAYS = queries.register(
+    "products_of_days",
+    """
+    SELECT pdr.date, pdr.product_id, pc.category_id, pdr.revenue_cents
+    FROM product_daily_revenue pdr
+    LEFT JOIN product_categories pc ON pc.product_id = pdr.product_id
+    WHERE pdr.date IN (SELECT value FROM json_each(?))
+    """,
+)
+
+DAYS_OF_PRODUCTS = queries.register(
+    "days_of_products",
+    "SELECT DISTINCT date FROM product_daily_revenue "
+    "WHERE product_id IN (SELECT value FROM json_each(?))",
+)
+
+SALES_COUNTS_FOR_PERIOD = queries.register(
+    "sales_counts_for_period",
+    """
+    SELECT
+        COUNT(*),
+        COUNT(DISTINCT st.product_id),
+        (
+            SELECT COUNT(DISTINCT pc.category_id)
+            FROM sales_transactions s
+            JOIN product_categories pc ON pc.product_id = s.product_id
+            WHERE s.date BETWEEN ? AND ?
+        )
+    FROM sales_transactions st
+    WHERE st.date BETWEEN ? AND ?
+    """,
+)
+
+# Value of a given rank in a period, for quantiles
+RANKED_SALES_VALUE_FOR_PERIOD = {
+    column: queries.register(
+        f"ranked_{column}_for_period",
+        f"""
+        SELECT {column} AS value FROM sales_transactions
+        WHERE date BETWEEN ? AND ?
+        ORDER BY value
+        LIMIT 1 OFFSET ?
+        """,  # noqa: S608
+    )
+    for column in ("revenue", "quantity")
+}
+
+# Revenue of some products, to rank them exactly
+PRODUCT_REVENUE_FOR_PERIOD = queries.register(
+    "product_revenue_for_period",
+    """
+    SELECT product_id, SUM(revenue_cents) FROM product_daily_revenue
+    WHERE product_id IN (SELECT value FROM json_each(?))
+        AND date BETWEEN ? AND ?
+    GROUP BY product_id
+    """,
+)
+
+# Categories are ranked from the revenue of every product, without a join
+REVENUE_OF_EVERY_PRODUCT_FOR_PERIOD = queries.register(
+    "revenue_of_every_product_for_period",
+    """
+    SELECT product_id, SUM(revenue_cents) FROM product_daily_revenue
+    WHERE date BETWEEN ? AND ?
+    GROUP BY product_id
+    """,
+    scans=["product_daily_revenue"],
+)
+
+TOP_PRODUCTS_FOR_PERIOD = queries.register(
+    "top_products_for_period",
+    """
+    SELECT product_id, SUM(revenue_cents) AS revenue FROM product_daily_revenue
+    WHERE date BETWEEN ? AND ?
+    GROUP BY product_id
+    ORDER BY revenue DESC, product_id
+    LIMIT ?
+    """,
+    scans=["product_daily_revenue"],
+)
+
+DailySalesSketchRow = Tuple[str, int, bytes, bytes, bytes, bytes, bytes, bytes]
+
+
+async def fetch_daily_sales_sketches(
+    days: Optional[Iterable[str]] = None,
+) -> List[DailySalesSketchRow]:
+    """
+    Read the daily sales sketches.
+
+    :param days: days to read, every day by default.
+    :return: date, number of transactions and serialized sketches of
+        products, categories, revenue and quantity, by date.
+    """
+
+    if days is None:
+        rows = await queries.fetch(DAILY_SALES_SKETCHES)
+    else:
+        rows = await queries.fetch(
+            DAILY_SALES_SKETCHES_OF_DAYS,
+            [json.dumps(list(days))],
+        )
+    return rows
+
+
+async def save_daily_sales_sketches(
+    rows: Sequence[DailySalesSketchRow],
+    empty_days: Sequence[str] = (),
+) -> None:
+    """
+    Write the sketches of some days.
+
+    :param rows: date, number of transactions and serialized sketches.
+    :param empty_days: days left without transaction, their row is deleted.
+    """
+
+    connection = Tortoise.get_connection("default")
+    if rows:
+        await connection.execute_many(
+            SAVE_DAILY_SALES_SKETCH,
+            [list(row) for row in rows],
+        )
+    if empty_days:
+        await connection.execute_query(
+            'DELETE FROM "daily_sales_sketch" '
+            'WHERE "date" IN (SELECT value FROM json_each(?))',
+            [json.dumps(list(empty_days))],
+        )
+
+
+async def delete_daily_sales_sketches() -> None:
+    """Delete every daily sales sketch, before rebuilding them."""
+
+    await Tortoise.get_connection("default").execute_query(
+        'DELETE FROM "daily_sales_sketch"',
+    )
+
+
+async def fetch_sales_of_days(days: Iterable[str]) -> List[Tuple[str, int, int]]:
+    """
+    Read the sales transactions of some days.
+
+    :param days: days.
+    :return: date, revenue in cents and quantity of every transaction.
+    """
+
+    return await queries.fetch(SALES_OF_DAYS, [json.dumps(list(days))])
+
+
+async def fetch_products_of_days(
+    days: Iterable[str],
+) -> List[Tuple[str, int, Optional[int], int]]:
+    """
+    Read the products sold on some days, with their categories.
+
+    :param days: days.
+    :return: date, product id, category id, None for a product without
+        category, and revenue in cents of the product that day, a row per
+        category of a product.
+    """
+
+    return await queries.fetch(PRODUCTS_OF_DAYS, [json.dumps(list(days))])
+
+
+async def fetch_days_of_products(product_ids: Iterable[int]) -> List[str]:
+    """
+    Read the days some products were sold.
+
+    :param product_ids: product ids.
+    :return: days.
+    """
+
+    rows = await queries.fetch(DAYS_OF_PRODUCTS, [json.dumps(list(product_ids))])
+    return [str(row[0]) for row in rows]
+
+
+async def sales_sketches_are_missing() -> bool:
+    """
+    Check whether sales transactions were stored without their sketches.
+
+    This is the case of databases created before the sketches existed.
+
+    :return: whether the sketches must be rebuilt.
+    """
+
+    _, rows = await Tortoise.get_connection("default").execute_query(
+        'SELECT EXISTS (SELECT 1 FROM "sales_transactions") '
+        'AND NOT EXISTS (SELECT 1 FROM "daily_sales_sketch")',
+    )
+    return bool(rows[0][0])
+
+
+async def fetch_sales_counts_for_period(
+    start_date: str,
+    end_date: str,
+) -> Tuple[int, int, int]:
+    """
+    Count the transactions of a period and their distinct products and categories.
+
+    :param start_date: first day.
+    :param end_date: last day.
+    :return: transactions, products and categories.
+    """
+
+    # The period is given to the subquery first
+    rows = await queries.fetch(
+        SALES_COUNTS_FOR_PERIOD,
+        [start_date, end_date, start_date, end_date],
+    )
+    return rows[0]
+
+
+async def fetch_ranked_sales_value(
+    column: str,
+    start_date: str,
+    end_date: str,
+    rank: int,
+) -> Any:
+    """
+    Get the value of a given rank among the transactions of a period.
+
+    :param column: ``revenue``, in cents, or ``quantity``.
+    :param start_date: first day.
+    :param end_date: last day.
+    :param rank: rank from 1, in increasing order.
+    :return: value, None if there are fewer transactions.
+    """
+
+    rows = await queries.fetch(
+        RANKED_SALES_VALUE_FOR_PERIOD[column],
+        [start_date, end_date, rank - 1],
+    )
+    return rows[0][0] if rows else None
+
+
+async def fetch_product_revenue_for_period(
+    start_date: str,
+    end_date: str,
+    product_ids: Optional[Iterable[int]] = None,
+) -> Dict[int, int]:
+    """
+    Sum the revenue of products over a period.
+
+    :param start_date: first day.
+    :param end_date: last day.
+    :param product_ids: products to sum, every product by default.
+    :return: revenue in cents by product id, products without sales are
+        left out.
+    """
+
+    if product_ids is None:
+        rows = await queries.fetch(
+            REVENUE_OF_EVERY_PRODUCT_FOR_PERIOD,
+            [start_date, end_date],
+        )
+    else:
+        rows = await queries.fetch(
+            PRODUCT_REVENUE_FOR_PERIOD,
+            [json.dumps(list(product_ids)), start_date, end_date],
+        )
+    return {row[0]: row[1] for row in rows}
+
+
+async def fetch_top_products_for_period(
+    start_date: str,
+    end_date: str,
+    limit: int,
+) -> List[Tuple[int, int]]:
+    """
+    Rank every product by its revenue over a period.
+
+    :param start_date: first day.
+    :param end_date: last day.
+    :param limit: number of products.
+    :return: product id and revenue in cents, largest revenue first, then
+        by id.
+    """
+
+    return await queries.fetch(
+        TOP_PRODUCTS_FOR_PERIOD,
+        [start_date, end_date, limit],
+    )
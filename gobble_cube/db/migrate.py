@@ -0,0 +1,68 @@
+import importlib
+import logging
+import pkgutil
+from typing import List, Tuple
+
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from gobble_cube.db import migrations
+
+logger = logging.getLogger(__name__)
+
+# Names of the migrations applied to the database
+MIGRATIONS_TABLE = "schema_migrations"
+
+
+def list_migrations() -> List[Tuple[str, str]]:
+    """
+    List the migrations of ``gobble_cube.db.migrations``.
+
+    A migration is a module of the package with an ``upgrade`` coroutine,
+    named after its number so that names sort in the order to apply them.
+
+    :return: name and module path of every migration, in order.
+    """
+    return sorted(
+        (module.name, f"{migrations.__name__}.{module.name}")
+        for module in pkgutil.iter_modules(migrations.__path__)
+    )
+
+
+async def apply_migrations() -> List[str]:
+    """
+    Apply the migrations the database is missing.
+
+    Tables and indexes of the models are created by ``generate_schemas``,
+    which never changes an existing table or drops an index. Migrations do
+    what it cannot for databases created by earlier versions. Each one is
+    applied in a transaction with the row recording it, and must leave a
+    database freshly created from the models unchanged.
+
+    :return: names of the migrations applied.
+    """
+    connection = Tortoise.get_connection("default")
+    await connection.execute_script(
+        f'CREATE TABLE IF NOT EXISTS "{MIGRATIONS_TABLE}" ('
+        '"name" VARCHAR(255) NOT NULL PRIMARY KEY, '
+        '"applied_at" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)',
+    )
+    _, rows = await connection.execute_query(
+        f'SELECT "name" FROM "{MIGRATIONS_TABLE}"',  # noqa: S608
+    )
+    applied = {row[0] for row in rows}
+
+    names = []
+    for name, path in list_migrations():
+        if name in applied:
+            continue
+        logger.info(f"Applying migration {name}")
+        module = importlib.import_module(path)
+        async with in_transaction() as transaction:
+            await module.upgrade(transaction)
+            await transaction.execute_query(
+                f'INSERT INTO "{MIGRATIONS_TABLE}" ("name") VALUES (?)',  # noqa: S608
+                [name],
+            )
+        names.append(name)
+    return names
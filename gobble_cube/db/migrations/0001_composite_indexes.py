@@ -0,0 +1,26 @@
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+# Names are the ones generate_schemas gives to the indexes of the models
+UPGRADE = [
+    'DROP INDEX IF EXISTS "idx_product_cat_product_d5079d"',
+    'CREATE INDEX IF NOT EXISTS "idx_product_cat_product_01e387" '
+    'ON "product_categories" ("product_id", "category_id")',
+    'CREATE INDEX IF NOT EXISTS "idx_product_cat_categor_0b497f" '
+    'ON "product_categories" ("category_id", "product_id")',
+    'CREATE INDEX IF NOT EXISTS "idx_sales_trans_date_427588" '
+    'ON "sales_transactions" ("date")',
+    'CREATE INDEX IF NOT EXISTS "idx_category_sh_date_ea1fd0" '
+    'ON "category_shares" ("date", "product_id", "market_share")',
+    'CREATE INDEX IF NOT EXISTS "idx_category_da_date_e9a7fc" '
+    'ON "category_daily_share" ("date")',
+]
+
+
+async def upgrade(connection: BaseDBAsyncClient) -> None:
+    """
+    Index the date ranges and the links between products and categories.
+
+    :param connection: connection of the migration transaction.
+    """
+    for statement in UPGRADE:
+        await connection.execute_script(statement)
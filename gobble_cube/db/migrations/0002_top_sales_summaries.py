@@ -0,0 +1,27 @@
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+# Heavy hitter summaries added to the daily sales sketches
+COLUMNS = ["top_products", "top_categories"]
+
+
+async def upgrade(connection: BaseDBAsyncClient) -> None:
+    """
+    Add the products and categories of largest revenue to the sales sketches.
+
+    Sketches stored without them are deleted, and built again from the
+    sales transactions at startup.
+
+    :param connection: connection of the migration transaction.
+    """
+    _, rows = await connection.execute_query(
+        "SELECT name FROM pragma_table_info('daily_sales_sketch')",
+    )
+    existing = {row[0] for row in rows}
+    missing = [column for column in COLUMNS if column not in existing]
+    for column in missing:
+        await connection.execute_script(
+            f'ALTER TABLE "daily_sales_sketch" '
+            f"ADD COLUMN \"{column}\" BLOB NOT NULL DEFAULT x''",
+        )
+    if missing:
+        await connection.execute_script('DELETE FROM "daily_sales_sketch"')
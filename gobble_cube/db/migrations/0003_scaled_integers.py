@@ -0,0 +1,66 @@
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+# Table, column stored as decimal text before, the other columns, then the
+# columns and indexes generate_schemas gives the table now that it is integer
+TABLES = [
+    (
+        "sales_transactions",
+        "revenue",
+        ["id", "date", "quantity", "product_id"],
+        '"id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, '
+        '"date" DATE NOT NULL, '
+        '"quantity" INT NOT NULL, '
+        '"revenue" BIGINT NOT NULL, '
+        '"product_id" INT NOT NULL REFERENCES "products" ("id") ON DELETE CASCADE',
+        [
+            'CREATE INDEX "idx_sales_trans_product_692f6b" '
+            'ON "sales_transactions" ("product_id", "date")',
+            'CREATE INDEX "idx_sales_trans_date_427588" '
+            'ON "sales_transactions" ("date")',
+        ],
+    ),
+    (
+        "category_shares",
+        "market_share",
+        ["id", "date", "product_id"],
+        '"id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, '
+        '"date" DATE NOT NULL, '
+        '"market_share" INT NOT NULL, '
+        '"product_id" INT NOT NULL REFERENCES "products" ("id") ON DELETE CASCADE',
+        [
+            'CREATE INDEX "idx_category_sh_product_40797b" '
+            'ON "category_shares" ("product_id", "date")',
+            'CREATE INDEX "idx_category_sh_date_ea1fd0" '
+            'ON "category_shares" ("date", "product_id", "market_share")',
+        ],
+    ),
+]
+
+
+async def upgrade(connection: BaseDBAsyncClient) -> None:
+    """
+    Store revenues in cents and market shares in basis points.
+
+    SQLite can not change the type of a column, so a table where it is still
+    text is copied to a new one, the values multiplied by 100. Stored text
+    already had two decimal places, rounding only drops the float error.
+
+    :param connection: connection of the migration transaction.
+    """
+    for table, column, others, columns, indexes in TABLES:
+        _, rows = await connection.execute_query(
+            "SELECT type FROM pragma_table_info(?) WHERE name = ?",
+            [table, column],
+        )
+        if not rows or "INT" in rows[0][0].upper():
+            continue
+        copied = ", ".join(f'"{name}"' for name in others)
+        await connection.execute_script(
+            f'CREATE TABLE "{table}_new" ({columns});'
+            f'INSERT INTO "{table}_new" ({copied}, "{column}") '
+            f'SELECT {copied}, CAST(ROUND("{column}" * 100) AS INTEGER) '
+            f'FROM "{table}";'
+            f'DROP TABLE "{table}";'
+            f'ALTER TABLE "{table}_new" RENAME TO "{table}";'
+            + "".join(f"{index};" for index in indexes),
+        )
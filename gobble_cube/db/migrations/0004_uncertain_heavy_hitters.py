@@ -0,0 +1,14 @@
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+
+async def upgrade(connection: BaseDBAsyncClient) -> None:
+    """
+    Record in the heavy hitter summaries whether negative weights were counted.
+
+    Summaries stored without the flag can not be read any more, so the
+    sketches are deleted, and built again from the sales transactions at
+    startup.
+
+    :param connection: connection of the migration transaction.
+    """
+    await connection.execute_script('DELETE FROM "daily_sales_sketch"')
@@ -0,0 +1,40 @@
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+# Name generate_schemas gives to the unique constraint of the model
+UNIQUE_INDEX = (
+    'CREATE UNIQUE INDEX "uid_product_cat_product_01e387" '
+    'ON "product_categories" ("product_id", "category_id")'
+)
+
+
+async def upgrade(connection: BaseDBAsyncClient) -> None:
+    """
+    Store every link between a product and a category once.
+
+    Only a plain index covered the links, so uploading them again stored
+    them once more. Duplicates are deleted, keeping the first, and the
+    plain index is replaced by a unique one. Summaries counting a product
+    once per link are deleted with them, and built again at startup.
+
+    :param connection: connection of the migration transaction.
+    """
+    deleted, _ = await connection.execute_query(
+        'DELETE FROM "product_categories" WHERE "id" NOT IN ('
+        'SELECT MIN("id") FROM "product_categories" '
+        'GROUP BY "product_id", "category_id")',
+    )
+    if deleted:
+        await connection.execute_script(
+            'DELETE FROM "category_daily_share";DELETE FROM "daily_sales_sketch";',
+        )
+
+    await connection.execute_script(
+        'DROP INDEX IF EXISTS "idx_product_cat_product_01e387"',
+    )
+    # Tables created from the models have the unique constraint already
+    _, rows = await connection.execute_query(
+        "SELECT 1 FROM pragma_index_list('product_categories') "
+        "WHERE \"unique\" AND origin = 'u'",
+    )
+    if not rows:
+        await connection.execute_script(UNIQUE_INDEX)
@@ -1,18 +1,33 @@
 """Models for gobble_cube."""
 
 from gobble_cube.db.models.models import (
-    Product,
     Category,
-    SalesTransaction,
+    CategoryDailyShare,
     CategoryShare,
+    DailyRevenue,
+    DailySalesSketch,
+    DataVersion,
+    IngestJobRecord,
+    Product,
     ProductCategory,
+    ProductDailyRevenue,
+    SalesTransaction,
+    UploadFingerprint,
+    table_name,
 )
 
-
 __all__ = [
     "Product",
     "Category",
     "SalesTransaction",
     "CategoryShare",
     "ProductCategory",
+    "UploadFingerprint",
+    "DailyRevenue",
+    "ProductDailyRevenue",
+    "CategoryDailyShare",
+    "DailySalesSketch",
+    "DataVersion",
+    "IngestJobRecord",
+    "table_name",
 ]
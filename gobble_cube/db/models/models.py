@@ -1,3 +1,5 @@
+from typing import Type
+
 from tortoise import fields, models
 
 
@@ -27,6 +29,10 @@ class ProductCategory(models.Model):
 
     class Meta:
         table = "product_categories"
+        # Natural key used to replace the categories of an upload, and the
+        # joins from products to categories and back, read from the indexes
+        unique_together = (("product", "category"),)
+        indexes = (("category_id", "product_id"),)
 
 
 class SalesTransaction(models.Model):
@@ -36,17 +42,167 @@ class SalesTransaction(models.Model):
         "models.Product", related_name="sales_transactions"
     )
     quantity = fields.IntField()
-    revenue = fields.DecimalField(max_digits=10, decimal_places=2)
+    # In cents, summed exactly by SQLite and turned into decimals by the API
+    revenue = fields.BigIntField()
 
     class Meta:
         table = "sales_transactions"
+        # Natural key used to replace the rows of an upload, and periods
+        indexes = (("product_id", "date"), ("date",))
+
+
+class DailyRevenue(models.Model):
+    """Sales transactions rolled up by day, revenue is in cents."""
+
+    id = fields.IntField(pk=True)
+    date = fields.DateField(unique=True)
+    revenue_cents = fields.BigIntField()
+    quantity = fields.BigIntField()
+    transactions = fields.IntField()
+
+    class Meta:
+        table = "daily_revenue"
+
+
+class ProductDailyRevenue(models.Model):
+    """Sales transactions rolled up by product and day, revenue is in cents."""
+
+    id = fields.IntField(pk=True)
+    date = fields.DateField()
+    product: fields.ForeignKeyRelation[Product] = fields.ForeignKeyField(
+        "models.Product",
+        related_name="daily_revenue",
+    )
+    revenue_cents = fields.BigIntField()
+    quantity = fields.BigIntField()
+    transactions = fields.IntField()
+
+    class Meta:
+        table = "product_daily_revenue"
+        unique_together = (("product", "date"),)
+        # Days are refreshed as a whole when rows are replaced
+        indexes = (("date",),)
 
 
 class CategoryShare(models.Model):
     id = fields.IntField(pk=True)
     date = fields.DateField()
     product = fields.ForeignKeyField("models.Product", related_name="category_shares")
-    market_share = fields.DecimalField(max_digits=5, decimal_places=2)
+    # In basis points, a hundredth of a percent
+    market_share = fields.IntField()
 
     class Meta:
         table = "category_shares"
+        # Natural key used to replace the rows of an upload, and periods
+        # read from the index alone
+        indexes = (("product_id", "date"), ("date", "product_id", "market_share"))
+
+
+class CategoryDailyShare(models.Model):
+    """Lowest and highest market share of a category by day, in basis points."""
+
+    id = fields.IntField(pk=True)
+    category: fields.ForeignKeyRelation[Category] = fields.ForeignKeyField(
+        "models.Category",
+        related_name="daily_shares",
+    )
+    date = fields.DateField()
+    min_share_bp = fields.IntField()
+    max_share_bp = fields.IntField()
+
+    class Meta:
+        table = "category_daily_share"
+        unique_together = (("category", "date"),)
+        indexes = (("date",),)
+
+
+class DailySalesSketch(models.Model):
+    """
+    Mergeable sketches of the sales transactions of a day.
+
+    Distinct products and categories are HyperLogLog sketches, revenue in
+    cents and quantity are t-digests, and the products and categories of
+    largest revenue heavy hitter summaries, see
+    ``gobble_cube.services.sketches``.
+    """
+
+    id = fields.IntField(pk=True)
+    date = fields.DateField(unique=True)
+    transactions = fields.IntField()
+    products = fields.BinaryField()
+    categories = fields.BinaryField()
+    revenue = fields.BinaryField()
+    quantity = fields.BinaryField()
+    top_products = fields.BinaryField()
+    top_categories = fields.BinaryField()
+
+    class Meta:
+        table = "daily_sales_sketch"
+
+
+class UploadFingerprint(models.Model):
+    """Digest of the content of an uploaded file, to skip it when sent again."""
+
+    id = fields.IntField(pk=True)
+    kind = fields.CharField(max_length=32)
+    digest = fields.CharField(max_length=64)
+    rows = fields.IntField()
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "upload_fingerprints"
+        unique_together = (("kind", "digest"),)
+
+
+class DataVersion(models.Model):
+    """
+    Version of the rows of a table, shared by every process.
+
+    Every transaction writing to the table bumps ``version``, and sets
+    ``rewritten`` to the new version when it deleted or changed rows
+    rather than only adding some, see ``gobble_cube.db.dao.data_versions``.
+    """
+
+    name = fields.CharField(max_length=64, pk=True)
+    version = fields.BigIntField(default=0)
+    rewritten = fields.BigIntField(default=0)
+
+    class Meta:
+        table = "data_versions"
+
+
+class IngestJobRecord(models.Model):
+    """
+    State of a background upload, shared by every process.
+
+    Times are Unix timestamps. ``worker`` names the process running the
+    job, so the jobs of a process which died can be queued again, see
+    ``gobble_cube.services.jobs``.
+    """
+
+    id = fields.CharField(max_length=32, pk=True)
+    kind = fields.CharField(max_length=32)
+    mode = fields.CharField(max_length=16)
+    fingerprint = fields.CharField(max_length=64, null=True)
+    status = fields.CharField(max_length=16)
+    rows_processed = fields.BigIntField(default=0)
+    error = fields.TextField(null=True)
+    worker = fields.CharField(max_length=32, null=True)
+    created_at = fields.FloatField()
+    started_at = fields.FloatField(null=True)
+    finished_at = fields.FloatField(null=True)
+
+    class Meta:
+        table = "ingest_jobs"
+        # Oldest jobs of a status, claimed by the workers
+        indexes = (("status", "created_at"),)
+
+
+def table_name(model: Type[models.Model]) -> str:
+    """
+    Get the name of the table of a model.
+
+    :param model: model class.
+    :return: table name.
+    """
+    return model._meta.db_table  # noqa: SLF001
@@ -0,0 +1,56 @@
+import sqlite3
+from typing import Any, cast
+
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseTransactionWrapper, TransactionContext
+from tortoise.backends.sqlite.client import SqliteClient, TransactionWrapper
+from tortoise.exceptions import TransactionManagementError
+from tortoise.transactions import in_transaction
+
+
+class ImmediateTransactionWrapper(TransactionWrapper):
+    """SQLite transaction taking the write lock of the database as it begins."""
+
+    async def start(self) -> None:
+        """Begin the transaction, waiting up to the busy timeout for other writers."""
+        try:
+            await self._connection.commit()
+            await self._connection.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as exc:
+            raise TransactionManagementError(exc) from exc
+
+
+class ImmediateTransactionContext(TransactionContext[ImmediateTransactionWrapper]):
+    """Context of an :class:`ImmediateTransactionWrapper`."""
+
+    async def __aenter__(self) -> ImmediateTransactionWrapper:
+        try:
+            return await super().__aenter__()
+        except TransactionManagementError:
+            # The transaction could not begin, as the database stayed locked,
+            # and Tortoise only releases the connection on exit, never reached
+            await super().__aexit__(TransactionManagementError, None, None)
+            raise
+
+
+def in_write_transaction(
+    connection_name: str = "default",
+) -> TransactionContext[Any]:
+    """
+    Start a transaction which writes, holding the write lock from its start.
+
+    A plain ``BEGIN`` only takes the lock at the first write. A transaction
+    starting with reads then fails at once with ``SQLITE_BUSY`` when another
+    process wrote in between, as its snapshot is stale, and the busy timeout
+    never applies. ``BEGIN IMMEDIATE`` waits for the other writers instead.
+    Within a transaction, a nested one is started as usual.
+
+    :param connection_name: name of the connection.
+    :return: transaction context manager.
+    """
+    connection = Tortoise.get_connection(connection_name)
+    if isinstance(connection, BaseTransactionWrapper):
+        return in_transaction(connection_name)
+    # The database is SQLite, the only one whose transactions are made here
+    wrapper = ImmediateTransactionWrapper(cast(SqliteClient, connection))
+    return ImmediateTransactionContext(wrapper)
@@ -0,0 +1,170 @@
+import asyncio
+import enum
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from gobble_cube.services.category_share import (
+    get_significant_category_shares_for_period,
+)
+from gobble_cube.services.cube import ordered
+from gobble_cube.services.result_cache import date_key
+from gobble_cube.services.service_transaction import (
+    get_sales_data_by_dimensions,
+    get_total_revenue_for_period,
+    validate_dimensions,
+)
+from gobble_cube.settings import settings
+
+
+class AnalyticsQueryKind(str, enum.Enum):
+    """Analytics endpoint a query of a batch stands for."""
+
+    # /sales-transaction/total
+    TOTAL = "total"
+    # /sales-transaction/dimentions
+    DIMENSIONS = "dimensions"
+    # /category-share/significant
+    SIGNIFICANT_CATEGORY_SHARES = "significant_category_shares"
+
+
+@dataclass(frozen=True)
+class AnalyticsQuery:
+    """A query of a batch, with the parameters of its endpoint."""
+
+    kind: AnalyticsQueryKind
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    dimensions: Tuple[str, ...] = ()
+    limit: int = 10
+
+    def validate(self) -> None:
+        """
+        Check the parameters the kind of query needs.
+
+        :raises ValueError: if a parameter is missing or invalid.
+        """
+        if self.kind == AnalyticsQueryKind.DIMENSIONS:
+            if not self.dimensions:
+                raise ValueError("Dimensions are required")
+            validate_dimensions(self.dimensions)
+        else:
+            self.period()
+
+    def period(self) -> Tuple[str, str]:
+        """
+        Get the dates of a query over a period.
+
+        :raises ValueError: if a date is missing.
+        :return: start and end dates.
+        """
+        if not self.start_date or not self.end_date:
+            raise ValueError("Start date and End date are required")
+        return self.start_date, self.end_date
+
+    def shared_key(self) -> Hashable:
+        """
+        Key of the computation the query can be answered from.
+
+        Significant category shares of a period are computed once for
+        every limit asked, the largest one, and dimensions once whatever
+        their order.
+
+        :return: key, equal for queries sharing a computation.
+        """
+        if self.kind == AnalyticsQueryKind.DIMENSIONS:
+            return self.kind, ordered(self.dimensions)
+        start_date, end_date = self.period()
+        return self.kind, date_key(start_date), date_key(end_date)
+
+
+async def run_analytics_batch(
+    batch: Sequence[AnalyticsQuery],
+) -> List[Dict[str, Any]]:
+    """
+    Answer many analytics queries at once.
+
+    Queries sharing a computation, see :meth:`AnalyticsQuery.shared_key`,
+    are grouped so it runs once, and the groups run concurrently through
+    the same services, and result cache, as the single endpoints. A query
+    failing does not fail the others.
+
+    :param batch: queries.
+    :raises ValueError: if the batch has more than
+        ``settings.analytics_batch_max_queries`` queries.
+    :return: a result per query, in order, with the fields of the response
+        of its endpoint, and the milliseconds its computation took as
+        ``elapsed_ms``, ``shared`` when other queries of the batch were
+        answered from it too.
+    """
+    if len(batch) > settings.analytics_batch_max_queries:
+        raise ValueError(
+            f"The batch has {len(batch)} queries, more than the "
+            f"{settings.analytics_batch_max_queries} allowed",
+        )
+
+    results: Dict[int, Dict[str, Any]] = {}
+    groups: Dict[Hashable, List[int]] = {}
+    for position, query in enumerate(batch):
+        try:
+            query.validate()
+        except ValueError as e:
+            results[position] = {"status": "error", "detail": str(e), "elapsed_ms": 0}
+            continue
+        groups.setdefault(query.shared_key(), []).append(position)
+
+    async def answer(positions: List[int]) -> None:
+        queries = [batch[position] for position in positions]
+        started = time.perf_counter()
+        try:
+            answers = await answer_group(queries)
+        except ValueError as e:
+            answers = [{"status": "error", "detail": str(e)}] * len(queries)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for position, result in zip(positions, answers):
+            results[position] = {
+                **result,
+                "elapsed_ms": elapsed_ms,
+                "shared": len(positions) > 1,
+            }
+
+    await asyncio.gather(*(answer(positions) for positions in groups.values()))
+    return [results[position] for position in range(len(batch))]
+
+
+async def answer_group(queries: List[AnalyticsQuery]) -> List[Dict[str, Any]]:
+    """
+    Answer queries sharing a computation.
+
+    :param queries: queries of the same shared key.
+    :raises ValueError: if the queries are invalid.
+    :return: response of the endpoint of every query.
+    """
+    first = queries[0]
+    if first.kind == AnalyticsQueryKind.TOTAL:
+        total_sales = await get_total_revenue_for_period(*first.period())
+        return [{"status": "success", "total_sales": total_sales}] * len(queries)
+
+    if first.kind == AnalyticsQueryKind.DIMENSIONS:
+        orders = [tuple(dict.fromkeys(query.dimensions)) for query in queries]
+        by_order: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        # One after the other, other orders are reordered from the cached rows
+        for order in orders:
+            if order not in by_order:
+                by_order[order] = await get_sales_data_by_dimensions(list(order))
+        return [
+            {"status": "success", "sales_by_dimensions": by_order[order]}
+            for order in orders
+        ]
+
+    # A limit of 0 or less returns every category
+    limits = [query.limit if query.limit > 0 else None for query in queries]
+    widest = 0 if None in limits else max(query.limit for query in queries)
+    changes = await get_significant_category_shares_for_period(
+        *first.period(),
+        widest,
+    )
+    return [
+        {"status": "success", "significant_category_shares": changes[:limit]}
+        for limit in limits
+    ]
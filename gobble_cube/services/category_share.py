@@ -1,51 +1,144 @@
-import csv
-from io import StringIO
-
-from tortoise.expressions import Subquery, F, Q
-from tortoise.functions import Sum
-from tortoise.transactions import in_transaction
-
-from gobble_cube.db.dao.category_share import fetch_category_share_data_for_period
-from gobble_cube.db.models import CategoryShare, Category
-
-ALLOWED_FIELDS_IN_CATEGORY_SHARE_CSV = ["market_share", "product_id", "date"]
-
-
-async def bulk_upload_category_share_from_csv(data) -> None:
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from gobble_cube.db.dao.bulk import bulk_insert
+from gobble_cube.db.dao.category_share_summary import (
+    add_to_category_daily_share,
+    fetch_categories_of_products,
+    fetch_share_changes_for_period,
+    refresh_category_daily_share,
+)
+from gobble_cube.db.dao.data_versions import bump_data_versions
+from gobble_cube.db.models import CategoryShare, ProductCategory, table_name
+from gobble_cube.db.transactions import in_write_transaction
+from gobble_cube.services.category_share_index import category_share_index
+from gobble_cube.services.category_share_summary import (
+    aggregate_category_share_batch,
+)
+from gobble_cube.services.data_versions import Versions
+from gobble_cube.services.formats import iter_upload_batches
+from gobble_cube.services.idempotency import (
+    NaturalKeyReplacer,
+    UploadMode,
+    UploadResult,
+    is_known_upload,
+    record_upload,
+)
+from gobble_cube.services.ingest import (
+    CSVSchema,
+    CSVSource,
+    ProgressCallback,
+    parse_date,
+    scaled_integer_converter,
+)
+from gobble_cube.services.result_cache import date_key, result_cache
+
+CATEGORY_SHARE_CSV_SCHEMA: CSVSchema = {
+    "market_share": scaled_integer_converter(2),
+    "product_id": int,
+    "date": parse_date,
+}
+
+ALLOWED_FIELDS_IN_CATEGORY_SHARE_CSV = list(CATEGORY_SHARE_CSV_SCHEMA)
+
+# A product has one market share per day
+CATEGORY_SHARE_NATURAL_KEY = ["product_id", "date"]
+
+
+async def bulk_upload_category_share_from_csv(
+    data: CSVSource,
+    on_progress: Optional[ProgressCallback] = None,
+    mode: UploadMode = UploadMode.APPEND,
+    fingerprint: Optional[str] = None,
+) -> UploadResult:
     """
     Upload category share from a CSV file.
 
-    :param data: data from the CSV file.
-    """
+    :param data: CSV text, or the uploaded file (CSV, gzip CSV, Parquet, Arrow).
+    :param on_progress: called with the number of rows after every batch.
+    :param mode: append the rows, or replace the stored shares
+        of the products and days in the file.
+    :param fingerprint: content hash of the file, a file already
+        uploaded with the same hash is skipped.
 
-    # Use StringIO to treat the string as a file object
-    csv_reader = csv.DictReader(StringIO(data))
+    :return: number of rows written, or whether the file was skipped.
+    """
 
-    csv_reader.fieldnames = [field.strip() for field in csv_reader.fieldnames]
+    result = UploadResult()
+    replacer = NaturalKeyReplacer(
+        CategoryShare,
+        ALLOWED_FIELDS_IN_CATEGORY_SHARE_CSV,
+        CATEGORY_SHARE_NATURAL_KEY,
+    )
+    changed_keys: Set[Tuple[int, str]] = set()
+    versions: Versions = {}
+
+    async with in_write_transaction():
+        if fingerprint and await is_known_upload("category_share", fingerprint):
+            result.duplicate = True
+            return result
+
+        async for batch in iter_upload_batches(data, CATEGORY_SHARE_CSV_SCHEMA):
+            if mode == UploadMode.REPLACE:
+                await replacer.delete_replaced(batch)
+            await bulk_insert(
+                CategoryShare,
+                ALLOWED_FIELDS_IN_CATEGORY_SHARE_CSV,
+                batch,
+            )
+            if mode == UploadMode.APPEND:
+                summary_rows = aggregate_category_share_batch(batch)
+                await add_to_category_daily_share(summary_rows)
+                changed_keys.update((row[0], row[1]) for row in summary_rows)
+            result.rows += len(batch)
+            if on_progress:
+                on_progress(len(batch))
+
+        if mode == UploadMode.REPLACE:
+            # Replaced shares are gone, their days are summed up again
+            await refresh_category_daily_share(list(replacer.replaced))
+        if fingerprint:
+            await record_upload("category_share", fingerprint, result.rows)
+        if result.rows:
+            versions = await bump_data_versions(
+                [table_name(CategoryShare)],
+                rewritten=mode == UploadMode.REPLACE,
+            )
 
-    if not all(
-        field in csv_reader.fieldnames for field in ALLOWED_FIELDS_IN_CATEGORY_SHARE_CSV
-    ):
-        raise ValueError(
-            "Invalid CSV file. Please make sure the file contains the "
-            "following columns: market_share, product_id, date.",
+    if versions:
+        await refresh_category_share_indexes(
+            changed_keys,
+            replacer.replaced,
+            versions,
+            mode,
         )
+    return result
 
-    category_shares = []
-    async with in_transaction():
-        for row in csv_reader:
-            product_id = int(row["product_id"])
-            market_share = float(row["market_share"])
-            date = row["date"]
 
-            category_share = CategoryShare(
-                product_id=product_id, market_share=market_share, date=date
-            )
-            category_shares.append(category_share)
-
-        await CategoryShare.bulk_create(category_shares)
+async def refresh_category_share_indexes(
+    changed_keys: Set[Tuple[int, str]],
+    replaced: Set[Tuple[int, str]],
+    versions: Versions,
+    mode: UploadMode,
+) -> None:
+    """
+    Bring the in-process indexes up to date with a committed share upload.
 
-    return
+    :param changed_keys: categories and days of the appended shares.
+    :param replaced: products and days of the replaced shares.
+    :param versions: versions the upload bumped its tables to.
+    :param mode: mode of the upload.
+    """
+    # Only committed days are read back into the index
+    if mode == UploadMode.REPLACE and replaced:
+        await category_share_index.refresh_categories(
+            await fetch_categories_of_products(
+                {product_id for product_id, _ in replaced},
+            ),
+            versions,
+        )
+    else:
+        await category_share_index.refresh_products(changed_keys, versions)
 
 
 async def get_significant_category_shares_for_period(
@@ -54,14 +147,57 @@ async def get_significant_category_shares_for_period(
     """
     Get significant category shares for a given period.
 
+    Results are kept in the result cache until the next category share
+    or product upload.
+
     :param start_date: start date.
     :param end_date: end date.
 
     :return: significant category shares.
     """
 
-    market_share_changes = await fetch_category_share_data_for_period(
-        start_date, end_date, limit
+    market_share_changes = await result_cache.get_or_compute(
+        "significant_category_shares",
+        # No limit and a limit of 0 both return every category
+        (date_key(start_date), date_key(end_date), limit or None),
+        [table_name(CategoryShare), table_name(ProductCategory)],
+        lambda: compute_significant_category_shares(start_date, end_date, limit),
     )
 
     return market_share_changes
+
+
+async def compute_significant_category_shares(
+    start_date: str,
+    end_date: str,
+    limit: Optional[int] = 10,
+) -> List[Dict[str, Any]]:
+    """
+    Compute significant category shares for a period, without the result cache.
+
+    The change of a category is the difference between the highest and
+    the lowest market share of its products over the period. It is taken
+    from the in-process range index, the categories with the largest
+    changes being picked with a heap. Dates in other formats than
+    ``YYYY-MM-DD`` are compared as text by SQLite, so they are read from
+    the category share summary instead.
+
+    :param start_date: start date.
+    :param end_date: end date.
+    :param limit: number of categories, every category when 0 or None.
+
+    :return: category ids and market share changes, largest change first.
+    """
+
+    try:
+        changes = await category_share_index.top(start_date, end_date, limit)
+    except ValueError:
+        changes = await fetch_share_changes_for_period(start_date, end_date, limit)
+
+    return [
+        {
+            "category_id": category_id,
+            "market_share_change": Decimal(change_bp).scaleb(-2).normalize(),
+        }
+        for category_id, change_bp in changes
+    ]
@@ -0,0 +1,238 @@
+import heapq
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from gobble_cube.db.dao.category_share_summary import (
+    CategoryShareSummaryRow,
+    fetch_category_daily_share,
+    fetch_category_daily_share_of_products,
+)
+from gobble_cube.db.models import CategoryShare, ProductCategory, table_name
+from gobble_cube.services.data_versions import VersionedIndex, Versions
+from gobble_cube.services.revenue_index import parse_day
+from gobble_cube.state import on_reset
+
+
+class MinMaxSegmentTree:
+    """
+    Lowest and highest value of any range of a list, in logarithmic time.
+
+    Leaves hold the values, every other node the lowest and highest
+    values of its two children, so a range is covered by at most two
+    nodes per level.
+    """
+
+    def __init__(self, lows: List[int], highs: List[int]) -> None:
+        self.size = len(lows)
+        self._lows = [0] * self.size + lows
+        self._highs = [0] * self.size + highs
+        for node in range(self.size - 1, 0, -1):
+            self._lows[node] = min(self._lows[2 * node], self._lows[2 * node + 1])
+            self._highs[node] = max(self._highs[2 * node], self._highs[2 * node + 1])
+
+    def update(self, position: int, low: int, high: int) -> None:
+        """
+        Set the values at a position.
+
+        :param position: index in the list.
+        :param low: lowest value.
+        :param high: highest value.
+        """
+        node = position + self.size
+        self._lows[node], self._highs[node] = low, high
+        while node > 1:
+            node //= 2
+            self._lows[node] = min(self._lows[2 * node], self._lows[2 * node + 1])
+            self._highs[node] = max(self._highs[2 * node], self._highs[2 * node + 1])
+
+    def query(self, start: int, stop: int) -> Tuple[int, int]:
+        """
+        Get the lowest and highest values of a range.
+
+        :param start: first index.
+        :param stop: index after the last one, greater than ``start``.
+        :return: lowest and highest values.
+        """
+        first, last = start + self.size, stop + self.size
+        low, high = self._lows[first], self._highs[first]
+        while first < last:
+            if first & 1:
+                low = min(low, self._lows[first])
+                high = max(high, self._highs[first])
+                first += 1
+            if last & 1:
+                last -= 1
+                low = min(low, self._lows[last])
+                high = max(high, self._highs[last])
+            first //= 2
+            last //= 2
+        return low, high
+
+
+class CategoryShareSeries:
+    """Days with market shares of a category, with their segment tree."""
+
+    def __init__(self, rows: Iterable[Tuple[int, int, int]]) -> None:
+        rows = sorted(rows)
+        self.days = [day for day, _, _ in rows]
+        self.lows = [low for _, low, _ in rows]
+        self.highs = [high for _, _, high in rows]
+        self.tree = MinMaxSegmentTree(list(self.lows), list(self.highs))
+
+    def change(self, start: int, end: int) -> Optional[int]:
+        """
+        Get the difference between the highest and lowest share of a period.
+
+        :param start: ordinal of the first day.
+        :param end: ordinal of the last day.
+        :return: change in basis points, None without share in the period.
+        """
+        first = bisect_left(self.days, start)
+        stop = bisect_right(self.days, end)
+        if first >= stop:
+            return None
+        low, high = self.tree.query(first, stop)
+        return high - low
+
+    def set_days(self, rows: Iterable[Tuple[int, int, int]]) -> "CategoryShareSeries":
+        """
+        Set the shares of some days.
+
+        :param rows: day ordinal, lowest and highest share in basis points.
+        :return: the series, or a new series when days were added.
+        """
+        added = []
+        for day, low, high in rows:
+            position = bisect_left(self.days, day)
+            if position < len(self.days) and self.days[position] == day:
+                self.lows[position], self.highs[position] = low, high
+                self.tree.update(position, low, high)
+            else:
+                added.append((day, low, high))
+        if not added:
+            return self
+        kept = zip(self.days, self.lows, self.highs)
+        return CategoryShareSeries([*kept, *added])
+
+
+class CategoryShareRangeIndex(VersionedIndex):
+    """
+    In-process lowest and highest market share of every category by day.
+
+    The category share summary is loaded on first use or at startup, and
+    again after shares or product categories were written by another
+    process, into a :class:`CategoryShareSeries` per category, so the
+    market share change of a category over any period is a segment tree
+    query. Uploads of this process refresh what they touched once their
+    transaction is committed, see :meth:`refresh_products` and
+    :meth:`refresh_categories`.
+    """
+
+    tables = (table_name(CategoryShare), table_name(ProductCategory))
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._series: Dict[int, CategoryShareSeries] = {}
+
+    async def top(
+        self,
+        start_date: str,
+        end_date: str,
+        limit: Optional[int] = None,
+    ) -> List[Tuple[int, int]]:
+        """
+        Get the categories whose market share changed the most over a period.
+
+        :param start_date: first day, ``YYYY-MM-DD``.
+        :param end_date: last day, ``YYYY-MM-DD``.
+        :param limit: number of categories, every category by default.
+        :raises ValueError: if a date is not in ``YYYY-MM-DD`` format.
+        :return: category id and change in basis points, largest change
+            first, then by category id.
+        """
+        start, end = parse_day(start_date), parse_day(end_date)
+        await self.load()
+        changes = []
+        for category_id, series in self._series.items():
+            change = series.change(start, end)
+            if change is not None:
+                changes.append((category_id, change))
+
+        def key(item: Tuple[int, int]) -> Tuple[int, int]:
+            return item[1], -item[0]
+
+        if limit and limit > 0:
+            return heapq.nlargest(limit, changes, key=key)
+        return sorted(changes, key=key, reverse=True)
+
+    async def refresh_products(
+        self,
+        keys: Iterable[Tuple[int, str]],
+        versions: Versions,
+    ) -> None:
+        """
+        Read again the summary of the categories of products on some days.
+
+        Only for uploads adding shares, summary rows are never removed.
+
+        :param keys: product id and date pairs.
+        :param versions: versions the upload bumped its tables to.
+        """
+        if not self.advance(versions):
+            return
+        rows = await fetch_category_daily_share_of_products(keys)
+        by_category: Dict[int, List[Tuple[int, int, int]]] = {}
+        for category_id, day, low, high in rows:
+            by_category.setdefault(category_id, []).append(
+                (parse_day(str(day)), low, high),
+            )
+        for category_id, days in by_category.items():
+            series = self._series.get(category_id)
+            if series is None:
+                self._series[category_id] = CategoryShareSeries(days)
+            else:
+                self._series[category_id] = series.set_days(days)
+
+    async def refresh_categories(
+        self,
+        categories: Iterable[int],
+        versions: Versions,
+    ) -> None:
+        """
+        Read again the whole summary of some categories.
+
+        :param categories: category ids.
+        :param versions: versions the upload bumped its tables to.
+        """
+        if not self.advance(versions):
+            return
+        categories = set(categories)
+        series = self._series_of(await fetch_category_daily_share(categories))
+        for category_id in categories:
+            self._series.pop(category_id, None)
+        self._series.update(series)
+
+    async def _build(self) -> bool:
+        self._series = self._series_of(await fetch_category_daily_share())
+        return True
+
+    def _clear(self) -> None:
+        self._series = {}
+
+    @staticmethod
+    def _series_of(
+        rows: List[CategoryShareSummaryRow],
+    ) -> Dict[int, CategoryShareSeries]:
+        by_category: Dict[int, List[Tuple[int, int, int]]] = {}
+        for category_id, day, low, high in rows:
+            by_category.setdefault(category_id, []).append(
+                (parse_day(str(day)), low, high),
+            )
+        return {
+            category_id: CategoryShareSeries(days)
+            for category_id, days in by_category.items()
+        }
+
+
+category_share_index = CategoryShareRangeIndex()
+on_reset(category_share_index.reset)
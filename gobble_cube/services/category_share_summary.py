@@ -0,0 +1,65 @@
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
+
+from gobble_cube.db.dao import category_share_summary
+from gobble_cube.db.dao.data_versions import bump_data_versions
+from gobble_cube.db.models import CategoryShare, table_name
+from gobble_cube.db.transactions import in_write_transaction
+from gobble_cube.services.category_share_index import category_share_index
+
+logger = logging.getLogger(__name__)
+
+
+def aggregate_category_share_batch(
+    batch: Sequence[Tuple[Any, ...]],
+) -> List[Tuple[int, str, int, int]]:
+    """
+    Aggregate a batch of uploaded category shares by product and day.
+
+    :param batch: rows in the order of the category share upload schema,
+        market share in basis points, product id and date.
+    :return: product id, date, lowest and highest market share in basis
+        points, one row per product and day.
+    """
+    ranges: Dict[Tuple[int, str], List[int]] = {}
+    for share_bp, product_id, day in batch:
+        bounds = ranges.get((product_id, day))
+        if bounds is None:
+            ranges[product_id, day] = [share_bp, share_bp]
+        elif share_bp < bounds[0]:
+            bounds[0] = share_bp
+        elif share_bp > bounds[1]:
+            bounds[1] = share_bp
+    return [
+        (product_id, day, low, high)
+        for (product_id, day), (low, high) in ranges.items()
+    ]
+
+
+async def rebuild_category_share_summary() -> None:
+    """
+    Recompute the category share summary from the category shares.
+
+    The version of the category shares is bumped as for a rewrite, so every
+    process builds its index again.
+    """
+    async with in_write_transaction():
+        await category_share_summary.rebuild_category_daily_share()
+        await bump_data_versions([table_name(CategoryShare)], rewritten=True)
+    category_share_index.reset()
+
+
+async def check_category_share_summary() -> List[Dict[str, Any]]:
+    """
+    Compare the category share summary with the category shares.
+
+    :return: differing rows, empty when the summary is consistent.
+    """
+    return await category_share_summary.find_category_daily_share_differences()
+
+
+async def ensure_category_share_summary() -> None:
+    """Build the summary of a database holding category shares but no summary."""
+    if await category_share_summary.category_daily_share_is_missing():
+        logger.info("Building the category share summary")
+        await rebuild_category_share_summary()
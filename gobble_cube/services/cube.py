@@ -0,0 +1,464 @@
+import logging
+import math
+from datetime import date
+from decimal import Decimal
+from operator import itemgetter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from gobble_cube.db.dao.cube import fetch_cube_statistics, fetch_cuboid
+from gobble_cube.db.models import ProductCategory, SalesTransaction, table_name
+from gobble_cube.services.data_versions import VersionedIndex, Versions
+from gobble_cube.services.product_categories import (
+    ProductCategoryMap,
+    product_category_index,
+)
+from gobble_cube.settings import settings
+from gobble_cube.state import on_reset
+
+logger = logging.getLogger(__name__)
+
+# Dimensions of the cube, keys of the cuboids follow this order
+DIMENSIONS = ("category", "product", "quantity", "revenue", "date")
+
+Cuboid = FrozenSet[str]
+Cells = Dict[Tuple[Any, ...], int]
+
+# The sales transactions table, every cuboid can be computed from it
+RAW: Cuboid = frozenset(DIMENSIONS)
+
+# Position of the values of the sales transaction upload schema
+UPLOAD_POSITIONS = {"product": 0, "quantity": 1, "revenue": 2, "date": 3}
+
+
+def ordered(cuboid: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Sort dimensions in the order of the cuboid keys.
+
+    :param cuboid: dimensions.
+    :return: dimensions in cube order.
+    """
+    return tuple(dimension for dimension in DIMENSIONS if dimension in cuboid)
+
+
+def can_answer(source: Cuboid, target: Cuboid) -> bool:
+    """
+    Check whether a cuboid can be rolled up into another.
+
+    A product belongs to any number of categories, so cuboids grouped by
+    category only roll up into cuboids grouped by category, while cuboids
+    grouped by product can be expanded to categories.
+
+    :param source: cuboid to roll up.
+    :param target: wanted cuboid.
+    :return: whether ``target`` can be computed from ``source``.
+    """
+    if "category" in source and "category" not in target:
+        return False
+    if "category" in target and not source & {"category", "product"}:
+        return False
+    return target - {"category"} <= source
+
+
+def estimate_sizes(statistics: Dict[str, int]) -> Dict[Cuboid, float]:
+    """
+    Estimate the number of cells of every cuboid.
+
+    Dimensions are assumed independent: the rows of the table are thrown
+    into the product of the dimension cardinalities (Cardenas' formula).
+
+    :param statistics: counts given by ``fetch_cube_statistics``.
+    :return: estimated cells of every cuboid but the raw table.
+    """
+    cardinalities = {
+        # Products without category are grouped under None
+        "category": statistics["categories"] + 1,
+        "product": statistics["products"],
+        "quantity": statistics["quantities"],
+        "revenue": statistics["revenues"],
+        "date": statistics["dates"],
+    }
+    sizes = {}
+    for mask in range(1 << len(DIMENSIONS)):
+        cuboid = frozenset(d for i, d in enumerate(DIMENSIONS) if mask >> i & 1)
+        if cuboid == RAW:
+            continue
+        rows = statistics["category_links" if "category" in cuboid else "rows"]
+        cells = math.prod(max(cardinalities[d], 1) for d in cuboid)
+        if cells <= 1 or rows == 0:
+            sizes[cuboid] = float(min(cells, max(rows, 1)))
+        else:
+            sizes[cuboid] = -cells * math.expm1(rows * math.log1p(-1 / cells))
+    return sizes
+
+
+def select_cuboids(
+    sizes: Dict[Cuboid, float],
+    raw_rows: float,
+    budget: float,
+) -> List[Cuboid]:
+    """
+    Pick the cuboids to materialize with the greedy algorithm of HRU.
+
+    Harinarayan, Rajaraman and Ullman: the cost of answering a cuboid is
+    the size of its smallest materialized ancestor, the raw table always
+    being one. The cuboid saving the most cost per cell is picked, until
+    the budget is spent or nothing saves anything.
+
+    :param sizes: cells of every candidate cuboid.
+    :param raw_rows: rows of the raw table.
+    :param budget: cells that can be materialized.
+    :return: picked cuboids, by decreasing size.
+    """
+    costs = dict.fromkeys(sizes, raw_rows)
+    selected: List[Cuboid] = []
+    remaining = budget
+    while True:
+        best, best_ratio = None, 0.0
+        for candidate, size in sizes.items():
+            if candidate in selected or size > remaining:
+                continue
+            benefit = sum(
+                max(cost - size, 0)
+                for cuboid, cost in costs.items()
+                if can_answer(candidate, cuboid)
+            )
+            if benefit / max(size, 1) > best_ratio:
+                best, best_ratio = candidate, benefit / max(size, 1)
+        if best is None:
+            break
+        selected.append(best)
+        remaining -= sizes[best]
+        for cuboid in costs:
+            if can_answer(best, cuboid):
+                costs[cuboid] = min(costs[cuboid], sizes[best])
+    return sorted(selected, key=lambda cuboid: -sizes[cuboid])
+
+
+class CubeDelta:
+    """
+    Revenue of the rows written by an upload, not yet committed.
+
+    Rows are summed by the dimensions of the materialized cuboids, and
+    added to the cube once the upload is committed.
+    """
+
+    def __init__(self, cuboids: Iterable[Cuboid]) -> None:
+        cuboids = list(cuboids)
+        needed = frozenset().union(*cuboids) if cuboids else frozenset()
+        if "category" in needed:
+            needed = (needed - {"category"}) | {"product"}
+        self.dimensions = ordered(needed)
+        self.cells: Cells = {}
+        self._active = bool(cuboids)
+        self._key = _tuple_getter([UPLOAD_POSITIONS[d] for d in self.dimensions])
+
+    def add(self, batch: Sequence[Tuple[Any, ...]]) -> None:
+        """
+        Add a batch of uploaded sales transactions.
+
+        :param batch: rows in the order of the sales transaction upload schema.
+        """
+        if not self._active:
+            return
+        cells, key = self.cells, self._key
+        for row in batch:
+            cell = key(row)
+            # Revenue is in cents
+            cells[cell] = cells.get(cell, 0) + row[2]
+
+
+class SalesCube(VersionedIndex):
+    """
+    In-memory OLAP cube of the sales revenue.
+
+    Every combination of :data:`DIMENSIONS` is a cuboid. Within the
+    ``settings.cube_max_cells`` budget, the cuboids that save the most
+    work are materialized, chosen with :func:`select_cuboids`. A query
+    is answered by rolling up its smallest materialized ancestor, or by
+    SQL when there is none. Every worker process holds its own cube.
+
+    Sales uploads of this process add their rows once committed
+    (:meth:`begin_write`, :meth:`end_write`). Uploads replacing rows drop
+    the cube, and product uploads recompute the cuboids grouped by
+    category, as they change the categories of the products. The cube is
+    built again on next use once dropped, or once another process wrote
+    sales or product categories.
+    """
+
+    tables = (table_name(SalesTransaction), table_name(ProductCategory))
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.cuboids: Dict[Cuboid, Cells] = {}
+        self.categories = ProductCategoryMap.from_rows({})
+        self._writes_in_flight = 0
+        self._writes_done = 0
+
+    async def _build(self) -> bool:
+        """Select and materialize the cuboids, unless uploads are running."""
+        # The outdated cube is dropped first, not to be held twice
+        self._clear()
+        writes_done = self._writes_done
+        if self._writes_in_flight:
+            return False
+
+        statistics = await fetch_cube_statistics()
+        sizes = estimate_sizes(statistics)
+        selection = select_cuboids(
+            sizes,
+            statistics["rows"],
+            settings.cube_max_cells,
+        )
+        categories = await product_category_index.current()
+        cuboids: Dict[Cuboid, Cells] = {}
+        for cuboid in selection:
+            source = self._smallest_ancestor(cuboid, cuboids)
+            if source is None:
+                cuboids[cuboid] = await self._fetch_cells(cuboid)
+            else:
+                cuboids[cuboid] = self._roll_up(
+                    source,
+                    cuboids[source],
+                    cuboid,
+                    categories,
+                )
+
+        # Rows written meanwhile may be missing, or counted twice
+        if self._writes_in_flight or writes_done != self._writes_done:
+            return False
+        self.cuboids, self.categories = cuboids, categories
+        logger.info(
+            "Sales cube materialized %s cuboids, %s cells",
+            len(cuboids),
+            sum(map(len, cuboids.values())),
+        )
+        return True
+
+    async def query(self, dimensions: Sequence[str]) -> Cells:
+        """
+        Get the revenue grouped by some dimensions.
+
+        :param dimensions: dimensions to group by.
+        :return: revenue in cents of every combination of values, keys
+            follow the order of :data:`DIMENSIONS`.
+        """
+        await self.load()
+        target = frozenset(dimensions)
+        source = self._smallest_ancestor(target, self.cuboids) if self.loaded else None
+        if source is None:
+            return await self._fetch_cells(target)
+        if source == target:
+            return self.cuboids[source]
+        return self._roll_up(source, self.cuboids[source], target, self.categories)
+
+    def begin_write(self) -> CubeDelta:
+        """
+        Start collecting the rows of a sales upload.
+
+        :return: delta to feed with the uploaded batches.
+        """
+        self._writes_in_flight += 1
+        return CubeDelta(self.cuboids if self.loaded else ())
+
+    def end_write(self, delta: CubeDelta, versions: Versions) -> None:
+        """
+        Add the rows of a sales upload, once its transaction is over.
+
+        :param delta: delta given by :meth:`begin_write`.
+        :param versions: versions the upload bumped its tables to, empty
+            when nothing was committed.
+        """
+        self._writes_in_flight -= 1
+        self._writes_done += 1
+        if not self.advance(versions) or not delta.cells:
+            return
+        for cuboid, cells in self.cuboids.items():
+            rolled_up = self._roll_up(
+                frozenset(delta.dimensions),
+                delta.cells,
+                cuboid,
+                self.categories,
+            )
+            for cell, revenue_cents in rolled_up.items():
+                cells[cell] = cells.get(cell, 0) + revenue_cents
+
+    def invalidate(self) -> None:
+        """Drop the cube, it is built again on next use."""
+        self.versions = None
+        self._clear()
+
+    async def refresh_categories(self, versions: Versions) -> None:
+        """Recompute the cuboids grouped by category, after product uploads.
+
+        The links are the ones of the product category index, which the
+        uploads refresh first.
+
+        :param versions: versions the upload bumped its tables to.
+        """
+        if not self.advance(versions):
+            return
+        categories = await product_category_index.current()
+        cuboids = {
+            cuboid: cells
+            for cuboid, cells in self.cuboids.items()
+            if "category" not in cuboid
+        }
+        for cuboid in self.cuboids:
+            if "category" not in cuboid:
+                continue
+            source = self._smallest_ancestor(cuboid, cuboids)
+            if source is None:
+                self.invalidate()
+                return
+            cuboids[cuboid] = self._roll_up(
+                source,
+                cuboids[source],
+                cuboid,
+                categories,
+            )
+        self.cuboids, self.categories = cuboids, categories
+
+    def reset(self) -> None:
+        """Forget the cube and the uploads in flight."""
+        super().reset()
+        self._writes_in_flight = 0
+        self._writes_done = 0
+
+    def _clear(self) -> None:
+        self.cuboids = {}
+        self.categories = ProductCategoryMap.from_rows({})
+
+    @staticmethod
+    def _smallest_ancestor(
+        target: Cuboid,
+        cuboids: Dict[Cuboid, Cells],
+    ) -> Optional[Cuboid]:
+        ancestors = [cuboid for cuboid in cuboids if can_answer(cuboid, target)]
+        return min(ancestors, key=lambda cuboid: len(cuboids[cuboid]), default=None)
+
+    @staticmethod
+    async def _fetch_cells(cuboid: Cuboid) -> Cells:
+        dimensions = ordered(cuboid)
+        rows = await fetch_cuboid(dimensions)
+        return {tuple(row[:-1]): row[-1] for row in rows}
+
+    @staticmethod
+    def _roll_up(
+        source: Cuboid,
+        cells: Cells,
+        target: Cuboid,
+        categories: ProductCategoryMap,
+    ) -> Cells:
+        source_dimensions = ordered(source)
+        target_dimensions = ordered(target)
+        rolled_up: Cells = {}
+        if "category" in target and "category" not in source:
+            # Every category of the product gets the revenue
+            product = source_dimensions.index("product")
+            others = _tuple_getter(
+                [source_dimensions.index(d) for d in target_dimensions[1:]],
+            )
+            no_category: List[Optional[int]] = [None]
+            # Categories of the products met, cells share a product many times
+            rows: Dict[int, Sequence[Optional[int]]] = {}
+            for cell, revenue_cents in cells.items():
+                rest = others(cell)
+                row = rows.get(cell[product])
+                if row is None:
+                    row = rows[cell[product]] = categories.get(
+                        cell[product],
+                        no_category,
+                    )
+                for category in row:
+                    key = (category, *rest)
+                    rolled_up[key] = rolled_up.get(key, 0) + revenue_cents
+            return rolled_up
+
+        project = _tuple_getter(
+            [source_dimensions.index(d) for d in target_dimensions],
+        )
+        for cell, revenue_cents in cells.items():
+            projected = project(cell)
+            rolled_up[projected] = rolled_up.get(projected, 0) + revenue_cents
+        return rolled_up
+
+
+def _tuple_getter(positions: List[int]) -> Callable[[Any], Tuple[Any, ...]]:
+    if not positions:
+        return lambda _: ()
+    if len(positions) == 1:
+        position = positions[0]
+        return lambda row: (row[position],)
+    return itemgetter(*positions)
+
+
+def cell_formatter(
+    dimensions: Sequence[str],
+    names: Dict[str, str],
+) -> Callable[[Tuple[Any, ...], int], Dict[str, Any]]:
+    """
+    Get the function turning a cube cell into a row returned by the API.
+
+    :param dimensions: requested dimensions.
+    :param names: name of every dimension in the rows.
+    :return: function of the cell and its revenue in cents, giving the
+        row with the values of the dimensions and ``total_revenue``.
+    """
+    cube_dimensions = ordered(dimensions)
+    requested = list(dict.fromkeys(dimensions))
+    positions = [cube_dimensions.index(dimension) for dimension in requested]
+    fields = [
+        (names[dimension], position, dimension)
+        for dimension, position in zip(requested, positions)
+    ]
+
+    def format_cell(cell: Tuple[Any, ...], revenue_cents: int) -> Dict[str, Any]:
+        row: Dict[str, Any] = {}
+        for name, position, dimension in fields:
+            value = cell[position]
+            if dimension == "revenue":
+                value = Decimal(value).scaleb(-2).normalize()
+            elif dimension == "date":
+                value = date.fromisoformat(value)
+            row[name] = value
+        row["total_revenue"] = Decimal(revenue_cents).scaleb(-2).normalize()
+        return row
+
+    return format_cell
+
+
+def format_cells(
+    cells: Cells,
+    dimensions: Sequence[str],
+    names: Dict[str, str],
+) -> List[Dict[str, Any]]:
+    """
+    Turn cube cells into the rows returned by the API.
+
+    :param cells: revenue in cents by values of the dimensions.
+    :param dimensions: requested dimensions.
+    :param names: name of every dimension in the rows.
+    :return: a row per cell, by values of the dimensions, with
+        ``total_revenue``.
+    """
+    format_cell = cell_formatter(dimensions, names)
+    return [format_cell(cell, cells[cell]) for cell in sorted(cells, key=_sort_key)]
+
+
+def _sort_key(cell: Tuple[Any, ...]) -> Tuple[Any, ...]:
+    # None, the category of products without any, comes first
+    return tuple((value is not None, value) for value in cell)
+
+
+sales_cube = SalesCube()
+on_reset(sales_cube.reset)
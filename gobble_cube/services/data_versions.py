@@ -0,0 +1,95 @@
+import asyncio
+from typing import Dict, Iterable, Optional, Tuple
+
+from gobble_cube.db.dao.data_versions import fetch_data_versions
+
+Versions = Dict[str, int]
+
+
+async def current_versions(tables: Iterable[str]) -> Versions:
+    """
+    Read the committed versions of some tables.
+
+    :param tables: names of the tables.
+    :return: version of every table, 0 for a table never written to.
+    """
+    versions = await fetch_data_versions()
+    return {table: versions.get(table, (0, 0))[0] for table in tables}
+
+
+class VersionedIndex:
+    """
+    Base of the in-process indexes, kept in line with every process' writes.
+
+    Each worker process holds its own copy of an index, and only applies
+    the uploads it ran itself. The uploads bump the shared version of the
+    tables they write to, see ``gobble_cube.db.dao.data_versions``, and
+    :meth:`load`, awaited before every answer, builds the index again when
+    a version moved on since it was built. Uploads of this process refresh
+    the index in place instead, when they are the only write it is missing,
+    see :meth:`advance`.
+
+    Subclasses name the ``tables`` they are built from and implement
+    :meth:`_build`, returning whether the index could be built, and
+    :meth:`_clear`.
+    """
+
+    tables: Tuple[str, ...] = ()
+
+    def __init__(self) -> None:
+        # Versions of the tables the index holds, None when it must be built
+        self.versions: Optional[Versions] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the index is built, and only missing writes of others."""
+        return self.versions is not None
+
+    async def load(self) -> None:
+        """Build the index, on first use and after writes of other processes."""
+        if self.versions == await current_versions(self.tables):
+            return
+        async with self._lock:
+            # Versions are read first, rows written meanwhile get a new one
+            versions = await current_versions(self.tables)
+            if versions != self.versions:
+                self.versions = None
+                if await self._build():
+                    self.versions = versions
+
+    def advance(self, versions: Versions) -> bool:
+        """
+        Take in a write of this process, before refreshing the index from it.
+
+        :param versions: versions the committed write bumped its tables to.
+        :return: whether to refresh the index from the write. Nothing is to
+            be done when the index is not built or already holds the write,
+            and when another process wrote meanwhile the index is left to
+            be built again by the next :meth:`load`.
+        """
+        if self.versions is None:
+            return False
+        bumped = {
+            table: version
+            for table, version in versions.items()
+            if table in self.versions and self.versions[table] < version
+        }
+        if any(
+            self.versions[table] != version - 1 for table, version in bumped.items()
+        ):
+            self.versions = None
+            return False
+        self.versions.update(bumped)
+        return bool(bumped)
+
+    def reset(self) -> None:
+        """Forget the index, it is built again on next use."""
+        self.versions = None
+        self._clear()
+
+    async def _build(self) -> bool:
+        raise NotImplementedError
+
+    def _clear(self) -> None:
+        raise NotImplementedError
@@ -0,0 +1,387 @@
+import asyncio
+import enum
+import gzip
+import tempfile
+import zlib
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator, List, Optional, Tuple
+
+import aiofiles
+
+from gobble_cube.services.ingest import (
+    READ_CHUNK_SIZE,
+    AsyncReadable,
+    CSVSchema,
+    CSVSource,
+    get_column_positions,
+    iter_csv_batches,
+    parse_date,
+)
+from gobble_cube.settings import settings
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc  # noqa: F401
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+# File name suffixes accepted by the upload endpoints.
+UPLOAD_SUFFIXES = (".csv", ".csv.gz", ".parquet", ".arrow", ".feather", ".ipc")
+
+INVALID_FORMAT_DETAIL = (
+    "Invalid file format. Please upload a CSV (optionally gzip-compressed), "
+    "Parquet or Arrow IPC file."
+)
+
+GZIP_MAGIC = b"\x1f\x8b"
+PARQUET_MAGIC = b"PAR1"
+ARROW_FILE_MAGIC = b"ARROW1"
+ARROW_STREAM_MAGIC = b"\xff\xff\xff\xff"
+
+
+class UploadFormat(str, enum.Enum):
+    """Formats the uploads can be sent in."""
+
+    CSV = "csv"
+    GZIP_CSV = "csv.gz"
+    PARQUET = "parquet"
+    ARROW_FILE = "arrow"
+    ARROW_STREAM = "arrow-stream"
+
+
+def is_supported_upload(filename: Optional[str]) -> bool:
+    """
+    Check the name of an uploaded file.
+
+    :param filename: name of the uploaded file.
+    :return: whether the file has one of the supported extensions.
+    """
+    return filename is not None and filename.lower().endswith(UPLOAD_SUFFIXES)
+
+
+def detect_format(head: bytes) -> UploadFormat:
+    """
+    Detect the format of a file from its first bytes.
+
+    :param head: first bytes of the file.
+    :return: detected format, CSV when nothing else matches.
+    """
+    if head.startswith(GZIP_MAGIC):
+        return UploadFormat.GZIP_CSV
+    if head.startswith(PARQUET_MAGIC):
+        return UploadFormat.PARQUET
+    if head.startswith(ARROW_FILE_MAGIC):
+        return UploadFormat.ARROW_FILE
+    if head.startswith(ARROW_STREAM_MAGIC):
+        return UploadFormat.ARROW_STREAM
+    return UploadFormat.CSV
+
+
+class PrefixedReader:
+    """Async reader returning already consumed bytes before the rest."""
+
+    def __init__(self, prefix: bytes, source: AsyncReadable) -> None:
+        self.prefix = prefix
+        self.source = source
+
+    async def read(self, size: int = -1) -> bytes:
+        """
+        Read the next chunk.
+
+        :param size: maximum number of bytes.
+        :return: next chunk, empty at the end.
+        """
+        if self.prefix:
+            chunk, self.prefix = self.prefix, b""
+            return chunk
+        return await self.source.read(size)
+
+
+class GzipReader:
+    """Async reader decompressing a gzip stream while it is read."""
+
+    def __init__(self, source: AsyncReadable) -> None:
+        self.source = source
+        self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    async def read(self, size: int = -1) -> bytes:
+        """
+        Read and decompress the next chunk.
+
+        :param size: maximum number of compressed bytes to read.
+        :raises ValueError: if the stream is corrupt or ends within a member.
+        :return: decompressed bytes, empty at the end.
+        """
+        while True:
+            chunk = await self.source.read(size if size > 0 else READ_CHUNK_SIZE)
+            if not chunk:
+                if not self._decompressor.eof:
+                    raise ValueError("truncated gzip")
+                return b""
+            try:
+                data = self._decompress(chunk)
+            except zlib.error as exc:
+                raise ValueError(f"invalid gzip: {exc}") from exc
+            if data:
+                return data
+
+    def _decompress(self, chunk: bytes) -> bytes:
+        data = self._decompressor.decompress(chunk)
+        # Concatenated gzip members are read one after the other
+        while self._decompressor.eof and self._decompressor.unused_data:
+            unused = self._decompressor.unused_data
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            data += self._decompressor.decompress(unused)
+        return data
+
+
+async def iter_upload_batches(
+    source: CSVSource,
+    schema: CSVSchema,
+    batch_size: Optional[int] = None,
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    """
+    Parse an upload into batches of typed rows, whatever its format.
+
+    The format is detected from the first bytes: gzip-compressed CSV is
+    decompressed on the fly, Parquet and Arrow IPC files are read one
+    record batch at a time and converted a column at a time, anything
+    else is parsed as CSV.
+
+    :param source: upload content, a stored upload or an async readable file.
+    :param schema: required columns and their converters.
+    :param batch_size: rows per batch, ``settings.ingest_batch_size`` by default.
+    :yield: lists of tuples with values in the schema order.
+    """
+    batch_size = batch_size or settings.ingest_batch_size
+    if isinstance(source, str):
+        batches = iter_csv_batches(source, schema, batch_size)
+    elif isinstance(source, bytes):
+        batches = _iter_bytes_batches(source, schema, batch_size)
+    elif isinstance(source, Path):
+        batches = _iter_path_batches(source, schema, batch_size)
+    else:
+        batches = _iter_stream_batches(source, schema, batch_size)
+
+    async for batch in batches:
+        yield batch
+
+
+async def _iter_bytes_batches(
+    source: bytes,
+    schema: CSVSchema,
+    batch_size: int,
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    upload_format = detect_format(source[:8])
+    if upload_format == UploadFormat.CSV:
+        batches = iter_csv_batches(source, schema, batch_size)
+    elif upload_format == UploadFormat.GZIP_CSV:
+        batches = iter_csv_batches(_gunzip(source), schema, batch_size)
+    else:
+        batches = iter_columnar_batches(
+            _require_pyarrow().BufferReader(source),
+            upload_format,
+            schema,
+            batch_size,
+        )
+    async for batch in batches:
+        yield batch
+
+
+def _gunzip(source: bytes) -> bytes:
+    try:
+        return gzip.decompress(source)
+    except EOFError as exc:
+        raise ValueError("truncated gzip") from exc
+    except (OSError, zlib.error) as exc:
+        raise ValueError(f"invalid gzip: {exc}") from exc
+
+
+async def _iter_path_batches(
+    source: Path,
+    schema: CSVSchema,
+    batch_size: int,
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    with source.open("rb") as file:
+        upload_format = detect_format(file.read(8))
+
+    if upload_format == UploadFormat.CSV:
+        batches = iter_csv_batches(source, schema, batch_size)
+    elif upload_format == UploadFormat.GZIP_CSV:
+        batches = _iter_gzip_file_batches(source, schema, batch_size)
+    else:
+        batches = iter_columnar_batches(str(source), upload_format, schema, batch_size)
+    async for batch in batches:
+        yield batch
+
+
+async def _iter_gzip_file_batches(
+    source: Path,
+    schema: CSVSchema,
+    batch_size: int,
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    async with aiofiles.open(source, "rb") as file:
+        async for batch in iter_csv_batches(GzipReader(file), schema, batch_size):
+            yield batch
+
+
+async def _iter_stream_batches(
+    source: AsyncReadable,
+    schema: CSVSchema,
+    batch_size: int,
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    head = await source.read(READ_CHUNK_SIZE)
+    upload_format = detect_format(head)
+    reader = PrefixedReader(head, source)
+
+    if upload_format == UploadFormat.CSV:
+        async for batch in iter_csv_batches(reader, schema, batch_size):
+            yield batch
+        return
+    if upload_format == UploadFormat.GZIP_CSV:
+        async for batch in iter_csv_batches(GzipReader(reader), schema, batch_size):
+            yield batch
+        return
+
+    # Columnar files need random access, so they are spooled to disk first
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "upload"
+        async with aiofiles.open(path, "wb") as spooled:
+            while True:
+                chunk = await reader.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await spooled.write(chunk)
+        batches = iter_columnar_batches(str(path), upload_format, schema, batch_size)
+        async for batch in batches:
+            yield batch
+
+
+def _require_pyarrow() -> Any:
+    if pa is None:
+        raise ValueError(
+            "Parquet and Arrow uploads need pyarrow, "
+            "install gobble_cube with the `columnar` extra.",
+        )
+    return pa
+
+
+def _open_record_batches(
+    source: Any,
+    upload_format: UploadFormat,
+    schema: CSVSchema,
+    batch_size: int,
+) -> Iterator[Any]:
+    columns = list(schema)
+    if upload_format == UploadFormat.PARQUET:
+        parquet_file = pq.ParquetFile(source)
+        get_column_positions(parquet_file.schema_arrow.names, schema)
+        yield from parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+        return
+
+    if upload_format == UploadFormat.ARROW_FILE:
+        reader = pa.ipc.open_file(source)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    else:
+        reader = pa.ipc.open_stream(source)
+        batches = iter(reader)
+    get_column_positions(reader.schema.names, schema)
+    for record_batch in batches:
+        for offset in range(0, record_batch.num_rows, batch_size):
+            yield record_batch.slice(offset, batch_size).select(columns)
+
+
+async def iter_columnar_batches(
+    source: Any,
+    upload_format: UploadFormat,
+    schema: CSVSchema,
+    batch_size: int,
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    """
+    Read a Parquet or Arrow IPC file into batches of typed rows.
+
+    Record batches are read and converted in a thread, one column at a
+    time with Arrow compute kernels, so the event loop keeps serving
+    requests meanwhile.
+
+    :param source: file path or Arrow buffer reader.
+    :param upload_format: Parquet, Arrow IPC file or Arrow IPC stream.
+    :param schema: required columns and their converters.
+    :param batch_size: rows per batch.
+    :yield: lists of tuples with values in the schema order.
+    """
+    _require_pyarrow()
+    record_batches = _open_record_batches(source, upload_format, schema, batch_size)
+    first_row = 1
+    while True:
+        columns = await asyncio.to_thread(
+            _convert_next_batch,
+            record_batches,
+            schema,
+            first_row,
+        )
+        if columns is None:
+            return
+        rows = list(zip(*columns))
+        first_row += len(rows)
+        yield rows
+
+
+def _convert_next_batch(
+    record_batches: Iterator[Any],
+    schema: CSVSchema,
+    first_row: int,
+) -> Optional[List[List[Any]]]:
+    record_batch = next(record_batches, None)
+    if record_batch is None:
+        return None
+    return [
+        convert_arrow_column(record_batch.column(name), convert, first_row)
+        for name, convert in schema.items()
+    ]
+
+
+def convert_arrow_column(column: Any, convert: Any, first_row: int) -> List[Any]:
+    """
+    Validate and convert an Arrow column to the values stored in the database.
+
+    Integers and dates are cast with Arrow kernels. Other converters are
+    only applied to the distinct values of the column. When a kernel
+    rejects the column, values are converted one by one like CSV cells,
+    to either accept them or report the offending row.
+
+    :param column: Arrow array.
+    :param convert: converter of the column in the upload schema.
+    :param first_row: number of the first row of the array in the file.
+    :raises ValueError: if a value is missing or can not be converted.
+    :return: converted values.
+    """
+    if column.null_count:
+        row = pc.index(column.is_null(), True).as_py()
+        raise ValueError(f"Invalid value in row {first_row + row}: missing value")
+
+    try:
+        if convert is int:
+            return column.cast(pa.int64()).to_pylist()
+        if convert is parse_date:
+            if not pa.types.is_date(column.type):
+                column = pc.strptime(column, format="%Y-%m-%d", unit="s")
+            return column.cast(pa.date32()).cast(pa.string()).to_pylist()
+
+        encoded = column.dictionary_encode()
+        dictionary = [convert(str(value)) for value in encoded.dictionary.to_pylist()]
+        return [dictionary[index] for index in encoded.indices.to_pylist()]
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, TypeError, ValueError):
+        return _convert_values(column.to_pylist(), convert, first_row)
+
+
+def _convert_values(values: List[Any], convert: Any, first_row: int) -> List[Any]:
+    converted = []
+    for row, value in enumerate(values):
+        try:
+            converted.append(convert(str(value)))
+        except (TypeError, ValueError) as exc:
+            raise ValueError(f"Invalid value in row {first_row + row}: {exc}") from exc
+    return converted
@@ -0,0 +1,63 @@
+import asyncio
+from typing import Iterable, List, Optional, Set, Type
+
+from tortoise import Model
+
+
+class KnownIdIndex:
+    """
+    In-process set of the primary keys already stored for a model.
+
+    The ids are loaded once, on first use, and then kept up to date by
+    the uploads, so checking which ids of a batch are new does not need
+    a query. Ids are only added once the transaction inserting them is
+    committed, see :meth:`add`.
+    """
+
+    def __init__(self, model: Type[Model]) -> None:
+        self.model = model
+        self._ids: Optional[Set[int]] = None
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> Set[int]:
+        """
+        Get the known ids, loading them from the database on first use.
+
+        :return: known ids.
+        """
+        if self._ids is None:
+            async with self._lock:
+                if self._ids is None:
+                    rows = await self.model.all().values_list("id")
+                    self._ids = {id_ for (id_,) in rows}
+        return self._ids
+
+    async def missing(
+        self,
+        ids: Iterable[int],
+        pending: Optional[Set[int]] = None,
+    ) -> List[int]:
+        """
+        Find the ids that are not stored yet.
+
+        :param ids: ids to check.
+        :param pending: ids inserted by the current, uncommitted transaction.
+        :return: new ids, sorted.
+        """
+        known = await self.load()
+        return sorted(
+            id_ for id_ in set(ids) if id_ not in known and id_ not in (pending or ())
+        )
+
+    def add(self, ids: Iterable[int]) -> None:
+        """
+        Record ids inserted by a committed transaction.
+
+        :param ids: new ids.
+        """
+        if self._ids is not None:
+            self._ids.update(ids)
+
+    def reset(self) -> None:
+        """Forget the ids, they are loaded again on next use."""
+        self._ids = None
@@ -0,0 +1,138 @@
+import asyncio
+import enum
+import hashlib
+from dataclasses import dataclass
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, List, Protocol, Sequence, Set, Tuple, Type, Union
+
+from tortoise import Model
+
+from gobble_cube.db.dao.bulk import bulk_delete
+from gobble_cube.db.models import UploadFingerprint
+from gobble_cube.services.ingest import READ_CHUNK_SIZE, AsyncReadable
+
+
+class AsyncSeekable(AsyncReadable, Protocol):
+    """Anything also exposing ``await seek(offset)``, e.g. ``UploadFile``."""
+
+    async def seek(self, offset: int) -> None:  # noqa: D102
+        ...
+
+
+class UploadMode(str, enum.Enum):
+    """How uploaded rows are combined with the stored ones."""
+
+    # Rows are added to the stored ones
+    APPEND = "append"
+    # Stored rows sharing a natural key with the upload are replaced
+    REPLACE = "replace"
+
+
+@dataclass
+class UploadResult:
+    """Outcome of an upload."""
+
+    rows: int = 0
+    # The same file was already uploaded, so nothing was written
+    duplicate: bool = False
+
+
+def new_fingerprint() -> "hashlib._Hash":
+    """
+    Start the fingerprint of an upload.
+
+    :return: hash object to feed with the raw bytes of the upload.
+    """
+    return hashlib.sha256()
+
+
+async def fingerprint_upload(
+    source: Union[str, bytes, Path, AsyncSeekable],
+) -> str:
+    """
+    Hash the raw content of an upload.
+
+    Uploaded files are read once and rewound, so they can still be ingested.
+
+    :param source: upload content, a stored upload or a seekable async file.
+    :return: hex digest of the content.
+    """
+    fingerprint = new_fingerprint()
+    if isinstance(source, str):
+        fingerprint.update(source.encode())
+    elif isinstance(source, bytes):
+        fingerprint.update(source)
+    elif isinstance(source, Path):
+        await asyncio.to_thread(_hash_file, source, fingerprint)
+    else:
+        while True:
+            chunk = await source.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            fingerprint.update(chunk)
+        await source.seek(0)
+    return fingerprint.hexdigest()
+
+
+def _hash_file(path: Path, fingerprint: "hashlib._Hash") -> None:
+    with path.open("rb") as file:
+        while chunk := file.read(READ_CHUNK_SIZE):
+            fingerprint.update(chunk)
+
+
+async def is_known_upload(kind: str, fingerprint: str) -> bool:
+    """
+    Check whether a file was already uploaded.
+
+    :param kind: what is uploaded.
+    :param fingerprint: digest of the file.
+    :return: whether the file was uploaded before.
+    """
+    return await UploadFingerprint.exists(kind=kind, digest=fingerprint)
+
+
+async def record_upload(kind: str, fingerprint: str, rows: int) -> None:
+    """
+    Remember an upload, in the transaction writing its rows.
+
+    :param kind: what is uploaded.
+    :param fingerprint: digest of the file.
+    :param rows: number of rows written.
+    """
+    await UploadFingerprint.create(kind=kind, digest=fingerprint, rows=rows)
+
+
+class NaturalKeyReplacer:
+    """
+    Delete the stored rows an upload replaces, batch by batch.
+
+    Before a batch is inserted, the rows stored under its natural keys are
+    deleted, unless the key was already seen earlier in the same upload,
+    so rows of the upload sharing a key are all kept.
+    """
+
+    def __init__(
+        self,
+        model: Type[Model],
+        columns: Sequence[str],
+        key_columns: Sequence[str],
+    ) -> None:
+        self.model = model
+        self.key_columns = list(key_columns)
+        self._get_key = itemgetter(*(columns.index(c) for c in key_columns))
+        # Keys whose stored rows were deleted so far
+        self.replaced: Set[Any] = set()
+
+    async def delete_replaced(self, batch: List[Tuple[Any, ...]]) -> None:
+        """
+        Delete the stored rows with the keys of a batch.
+
+        :param batch: rows about to be inserted.
+        """
+        keys = set(map(self._get_key, batch)) - self.replaced
+        self.replaced.update(keys)
+        if len(self.key_columns) == 1:
+            await bulk_delete(self.model, self.key_columns, [(key,) for key in keys])
+        else:
+            await bulk_delete(self.model, self.key_columns, list(keys))
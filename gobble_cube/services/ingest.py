@@ -0,0 +1,511 @@
+import asyncio
+import codecs
+import csv
+import datetime
+import io
+import math
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from functools import partial
+from operator import itemgetter
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Protocol,
+    Tuple,
+    Union,
+)
+
+import aiofiles
+
+from gobble_cube.settings import settings
+
+# Size of the chunks pulled from an uploaded file at a time.
+READ_CHUNK_SIZE = 1024 * 1024
+# Size of the byte ranges handed to the parser processes.
+PARALLEL_RANGE_SIZE = 8 * 1024 * 1024
+# Range of the integers SQLite stores, a signed 64-bit integer.
+MIN_SCALED_INTEGER = -(2**63)
+MAX_SCALED_INTEGER = 2**63 - 1
+
+
+class AsyncReadable(Protocol):
+    """Anything exposing ``await read(size)``, e.g. ``UploadFile``."""
+
+    async def read(self, size: int = -1) -> bytes:  # noqa: D102
+        ...
+
+
+# Sources decoded as they are read
+TextSource = Union[str, bytes, AsyncReadable]
+
+# A path is read from disk, and parsed in parallel when the file is large.
+CSVSource = Union[TextSource, Path]
+
+# Ordered mapping of CSV column -> converter applied to the raw cell.
+CSVSchema = Dict[str, Callable[[str], Any]]
+
+# Called with the number of rows written after every batch.
+ProgressCallback = Callable[[int], None]
+
+
+def parse_date(value: str) -> str:
+    """
+    Validate an ISO date.
+
+    :param value: raw cell.
+    :return: the date in the ``YYYY-MM-DD`` form stored by ``DateField``.
+    """
+    return datetime.date.fromisoformat(value.strip()).isoformat()
+
+
+def scaled_integer_converter(decimal_places: int) -> Callable[[str], int]:
+    """
+    Build a converter to the integer a scaled field stores.
+
+    Money and shares are stored as integers of their smallest unit, cents or
+    basis points. The uploads always parsed the cell as a float first, so
+    the same steps are kept for the stored values (and their grouping) to
+    stay identical: the float is rounded half to even to the precision.
+    Infinities, NaN and values too large for SQLite are rejected with a
+    ``ValueError``, reported like any other invalid cell.
+
+    :param decimal_places: decimal places of the field.
+    :return: converter to the integer number of ``10**-decimal_places``.
+    """
+    return partial(_to_scaled_integer, decimal_places)
+
+
+def _to_scaled_integer(decimal_places: int, value: str) -> int:
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"not a finite number: {value.strip()}")
+    scaled = int(Decimal(number).scaleb(decimal_places).to_integral_value())
+    if not MIN_SCALED_INTEGER <= scaled <= MAX_SCALED_INTEGER:
+        raise ValueError(f"number out of range: {value.strip()}")
+    return scaled
+
+
+class CSVRowError(ValueError):
+    """Raised when a CSV row can not be converted to the expected types."""
+
+    def __init__(self, line_number: int, message: str) -> None:
+        super().__init__(f"Invalid value on line {line_number}: {message}")
+        self.line_number = line_number
+        self.reason = message
+
+
+async def iter_text_chunks(source: TextSource) -> AsyncIterator[str]:
+    """
+    Decode the source incrementally.
+
+    :param source: CSV text, raw bytes or an async readable file.
+    :yield: decoded pieces of text, in order.
+    """
+    if isinstance(source, str):
+        yield source
+        return
+
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    if isinstance(source, bytes):
+        yield decoder.decode(source, final=True)
+        return
+
+    while True:
+        chunk = await source.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def iter_csv_records(
+    source: TextSource,
+) -> AsyncIterator[Tuple[List[int], List[str]]]:
+    """
+    Split the source into complete CSV records as text arrives.
+
+    A record normally is a single line, but a quoted field may contain
+    newlines, so lines are glued together until their quotes balance.
+
+    :param source: CSV text, raw bytes or an async readable file.
+    :yield: line numbers and texts of the records decoded so far.
+    """
+    pending = ""
+    record = ""
+    record_line = 0
+    line_number = 0
+
+    async for text in iter_text_chunks(source):
+        *lines, pending = (pending + text).split("\n")
+        line_numbers: List[int] = []
+        records: List[str] = []
+        for line in lines:
+            line_number += 1
+            if record:
+                record = f"{record}\n{line}"
+            else:
+                record, record_line = line, line_number
+            if record.count('"') % 2 == 0:
+                line_numbers.append(record_line)
+                records.append(record)
+                record = ""
+        if records:
+            yield line_numbers, records
+
+    if pending:
+        line_number += 1
+        if record:
+            record = f"{record}\n{pending}"
+        else:
+            record, record_line = pending, line_number
+    if record:
+        yield [record_line], [record]
+
+
+async def iter_csv_batches(
+    source: CSVSource,
+    schema: CSVSchema,
+    batch_size: Optional[int] = None,
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    """
+    Parse a CSV source into batches of typed rows.
+
+    Only one batch is held in memory at a time, so the memory used
+    does not depend on the size of the source.
+
+    :param source: CSV text, raw bytes or an async readable file.
+    :param schema: required columns and their converters.
+    :param batch_size: rows per batch, ``settings.ingest_batch_size`` by default.
+    :raises ValueError: if one of the required columns is missing.
+    :raises CSVRowError: if a row can not be converted.
+    :yield: lists of tuples with values in the schema order.
+    """
+    batch_size = batch_size or settings.ingest_batch_size
+    if isinstance(source, Path):
+        async for batch in iter_csv_file_batches(source, schema, batch_size):
+            yield batch
+        return
+
+    positions: Optional[List[int]] = None
+    rows: List[List[str]] = []
+    row_lines: List[int] = []
+
+    async for line_numbers, parsed in iter_csv_rows(source):
+        rows += parsed
+        row_lines += line_numbers
+        if positions is None:
+            positions = get_column_positions(rows.pop(0), schema)
+            row_lines.pop(0)
+        while len(rows) >= batch_size:
+            yield convert_rows(
+                rows[:batch_size],
+                row_lines[:batch_size],
+                positions,
+                schema,
+            )
+            del rows[:batch_size], row_lines[:batch_size]
+
+    if positions is None:
+        get_column_positions([], schema)
+    elif rows:
+        yield convert_rows(rows, row_lines, positions, schema)
+
+
+async def iter_csv_file_batches(
+    path: Path,
+    schema: CSVSchema,
+    batch_size: int,
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    """
+    Parse a CSV file from disk, in parallel when it is large.
+
+    :param path: CSV file.
+    :param schema: required columns and their converters.
+    :param batch_size: rows per batch.
+    :yield: lists of tuples with values in the schema order.
+    """
+    if _should_parse_in_parallel(path):
+        batches = iter_csv_file_batches_in_parallel(path, schema, batch_size)
+        async for batch in batches:
+            yield batch
+        return
+    async with aiofiles.open(path, "rb") as file:
+        async for batch in iter_csv_batches(file, schema, batch_size):
+            yield batch
+
+
+async def iter_csv_rows(
+    source: TextSource,
+) -> AsyncIterator[Tuple[List[int], List[List[str]]]]:
+    """
+    Parse the records of the source into rows, skipping blank lines.
+
+    :param source: CSV text, raw bytes or an async readable file.
+    :yield: line numbers and fields of the rows decoded so far.
+    """
+    async for line_numbers, records in iter_csv_records(source):
+        row_lines: List[int] = []
+        rows: List[List[str]] = []
+        for line_number, row in zip(line_numbers, csv.reader(records)):
+            if row:
+                row_lines.append(line_number)
+                rows.append(row)
+        if rows:
+            yield row_lines, rows
+
+
+def convert_rows(
+    rows: List[List[str]],
+    line_numbers: List[int],
+    positions: List[int],
+    schema: CSVSchema,
+) -> List[Tuple[Any, ...]]:
+    """
+    Convert raw rows into parameter tuples.
+
+    :param rows: raw CSV rows.
+    :param line_numbers: line of every row in the source.
+    :param positions: position of every schema column in the rows.
+    :param schema: required columns and their converters.
+    :return: tuples with values in the schema order.
+    """
+    return list(zip(*convert_columns(rows, line_numbers, positions, schema)))
+
+
+def convert_columns(
+    rows: List[List[str]],
+    line_numbers: List[int],
+    positions: List[int],
+    schema: CSVSchema,
+) -> List[List[Any]]:
+    """
+    Convert raw rows into typed columns, one column at a time.
+
+    Every column is converted with a single ``map`` call, which avoids
+    the per-row Python overhead. Rows are only walked one by one when
+    a conversion fails, to find the line to report.
+
+    :param rows: raw CSV rows.
+    :param line_numbers: line of every row in the source.
+    :param positions: position of every schema column in the rows.
+    :param schema: required columns and their converters.
+    :raises CSVRowError: if a row can not be converted.
+    :return: typed values of every column, in the schema order.
+    """
+    try:
+        return [
+            list(map(convert, map(itemgetter(position), rows)))
+            for position, convert in zip(positions, schema.values())
+        ]
+    except (IndexError, TypeError, ValueError):
+        for line_number, row in zip(line_numbers, rows):
+            try:
+                for position, convert in zip(positions, schema.values()):
+                    convert(row[position])
+            except (IndexError, TypeError, ValueError) as exc:
+                raise CSVRowError(line_number, str(exc) or "missing value") from exc
+        raise
+
+
+def get_column_positions(header: List[str], schema: CSVSchema) -> List[int]:
+    """
+    Find the position of every schema column in the header.
+
+    :param header: first row of the CSV file.
+    :param schema: required columns.
+    :raises ValueError: if one of the required columns is missing.
+    :return: positions of the columns, in the schema order.
+    """
+    header = [field.strip() for field in header]
+    if not all(field in header for field in schema):
+        raise ValueError(
+            "Invalid CSV file. Please make sure the file contains the "
+            f"following columns: {', '.join(schema)}.",
+        )
+    return [header.index(field) for field in schema]
+
+
+def _should_parse_in_parallel(path: Path) -> bool:
+    return (
+        _get_parse_processes() > 1
+        and path.stat().st_size >= settings.ingest_parallel_min_bytes
+    )
+
+
+def _get_parse_processes() -> int:
+    return settings.ingest_parse_processes or os.cpu_count() or 1
+
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Get the pool of parser processes, starting it on first use.
+
+    :return: process pool.
+    """
+    global _process_pool  # noqa: PLW0603
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=_get_parse_processes(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    """Stop the parser processes, if they were started."""
+    global _process_pool  # noqa: PLW0603
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+
+
+def split_file(path: Path, start: int, range_size: int) -> Iterator[Tuple[int, int]]:
+    """
+    Split a file into byte ranges ending on a newline outside quoted fields.
+
+    A quoted field may contain newlines, so a range ends at the first
+    newline after ``range_size`` bytes where its quotes balance. Ranges
+    start where the previous one ended, outside a quoted field as well.
+
+    :param path: CSV file.
+    :param start: offset of the first range, outside a quoted field.
+    :param range_size: approximate size of every range.
+    :yield: start and end offsets of the ranges.
+    """
+    size = path.stat().st_size
+    with path.open("rb") as file:
+        file.seek(start)
+        while start < size:
+            quotes = file.read(range_size).count(b'"')
+            while True:
+                line = file.readline()
+                quotes += line.count(b'"')
+                if not line or quotes % 2 == 0:
+                    break
+            end = file.tell()
+            yield start, end
+            start = end
+
+
+def parse_file_range(
+    path: Path,
+    start: int,
+    end: int,
+    positions: List[int],
+    schema: CSVSchema,
+) -> Tuple[List[List[Any]], int, Optional[Tuple[int, str]]]:
+    """
+    Parse and convert a byte range of a CSV file, in a parser process.
+
+    :param path: CSV file.
+    :param start: offset of the first byte of the range.
+    :param end: offset after the last byte of the range.
+    :param positions: position of every schema column in the rows.
+    :param schema: required columns and their converters.
+    :return: typed columns, number of lines in the range and, if a row
+        could not be converted, its line relative to the range and the reason.
+    """
+    with path.open("rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+
+    # Newlines of quoted fields are kept, records are numbered by their first line
+    reader = csv.reader(io.StringIO(data.decode("utf-8"), newline=""))
+    rows: List[List[str]] = []
+    line_numbers: List[int] = []
+    previous_line = 0
+    for row in reader:
+        if row:
+            rows.append(row)
+            line_numbers.append(previous_line + 1)
+        previous_line = reader.line_num
+
+    try:
+        columns = convert_columns(rows, line_numbers, positions, schema)
+    except CSVRowError as exc:
+        return [], 0, (exc.line_number, exc.reason)
+    return columns, data.count(b"\n"), None
+
+
+async def iter_csv_file_batches_in_parallel(
+    path: Path,
+    schema: CSVSchema,
+    batch_size: int,
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    """
+    Parse a large CSV file with several processes.
+
+    The file is split in byte ranges ending on a newline outside quoted
+    fields, so a quoted field may span lines as in sequential parsing. The
+    ranges are parsed and converted by the process pool, while the caller
+    writes the batches of the ranges already parsed, in file order. Only a
+    few ranges are parsed ahead, so the memory used stays bounded.
+
+    :param path: CSV file.
+    :param schema: required columns and their converters.
+    :param batch_size: rows per batch.
+    :raises CSVRowError: if a row can not be converted.
+    :yield: lists of tuples with values in the schema order.
+    """
+    with path.open("rb") as file:
+        header_line = file.readline()
+        header_end = file.tell()
+    header = next(csv.reader([header_line.decode("utf-8-sig")]), [])
+    positions = get_column_positions(header, schema)
+
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    ranges = split_file(path, header_end, PARALLEL_RANGE_SIZE)
+    pending: Deque["asyncio.Future[Any]"] = deque()
+
+    def submit_next_range() -> None:
+        file_range = next(ranges, None)
+        if file_range is not None:
+            pending.append(
+                loop.run_in_executor(
+                    pool,
+                    parse_file_range,
+                    path,
+                    *file_range,
+                    positions,
+                    schema,
+                ),
+            )
+
+    for _ in range(_get_parse_processes() * 2):
+        submit_next_range()
+
+    line_offset = 1
+    try:
+        while pending:
+            columns, line_count, error = await pending.popleft()
+            submit_next_range()
+            if error is not None:
+                raise CSVRowError(line_offset + error[0], error[1])
+            line_offset += line_count
+
+            rows = list(zip(*columns))
+            for batch_start in range(0, len(rows), batch_size):
+                yield rows[batch_start : batch_start + batch_size]
+    finally:
+        for future in pending:
+            future.cancel()
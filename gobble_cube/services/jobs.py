@@ -0,0 +1,425 @@
+import asyncio
+import contextlib
+import enum
+import fcntl
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Any, Awaitable, Callable, Dict, List, Optional
+
+import aiofiles
+from tortoise.exceptions import OperationalError, TransactionManagementError
+
+from gobble_cube.db.dao.ingest_jobs import (
+    delete_finished_ingest_jobs,
+    fetch_ingest_job,
+    fetch_ingest_jobs_with_status,
+)
+from gobble_cube.db.models import IngestJobRecord
+from gobble_cube.db.transactions import in_write_transaction
+from gobble_cube.services.category_share import bulk_upload_category_share_from_csv
+from gobble_cube.services.idempotency import (
+    UploadMode,
+    UploadResult,
+    new_fingerprint,
+)
+from gobble_cube.services.ingest import READ_CHUNK_SIZE, AsyncReadable
+from gobble_cube.services.product import bulk_upload_products_from_csv
+from gobble_cube.services.service_transaction import (
+    bulk_upload_sales_transactions_from_csv,
+)
+from gobble_cube.settings import settings
+from gobble_cube.state import on_reset
+
+logger = logging.getLogger(__name__)
+
+Uploader = Callable[..., Awaitable[UploadResult]]
+
+# Upload service of every kind of job, the jobs of a kind may be run by
+# another process than the one they were submitted to.
+UPLOADERS: Dict[str, Uploader] = {
+    "product": bulk_upload_products_from_csv,
+    "sales_transaction": bulk_upload_sales_transactions_from_csv,
+    "category_share": bulk_upload_category_share_from_csv,
+}
+
+# Finished jobs kept around for the status endpoint.
+MAX_FINISHED_JOBS = 1000
+
+# Raised when another process holds the write lock beyond the busy timeout,
+# as a transaction begins or as one of its statements runs.
+LOCKED_ERRORS = (OperationalError, TransactionManagementError)
+
+
+class JobStatus(str, enum.Enum):
+    """Possible states of an ingestion job."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    # The same file was already uploaded
+    SKIPPED = "skipped"
+    FAILED = "failed"
+
+
+@dataclass
+class IngestJob:
+    """A file waiting for, or going through, a background upload."""
+
+    id: str
+    kind: str
+    mode: UploadMode = UploadMode.APPEND
+    fingerprint: Optional[str] = None
+    status: JobStatus = JobStatus.PENDING
+    rows_processed: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "IngestJob":
+        """
+        Rebuild a job from its stored state.
+
+        :param record: columns of the ``ingest_jobs`` table.
+        :return: the job.
+        """
+        job = cls(
+            id=record["id"],
+            kind=record["kind"],
+            mode=UploadMode(record["mode"]),
+            fingerprint=record["fingerprint"],
+            status=JobStatus(record["status"]),
+            rows_processed=record["rows_processed"],
+            error=record["error"],
+            created_at=record["created_at"],
+            started_at=record["started_at"],
+            finished_at=record["finished_at"],
+        )
+        if job.finished_at is not None:
+            job.done.set()
+        return job
+
+    @property
+    def path(self) -> Path:
+        """
+        Where the uploaded file is kept until the job is finished.
+
+        :return: path of the file.
+        """
+        return settings.ingest_upload_dir / f"{self.id}.upload"
+
+    @property
+    def elapsed(self) -> float:
+        """
+        Seconds spent processing the job so far.
+
+        :return: elapsed seconds.
+        """
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def rows_per_second(self) -> float:
+        """
+        Average throughput of the job.
+
+        :return: rows per second.
+        """
+        elapsed = self.elapsed
+        return self.rows_processed / elapsed if elapsed else 0.0
+
+    def add_rows(self, count: int) -> None:
+        """
+        Record rows written by the uploader.
+
+        :param count: number of rows.
+        """
+        self.rows_processed += count
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Job progress as returned by the API.
+
+        :return: serializable job status.
+        """
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status.value,
+            "rows_processed": self.rows_processed,
+            "rows_per_second": round(self.rows_per_second, 2),
+            "elapsed_seconds": round(self.elapsed, 3),
+            "error": self.error,
+        }
+
+
+def _worker_lock_path(worker: str) -> Path:
+    return settings.ingest_upload_dir / f"{worker}.worker"
+
+
+def _is_worker_alive(worker: str) -> bool:
+    """
+    Check whether the process holding a worker lock file is still running.
+
+    The lock is released by the system when the process exits, however it
+    exits, and process ids being reused does not matter.
+
+    :param worker: name of the worker.
+    :return: whether its lock is held.
+    """
+    path = _worker_lock_path(worker)
+    try:
+        handle = path.open("a")
+    except OSError:
+        return False
+    with handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+    path.unlink(missing_ok=True)
+    return False
+
+
+class IngestJobQueue:
+    """
+    Bounded pool of workers running uploads in the background.
+
+    Jobs are kept in the ``ingest_jobs`` table, so every worker process
+    reports them and runs them, whichever process they were submitted to.
+    At most ``settings.ingest_workers`` uploads run at the same time in a
+    process, the others wait in the table, so ingestion can not starve the
+    other endpoints. Workers are started with the first submitted job, or
+    on application startup.
+
+    The rows processed so far are only known to the process running the
+    job, as its upload holds the write lock of the database, the other
+    processes report them once the job is finished. A process holds a lock
+    file while it runs jobs, the running jobs of a process which exited
+    without finishing them are queued again by the others.
+    """
+
+    def __init__(self) -> None:
+        # Jobs submitted to, or run by, this process
+        self.jobs: Dict[str, IngestJob] = {}
+        self.worker = uuid.uuid4().hex
+        self._wakeups: Optional["asyncio.Queue[None]"] = None
+        self._workers: List["asyncio.Task[None]"] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock_file: Optional[IO[str]] = None
+
+    async def start(self) -> None:
+        """Start the workers, running the jobs queued before the process started."""
+        self._start().put_nowait(None)
+
+    async def submit(
+        self,
+        kind: str,
+        file: AsyncReadable,
+        mode: UploadMode = UploadMode.APPEND,
+    ) -> IngestJob:
+        """
+        Store the uploaded file and queue it for ingestion.
+
+        The file is fingerprinted while it is stored, so a file
+        uploaded before is skipped without being parsed.
+
+        :param kind: what is uploaded, one of :data:`UPLOADERS`.
+        :param file: uploaded file.
+        :param mode: how the rows are combined with the stored ones.
+        :return: queued job.
+        """
+        wakeups = self._start()
+        job = IngestJob(id=uuid.uuid4().hex, kind=kind, mode=mode)
+
+        fingerprint = new_fingerprint()
+        async with aiofiles.open(job.path, "wb") as stored:
+            while True:
+                chunk = await file.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                fingerprint.update(chunk)
+                await stored.write(chunk)
+        job.fingerprint = fingerprint.hexdigest()
+
+        self._forget_finished_jobs()
+        self.jobs[job.id] = job
+        await IngestJobRecord.create(
+            id=job.id,
+            kind=job.kind,
+            mode=job.mode.value,
+            fingerprint=job.fingerprint,
+            status=job.status.value,
+            created_at=job.created_at,
+        )
+        wakeups.put_nowait(None)
+        return job
+
+    async def get(self, job_id: str) -> Optional[IngestJob]:
+        """
+        Find a job by its id.
+
+        :param job_id: id returned on submission.
+        :return: the job, if it is known.
+        """
+        job = self.jobs.get(job_id)
+        if job is not None and job.status != JobStatus.PENDING:
+            return job
+        record = await fetch_ingest_job(job_id)
+        return IngestJob.from_record(record) if record else None
+
+    async def stop(self) -> None:
+        """Cancel the workers, their running jobs are queued again by others."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._loop = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+            _worker_lock_path(self.worker).unlink(missing_ok=True)
+
+    async def reset(self) -> None:
+        """Stop the workers and forget the jobs of this process."""
+        await self.stop()
+        self.jobs.clear()
+
+    def _start(self) -> "asyncio.Queue[None]":
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._wakeups is not None:
+            return self._wakeups
+        settings.ingest_upload_dir.mkdir(parents=True, exist_ok=True)
+        if self._lock_file is None:
+            self._lock_file = _worker_lock_path(self.worker).open("w")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._loop = loop
+        wakeups: "asyncio.Queue[None]" = asyncio.Queue()
+        self._wakeups = wakeups
+        self._workers = [
+            loop.create_task(self._work(wakeups))
+            for _ in range(settings.ingest_workers)
+        ]
+        return wakeups
+
+    async def _work(self, wakeups: "asyncio.Queue[None]") -> None:
+        while True:
+            try:
+                await self._requeue_abandoned_jobs()
+                job = await self._claim()
+            except LOCKED_ERRORS:
+                logger.warning("Could not claim an ingestion job, will retry")
+                job = None
+            except Exception:
+                # A dead worker would leave the queue stuck without a word
+                logger.exception("Could not claim an ingestion job, will retry")
+                job = None
+            if job is not None:
+                await self._run(job)
+                continue
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    wakeups.get(),
+                    settings.ingest_poll_interval,
+                )
+
+    async def _requeue_abandoned_jobs(self) -> None:
+        running = await fetch_ingest_jobs_with_status(
+            JobStatus.RUNNING.value,
+            MAX_FINISHED_JOBS,
+        )
+        for job_id, worker in running:
+            if worker is not None and _is_worker_alive(worker):
+                continue
+            logger.warning("Queueing again abandoned ingestion job %s", job_id)
+            await IngestJobRecord.filter(
+                id=job_id,
+                status=JobStatus.RUNNING.value,
+            ).update(
+                status=JobStatus.PENDING.value,
+                worker=None,
+                started_at=None,
+            )
+
+    async def _claim(self) -> Optional[IngestJob]:
+        # Checked on the read-only connections first, an idle worker does
+        # not take the write lock
+        if not await fetch_ingest_jobs_with_status(JobStatus.PENDING.value, 1):
+            return None
+        async with in_write_transaction():
+            record = (
+                await IngestJobRecord.filter(status=JobStatus.PENDING.value)
+                .order_by("created_at")
+                .first()
+                .values()
+            )
+            if record is None:
+                return None
+            record.update(status=JobStatus.RUNNING.value, started_at=time.time())
+            await IngestJobRecord.filter(id=record["id"]).update(
+                status=record["status"],
+                started_at=record["started_at"],
+                worker=self.worker,
+            )
+
+        job = self.jobs.get(record["id"])
+        if job is None:
+            job = self.jobs[record["id"]] = IngestJob.from_record(record)
+        job.status = JobStatus.RUNNING
+        job.started_at = record["started_at"]
+        return job
+
+    async def _run(self, job: IngestJob) -> None:
+        try:
+            result = await UPLOADERS[job.kind](
+                job.path,
+                job.add_rows,
+                mode=job.mode,
+                fingerprint=job.fingerprint,
+            )
+        except Exception as exc:
+            logger.exception("Ingestion job %s failed", job.id)
+            job.status = JobStatus.FAILED
+            job.error = str(exc)
+        else:
+            if result.duplicate:
+                job.status = JobStatus.SKIPPED
+            else:
+                job.status = JobStatus.SUCCEEDED
+        job.finished_at = time.time()
+        await self._save_finished(job)
+        job.path.unlink(missing_ok=True)
+        job.done.set()
+
+    async def _save_finished(self, job: IngestJob) -> None:
+        while True:
+            try:
+                async with in_write_transaction():
+                    await IngestJobRecord.filter(id=job.id).update(
+                        status=job.status.value,
+                        rows_processed=job.rows_processed,
+                        error=job.error,
+                        finished_at=job.finished_at,
+                    )
+                    await delete_finished_ingest_jobs(MAX_FINISHED_JOBS)
+            except LOCKED_ERRORS:
+                # The rows are committed, the job must not be run again
+                logger.warning("Could not save ingestion job %s, will retry", job.id)
+                await asyncio.sleep(settings.ingest_poll_interval)
+            else:
+                return
+
+    def _forget_finished_jobs(self) -> None:
+        finished = [job for job in self.jobs.values() if job.done.is_set()]
+        for job in finished[: max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job.id]
+
+
+ingest_jobs = IngestJobQueue()
+on_reset(ingest_jobs.reset)
@@ -1,107 +1,191 @@
-import csv
-from io import StringIO
-from faker import Faker
-from tortoise.transactions import in_transaction
-
-from gobble_cube.db.models import Product, Category, ProductCategory
-
-ALLOWED_FIELDS_IN_PRODUCT_CSV = [
-    "product_id",
-    "category_id",
-]
-
-
-async def bulk_upload_products_from_csv(data):
+from typing import List, Optional, Set
+
+from gobble_cube.db.dao.bulk import bulk_insert
+from gobble_cube.db.dao.category_share_summary import (
+    fetch_categories_of_products,
+    refresh_category_daily_share_of_categories,
+)
+from gobble_cube.db.dao.data_versions import bump_data_versions
+from gobble_cube.db.models import Category, Product, ProductCategory, table_name
+from gobble_cube.db.transactions import in_write_transaction
+from gobble_cube.services.category_share_index import category_share_index
+from gobble_cube.services.cube import sales_cube
+from gobble_cube.services.data_versions import Versions
+from gobble_cube.services.formats import iter_upload_batches
+from gobble_cube.services.id_cache import KnownIdIndex
+from gobble_cube.services.idempotency import (
+    NaturalKeyReplacer,
+    UploadMode,
+    UploadResult,
+    is_known_upload,
+    record_upload,
+)
+from gobble_cube.services.ingest import (
+    CSVSchema,
+    CSVSource,
+    ProgressCallback,
+)
+from gobble_cube.services.product_categories import product_category_index
+from gobble_cube.services.sales_summary import (
+    refresh_sales_sketches_of_products,
+    sales_sketch_index,
+)
+from gobble_cube.state import on_reset
+
+PRODUCT_CSV_SCHEMA: CSVSchema = {
+    "product_id": int,
+    "category_id": int,
+}
+
+ALLOWED_FIELDS_IN_PRODUCT_CSV = list(PRODUCT_CSV_SCHEMA)
+
+# The categories of a product are replaced together in replace mode
+PRODUCT_NATURAL_KEY = ["product_id"]
+
+known_product_ids = KnownIdIndex(Product)
+known_category_ids = KnownIdIndex(Category)
+on_reset(known_product_ids.reset)
+on_reset(known_category_ids.reset)
+
+
+async def bulk_upload_products_from_csv(
+    data: CSVSource,
+    on_progress: Optional[ProgressCallback] = None,
+    mode: UploadMode = UploadMode.APPEND,
+    fingerprint: Optional[str] = None,
+) -> UploadResult:
     """
     Bulk upload products from a CSV file.
     If the category_id does not exist, a placeholder category is created.
-    """
-
-    # Use StringIO to treat the string as a file object
-    csv_reader = csv.DictReader(StringIO(data))
-
-    # Ensure field names are stripped of any whitespace
-    csv_reader.fieldnames = [field.strip() for field in csv_reader.fieldnames]
-
-    # Check if all required fields are present in the CSV
-    if not all(
-        field in csv_reader.fieldnames for field in ALLOWED_FIELDS_IN_PRODUCT_CSV
-    ):
-        raise ValueError(
-            "Invalid CSV file. Please make sure the file contains the "
-            "following columns: name, category_id."
-        )
-
-    product_ids = set()
-    category_ids = set()
 
-    product_category_relations = []
+    :param data: CSV text, or the uploaded file (CSV, gzip CSV, Parquet, Arrow).
+    :param on_progress: called with the number of rows after every batch.
+    :param mode: add the categories to the products, or replace
+        the categories of the products in the file.
+    :param fingerprint: content hash of the file, a file already
+        uploaded with the same hash is skipped.
 
-    async with in_transaction():
-        for row in csv_reader:
-            product_id = int(row["product_id"])
-            category_id = int(row["category_id"])
-
-            product_ids.add(product_id)
-            category_ids.add(category_id)
+    :return: number of rows written, or whether the file was skipped.
+    """
 
-            product_category_relations.append(
-                ProductCategory(product_id=product_id, category_id=category_id)
+    result = UploadResult()
+    replacer = NaturalKeyReplacer(
+        ProductCategory,
+        ALLOWED_FIELDS_IN_PRODUCT_CSV,
+        PRODUCT_NATURAL_KEY,
+    )
+    new_product_ids: Set[int] = set()
+    new_category_ids: Set[int] = set()
+    changed_categories: Set[int] = set()
+    changed_products: Set[int] = set()
+    versions: Versions = {}
+
+    async with in_write_transaction():
+        if fingerprint and await is_known_upload("product", fingerprint):
+            result.duplicate = True
+            return result
+
+        async for batch in iter_upload_batches(data, PRODUCT_CSV_SCHEMA):
+            new_product_ids.update(
+                await upsert_product(
+                    [product_id for product_id, _ in batch],
+                    new_product_ids,
+                ),
+            )
+            new_category_ids.update(
+                await upsert_category(
+                    [category_id for _, category_id in batch],
+                    new_category_ids,
+                ),
             )
 
-        await upsert_product(list(product_ids))
-        await upsert_category(list(category_ids))
-
-        await ProductCategory.bulk_create(
-            product_category_relations, ignore_conflicts=True
-        )
+            # Categories gaining or losing products are summed up again
+            changed_categories.update(category_id for _, category_id in batch)
+            changed_products.update(product_id for product_id, _ in batch)
+            if mode == UploadMode.REPLACE:
+                changed_categories.update(
+                    await fetch_categories_of_products(
+                        {product_id for product_id, _ in batch},
+                    ),
+                )
+                await replacer.delete_replaced(batch)
+            await bulk_insert(
+                ProductCategory,
+                ALLOWED_FIELDS_IN_PRODUCT_CSV,
+                batch,
+                ignore_conflicts=True,
+            )
+            result.rows += len(batch)
+            if on_progress:
+                on_progress(len(batch))
+
+        await refresh_category_daily_share_of_categories(changed_categories)
+        sketch_days = await refresh_sales_sketches_of_products(changed_products)
+        if fingerprint:
+            await record_upload("product", fingerprint, result.rows)
+        if result.rows:
+            versions = await bump_data_versions(
+                [table_name(ProductCategory)],
+                rewritten=mode == UploadMode.REPLACE,
+            )
 
+    # Only committed ids are added to the indexes
+    known_product_ids.add(new_product_ids)
+    known_category_ids.add(new_category_ids)
+    if result.rows:
+        await product_category_index.refresh_products(changed_products, versions)
+        await sales_cube.refresh_categories(versions)
+        await category_share_index.refresh_categories(changed_categories, versions)
+        await sales_sketch_index.refresh_days(sketch_days, versions)
 
-faker = Faker()
+    return result
 
 
-async def upsert_product(product_ids: list[int]):
+async def upsert_product(
+    product_ids: List[int],
+    pending: Optional[Set[int]] = None,
+) -> List[int]:
     """
     Upsert products.
     If the products do not exist, they are created.
 
     :param product_ids: list of product IDs.
+    :param pending: product IDs already created by the current transaction.
 
+    :return: IDs of the created products.
     """
 
-    # Get existing products and categories
-    existing_products = await Product.filter(id__in=product_ids).all()
-
-    existing_product_ids = {prod.id for prod in existing_products}
+    new_product_ids = await known_product_ids.missing(product_ids, pending)
+    await bulk_insert(
+        Product,
+        ["id", "name"],
+        [(pid, f"Product {pid}") for pid in new_product_ids],
+        ignore_conflicts=True,
+    )
 
-    # Create new products and categories if they don't exist
-    new_products = [
-        Product(id=pid, name=faker.name())
-        for pid in product_ids
-        if pid not in existing_product_ids
-    ]
+    return new_product_ids
 
-    if new_products:
-        await Product.bulk_create(new_products)
 
-
-async def upsert_category(category_ids: list[int]):
+async def upsert_category(
+    category_ids: List[int],
+    pending: Optional[Set[int]] = None,
+) -> List[int]:
     """
     Upsert categories.
     If the categories do not exist, they are created.
 
     :param category_ids: list of category IDs.
+    :param pending: category IDs already created by the current transaction.
 
+    :return: IDs of the created categories.
     """
 
-    existing_categories = await Category.filter(id__in=category_ids).all()
-    existing_category_ids = {cat.id for cat in existing_categories}
-
-    new_categories = [
-        Category(id=cid, name=faker.name())
-        for cid in category_ids
-        if cid not in existing_category_ids
-    ]
+    new_category_ids = await known_category_ids.missing(category_ids, pending)
+    await bulk_insert(
+        Category,
+        ["id", "name"],
+        [(cid, f"Category {cid}") for cid in new_category_ids],
+        ignore_conflicts=True,
+    )
 
-    if new_categories:
-        await Category.bulk_create(new_categories)
+    return new_category_ids
@@ -0,0 +1,281 @@
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from gobble_cube.db.dao.cube import fetch_product_categories
+from gobble_cube.db.models import ProductCategory, table_name
+from gobble_cube.services.data_versions import VersionedIndex, Versions
+from gobble_cube.state import on_reset
+
+Default = TypeVar("Default")
+
+# Products are found by their id while ids span at most this many times their
+# number, by a binary search of the ids otherwise
+DENSE_SPAN_FACTOR = 4
+
+
+class ProductCategoryMap:
+    """
+    Categories of every product, as compressed sparse rows.
+
+    The categories of ``products[i]`` are ``categories[offsets[i]:offsets[i + 1]]``,
+    three flat arrays of 64-bit integers instead of a list per product.
+    Products are sorted by id. When ids are dense enough, every id of their
+    range is kept, with no category for the missing ones, so a product is
+    found by a subtraction. Links are unique in the database, so a product
+    is in each of its categories once.
+
+    Maps are not changed once built, :meth:`patched` gives a new one.
+    """
+
+    def __init__(
+        self,
+        products: "array[int]",
+        offsets: "array[int]",
+        categories: "array[int]",
+    ) -> None:
+        self.products = products
+        self.offsets = offsets
+        self.categories = categories
+        self._first = products[0] if products else 0
+        self._dense = bool(products) and (
+            products[-1] - self._first + 1 == len(products)
+        )
+
+    @classmethod
+    def from_links(cls, links: Iterable[Tuple[int, int]]) -> "ProductCategoryMap":
+        """
+        Build the map of product to category links.
+
+        :param links: product id and category id pairs, in any order.
+        :return: map.
+        """
+        by_product: Dict[int, List[int]] = {}
+        for product_id, category_id in links:
+            by_product.setdefault(product_id, []).append(category_id)
+        return cls.from_rows(by_product)
+
+    @classmethod
+    def from_rows(cls, rows: Mapping[int, Sequence[int]]) -> "ProductCategoryMap":
+        """
+        Build the map of the categories of every product.
+
+        :param rows: categories by product id, products without any are left out.
+        :return: map.
+        """
+        ids = sorted(product_id for product_id, row in rows.items() if row)
+        if ids and ids[-1] - ids[0] + 1 <= DENSE_SPAN_FACTOR * len(ids):
+            ids = list(range(ids[0], ids[-1] + 1))
+        products, offsets, categories = array("q", ids), array("q", [0]), array("q")
+        for product_id in ids:
+            categories.extend(rows.get(product_id, ()))
+            offsets.append(len(categories))
+        return cls(products, offsets, categories)
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    def get(
+        self,
+        product_id: int,
+        default: Default,
+    ) -> Union[Sequence[int], Default]:
+        """
+        Get the categories of a product.
+
+        :param product_id: product id.
+        :param default: returned for a product without category.
+        :return: category ids.
+        """
+        if self._dense:
+            position = product_id - self._first
+            if position < 0 or position >= len(self.products):
+                return default
+        else:
+            position = bisect_left(self.products, product_id)
+            if position == len(self.products) or self.products[position] != product_id:
+                return default
+        start, stop = self.offsets[position], self.offsets[position + 1]
+        if start == stop:
+            return default
+        return self.categories[start:stop]
+
+    def items(self) -> Iterator[Tuple[int, Sequence[int]]]:
+        """
+        Iterate over the products with categories.
+
+        :yield: product id and its category ids, by product id.
+        """
+        offsets, categories = self.offsets, self.categories
+        for position, product_id in enumerate(self.products):
+            start, stop = offsets[position], offsets[position + 1]
+            if start != stop:
+                yield product_id, categories[start:stop]
+
+    def products_of(self, category_ids: Iterable[int]) -> List[int]:
+        """
+        Find the products of some categories.
+
+        :param category_ids: category ids.
+        :return: ids of the products in any of them, by product id.
+        """
+        wanted = set(category_ids)
+        return [
+            product_id for product_id, row in self.items() if not wanted.isdisjoint(row)
+        ]
+
+    def scatter_add(self, values: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+        """
+        Add the value of every product to each of its categories.
+
+        Products are summed up before, by SQL without any join, so this
+        runs once per product rather than once per row.
+
+        :param values: product id and value pairs, such as revenue in cents.
+        :return: summed value by category id, categories without any of
+            the products are left out.
+        """
+        totals: Dict[int, int] = {}
+        no_category: Sequence[int] = ()
+        for product_id, value in values:
+            row = self.get(product_id, no_category)
+            for category_id in row:
+                totals[category_id] = totals.get(category_id, 0) + value
+        return totals
+
+    def patched(self, rows: Mapping[int, Sequence[int]]) -> "ProductCategoryMap":
+        """
+        Build a map where some products have other categories.
+
+        The arrays are spliced: the rows of the unchanged products are
+        copied in runs between the changed ones, whose offsets are shifted
+        by the change of length. A dense map stays dense when new products
+        are close enough to its range.
+
+        :param rows: new categories by product id, empty to remove a product.
+        :return: new map, this one is left unchanged.
+        """
+        if not self.products:
+            return self.from_rows(rows)
+        # Products filling the range of a dense map have no category, None
+        changes: Dict[int, Optional[Sequence[int]]] = {
+            **self._fillers([product_id for product_id, row in rows.items() if row]),
+            **rows,
+        }
+        products, offsets, categories = array("q"), array("q", [0]), array("q")
+        position = 0
+        for product_id in sorted(changes):
+            found = bisect_left(self.products, product_id, position)
+            self._copy_rows(position, found, products, offsets, categories)
+            position = found
+            row = changes[product_id]
+            if found < len(self.products) and self.products[found] == product_id:
+                position += 1
+            elif row is not None and not row:
+                # A product without category has nothing to remove
+                continue
+            products.append(product_id)
+            categories.extend(row or ())
+            offsets.append(len(categories))
+        self._copy_rows(position, len(self.products), products, offsets, categories)
+        return ProductCategoryMap(products, offsets, categories)
+
+    def _fillers(self, product_ids: List[int]) -> Dict[int, None]:
+        if not self._dense:
+            return {}
+        first, last = self._first, self.products[-1]
+        added = [
+            product_id for product_id in product_ids if not first <= product_id <= last
+        ]
+        if not added:
+            return {}
+        low, high = min(first, *added), max(last, *added)
+        if high - low + 1 > DENSE_SPAN_FACTOR * (len(self.products) + len(added)):
+            return {}
+        return dict.fromkeys(chain(range(low, first), range(last + 1, high + 1)))
+
+    def _copy_rows(
+        self,
+        start: int,
+        stop: int,
+        products: "array[int]",
+        offsets: "array[int]",
+        categories: "array[int]",
+    ) -> None:
+        if start >= stop:
+            return
+        first, last = self.offsets[start], self.offsets[stop]
+        shift = len(categories) - first
+        products.extend(self.products[start:stop])
+        categories.extend(self.categories[first:last])
+        moved = self.offsets[start + 1 : stop + 1]
+        offsets.extend(moved if not shift else (offset + shift for offset in moved))
+
+
+class ProductCategoryIndex(VersionedIndex):
+    """
+    In-process product to category links, shared by the category rollups.
+
+    The links are read on first use or at startup, and again after another
+    process wrote product categories. Product uploads of this process read
+    again the links of the products they changed once committed, see
+    :meth:`refresh_products`, instead of the whole table.
+    """
+
+    tables = (table_name(ProductCategory),)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.map = ProductCategoryMap.from_rows({})
+
+    async def current(self) -> ProductCategoryMap:
+        """
+        Get the map, read again on first use and after writes of other processes.
+
+        :return: current map.
+        """
+        await self.load()
+        return self.map
+
+    async def refresh_products(
+        self,
+        product_ids: Iterable[int],
+        versions: Versions,
+    ) -> None:
+        """
+        Read again the links of some products, after their categories changed.
+
+        :param product_ids: changed products.
+        :param versions: versions the upload bumped its tables to.
+        """
+        if not self.advance(versions):
+            return
+        rows: Dict[int, List[int]] = {product_id: [] for product_id in product_ids}
+        if not rows:
+            return
+        for product_id, category_id in await fetch_product_categories(list(rows)):
+            rows[product_id].append(category_id)
+        self.map = self.map.patched(rows)
+
+    async def _build(self) -> bool:
+        self.map = ProductCategoryMap.from_links(await fetch_product_categories())
+        return True
+
+    def _clear(self) -> None:
+        self.map = ProductCategoryMap.from_rows({})
+
+
+product_category_index = ProductCategoryIndex()
+on_reset(product_category_index.reset)
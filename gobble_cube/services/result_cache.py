@@ -0,0 +1,147 @@
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from gobble_cube.services.data_versions import current_versions
+from gobble_cube.services.revenue_index import parse_day
+from gobble_cube.settings import settings
+from gobble_cube.state import on_reset
+
+T = TypeVar("T")
+
+
+def date_key(value: str) -> Hashable:
+    """
+    Normalize a date parameter of a query.
+
+    Dates in ``YYYY-MM-DD`` format are keyed by their day. The queries
+    compare other formats as text, so those are keyed by their text.
+
+    :param value: date given to the query.
+    :return: cache key of the date.
+    """
+    try:
+        return parse_day(value)
+    except ValueError:
+        return value
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of the results of the analytics services.
+
+    A result is stored with the committed data version of every table it
+    was computed from, shared by the worker processes. Uploads bump the
+    version of the tables they write to in their transaction, see
+    ``gobble_cube.db.dao.data_versions``, so a result computed from older
+    data is never returned, whichever worker wrote, and is eventually
+    evicted. Entries also expire after ``settings.result_cache_ttl``
+    seconds, for writes which do not bump the versions.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ) -> None:
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.versions: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def max_entries(self) -> int:
+        """Number of results kept, 0 disables the cache."""
+        if self._max_entries is None:
+            return settings.result_cache_max_entries
+        return self._max_entries
+
+    @property
+    def ttl(self) -> float:
+        """Seconds a result is kept."""
+        if self._ttl is None:
+            return settings.result_cache_ttl
+        return self._ttl
+
+    async def get_or_compute(
+        self,
+        name: str,
+        params: Hashable,
+        tables: Sequence[str],
+        compute: Callable[[], Awaitable[T]],
+    ) -> T:
+        """
+        Get a result from the cache, or compute and store it.
+
+        :param name: name of the query.
+        :param params: normalized parameters of the query.
+        :param tables: tables the result is computed from.
+        :param compute: computes the result.
+        :return: the result.
+        """
+        if self.max_entries <= 0:
+            return await compute()
+
+        # Versions are read first, data written meanwhile gets a new version
+        versions = await current_versions(tables)
+        self.versions.update(versions)
+        key = (name, params, tuple(versions.values()))
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+            self.expirations += 1
+
+        self.misses += 1
+        result = await compute()
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the counters of the cache.
+
+        :return: hits, misses, evictions, expirations, stored entries,
+            size limit and the table versions last read.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "versions": dict(self.versions),
+        }
+
+    def reset(self) -> None:
+        """Drop every result and reset the counters and versions."""
+        self._entries.clear()
+        self.versions.clear()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+
+result_cache = ResultCache()
+on_reset(result_cache.reset)
@@ -0,0 +1,137 @@
+from bisect import bisect_left, bisect_right
+from datetime import date
+from decimal import Decimal
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from gobble_cube.db.dao.sales_rollup import fetch_daily_revenue
+from gobble_cube.db.models import SalesTransaction, table_name
+from gobble_cube.services.data_versions import VersionedIndex, Versions
+from gobble_cube.state import on_reset
+
+
+def parse_day(value: str) -> int:
+    """
+    Parse a day given in ISO format.
+
+    :param value: date such as ``2024-01-31``.
+    :raises ValueError: if the date is not in ``YYYY-MM-DD`` format.
+    :return: ordinal of the day.
+    """
+    day = date.fromisoformat(value)
+    # Other formats compare differently with the stored dates
+    if day.isoformat() != value:
+        raise ValueError(f"Not a YYYY-MM-DD date: {value}")
+    return day.toordinal()
+
+
+class RevenuePrefixIndex(VersionedIndex):
+    """
+    In-process cumulative revenue of the days with sales, for fast totals.
+
+    The daily revenue rollup is loaded on first use or at startup, and
+    again after sales were written by another process. Only the days with
+    transactions are kept, sorted, so a lone outlier date such as
+    ``0001-01-01`` costs one entry. Cumulative sums of revenue and
+    transactions make the total of any period two binary searches and a
+    subtraction. Sales uploads of this process refresh the days they
+    touched once their transaction is committed, see :meth:`refresh_days`.
+    """
+
+    tables = (table_name(SalesTransaction),)
+
+    def __init__(self) -> None:
+        super().__init__()
+        # Revenue in cents and transactions of every day with sales
+        self._days: Dict[int, Tuple[int, int]] = {}
+        self._ordinals: List[int] = []
+        # Cumulative sums over the sorted days, with a leading 0
+        self._revenue_sums: List[int] = [0]
+        self._transaction_sums: List[int] = [0]
+
+    async def total(self, start_date: str, end_date: str) -> Optional[Decimal]:
+        """
+        Get the revenue of a period.
+
+        :param start_date: first day, ``YYYY-MM-DD``.
+        :param end_date: last day, ``YYYY-MM-DD``.
+        :raises ValueError: if a date is not in ``YYYY-MM-DD`` format.
+        :return: total revenue, None if there is no transaction in the period.
+        """
+        start, end = parse_day(start_date), parse_day(end_date)
+        await self.load()
+        revenue_cents, transactions = self._sums(start, end)
+        if not transactions:
+            return None
+        return Decimal(revenue_cents).scaleb(-2).normalize()
+
+    async def period_totals(
+        self,
+        starts: List[int],
+        end: int,
+    ) -> List[Tuple[int, int]]:
+        """
+        Get the revenue of consecutive periods.
+
+        :param starts: ordinal of the first day of every period, increasing.
+        :param end: ordinal of the last day of the last period.
+        :return: revenue in cents and number of transactions of every period.
+        """
+        await self.load()
+        stops = [*starts[1:], end + 1]
+        return [self._sums(start, stop - 1) for start, stop in zip(starts, stops)]
+
+    async def refresh_days(self, days: Iterable[str], versions: Versions) -> None:
+        """
+        Read again the rollup of some days, after their sales changed.
+
+        :param days: changed days.
+        :param versions: versions the upload bumped its tables to.
+        """
+        if not self.advance(versions):
+            return
+        days = list(days)
+        rows = await fetch_daily_revenue(days)
+        found = {row[0] for row in rows}
+        # Days without a rollup row have no transaction left
+        rows.extend((day, 0, 0) for day in days if day not in found)
+        self._set_days(rows)
+
+    async def _build(self) -> bool:
+        self._set_days(await fetch_daily_revenue(), replace_all=True)
+        return True
+
+    def _clear(self) -> None:
+        self._set_days([], replace_all=True)
+
+    def _sums(self, start: int, end: int) -> Tuple[int, int]:
+        first = bisect_left(self._ordinals, start)
+        stop = bisect_right(self._ordinals, end)
+        if first >= stop:
+            return 0, 0
+        return (
+            self._revenue_sums[stop] - self._revenue_sums[first],
+            self._transaction_sums[stop] - self._transaction_sums[first],
+        )
+
+    def _set_days(
+        self,
+        rows: List[Tuple[str, int, int]],
+        replace_all: bool = False,
+    ) -> None:
+        if replace_all:
+            self._days = {}
+        for day, cents, count in rows:
+            ordinal = parse_day(str(day))
+            if count:
+                self._days[ordinal] = (cents, count)
+            else:
+                self._days.pop(ordinal, None)
+        self._ordinals = sorted(self._days)
+        totals = [self._days[ordinal] for ordinal in self._ordinals]
+        self._revenue_sums = [0, *accumulate(cents for cents, _ in totals)]
+        self._transaction_sums = [0, *accumulate(count for _, count in totals)]
+
+
+revenue_index = RevenuePrefixIndex()
+on_reset(revenue_index.reset)
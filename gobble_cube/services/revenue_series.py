@@ -0,0 +1,156 @@
+import enum
+from bisect import bisect_right
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from gobble_cube.db.dao.sales_rollup import fetch_product_daily_revenue_for_period
+from gobble_cube.db.models import ProductCategory, SalesTransaction, table_name
+from gobble_cube.services.result_cache import result_cache
+from gobble_cube.services.revenue_index import parse_day, revenue_index
+from gobble_cube.settings import settings
+
+
+class Bucket(str, enum.Enum):
+    """Period summed into a point of a revenue series."""
+
+    DAY = "day"
+    # Weeks start on Monday
+    WEEK = "week"
+    MONTH = "month"
+
+
+def count_buckets(start: date, end: date, bucket: Bucket) -> int:
+    """
+    Count the periods a date range overlaps.
+
+    :param start: first day.
+    :param end: last day, not before the first one.
+    :param bucket: period.
+    :return: number of periods.
+    """
+    if bucket == Bucket.DAY:
+        return (end - start).days + 1
+    if bucket == Bucket.WEEK:
+        weeks = end.toordinal() - end.weekday() - start.toordinal() + start.weekday()
+        return weeks // 7 + 1
+    return (end.year - start.year) * 12 + end.month - start.month + 1
+
+
+def bucket_starts(start: date, end: date, bucket: Bucket) -> List[date]:
+    """
+    Get the first day of every period a date range overlaps.
+
+    :param start: first day.
+    :param end: last day, not before the first one.
+    :param bucket: period.
+    :return: first days, the first period starting at or before ``start``.
+    """
+    if bucket == Bucket.DAY:
+        first = start.toordinal()
+        return [date.fromordinal(first + day) for day in range((end - start).days + 1)]
+    if bucket == Bucket.WEEK:
+        first = start.toordinal() - start.weekday()
+        return [
+            date.fromordinal(first + 7 * week)
+            for week in range(count_buckets(start, end, bucket))
+        ]
+    months = start.year * 12 + start.month - 1
+    return [
+        date((months + month) // 12, (months + month) % 12 + 1, 1)
+        for month in range(count_buckets(start, end, bucket))
+    ]
+
+
+async def get_revenue_series(
+    start_date: str,
+    end_date: str,
+    bucket: Bucket,
+    product_id: Optional[int] = None,
+    category_id: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Get the revenue of every period of a date range.
+
+    Series are kept in the result cache until the next sales or product
+    upload.
+
+    :param start_date: first day, ``YYYY-MM-DD``.
+    :param end_date: last day, ``YYYY-MM-DD``.
+    :param bucket: period of a point.
+    :param product_id: only count the sales of this product.
+    :param category_id: only count the sales of the products of this category.
+    :raises ValueError: if a date is not in ``YYYY-MM-DD`` format, if both
+        filters are given, or if the series has more than
+        ``settings.revenue_series_max_points`` points.
+    :return: first day of the period, revenue and number of transactions,
+        a point per period, periods without sales included.
+    """
+    start, end = parse_day(start_date), parse_day(end_date)
+    if product_id is not None and category_id is not None:
+        raise ValueError("Filter by product or by category, not both")
+    if start > end:
+        return []
+    points = count_buckets(date.fromordinal(start), date.fromordinal(end), bucket)
+    if points > settings.revenue_series_max_points:
+        raise ValueError(
+            f"The series has {points} points, more than the "
+            f"{settings.revenue_series_max_points} allowed, "
+            "use a shorter range or a larger bucket",
+        )
+
+    return await result_cache.get_or_compute(
+        "revenue_series",
+        (start, end, bucket.value, product_id, category_id),
+        [table_name(SalesTransaction), table_name(ProductCategory)],
+        lambda: compute_revenue_series(start, end, bucket, product_id, category_id),
+    )
+
+
+async def compute_revenue_series(
+    start: int,
+    end: int,
+    bucket: Bucket,
+    product_id: Optional[int] = None,
+    category_id: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Compute a revenue series, without the result cache.
+
+    The revenue of every period is two lookups in the in-process revenue
+    index. Series of a product or category are summed from the product
+    daily revenue rollup, a row per day with sales.
+
+    :param start: ordinal of the first day.
+    :param end: ordinal of the last day.
+    :param bucket: period of a point.
+    :param product_id: only count the sales of this product.
+    :param category_id: only count the sales of the products of this category.
+    :return: points, see :func:`get_revenue_series`.
+    """
+    starts = bucket_starts(date.fromordinal(start), date.fromordinal(end), bucket)
+    ordinals = [day.toordinal() for day in starts]
+    if product_id is None and category_id is None:
+        # The first period is counted from the first day of the range
+        totals = await revenue_index.period_totals([start, *ordinals[1:]], end)
+    else:
+        totals = [(0, 0)] * len(starts)
+        rows = await fetch_product_daily_revenue_for_period(
+            date.fromordinal(start).isoformat(),
+            date.fromordinal(end).isoformat(),
+            product_id,
+            category_id,
+        )
+        for day, revenue_cents, transactions in rows:
+            position = bisect_right(ordinals, parse_day(str(day))) - 1
+            cents, count = totals[position]
+            totals[position] = (cents + revenue_cents, count + transactions)
+
+    return [
+        {
+            "date": day,
+            "revenue": Decimal(revenue_cents).scaleb(-2).normalize(),
+            "transactions": transactions,
+        }
+        for day, (revenue_cents, transactions) in zip(starts, totals)
+    ]
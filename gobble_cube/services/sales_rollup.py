@@ -0,0 +1,65 @@
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
+
+from gobble_cube.db.dao import sales_rollup
+from gobble_cube.db.dao.data_versions import bump_data_versions
+from gobble_cube.db.dao.sales_rollup import SalesRollupRow
+from gobble_cube.db.models import SalesTransaction, table_name
+from gobble_cube.db.transactions import in_write_transaction
+from gobble_cube.services.revenue_index import revenue_index
+
+logger = logging.getLogger(__name__)
+
+
+def aggregate_sales_batch(batch: Sequence[Tuple[Any, ...]]) -> List[SalesRollupRow]:
+    """
+    Aggregate a batch of uploaded sales transactions by product and day.
+
+    :param batch: rows in the order of the sales transaction upload schema,
+        product id, quantity, revenue in cents and date.
+    :return: product id, date, revenue in cents, quantity and number of
+        transactions, one row per product and day.
+    """
+    totals: Dict[Tuple[int, str], List[int]] = {}
+    for product_id, quantity, revenue_cents, day in batch:
+        total = totals.get((product_id, day))
+        if total is None:
+            totals[product_id, day] = [revenue_cents, quantity, 1]
+        else:
+            total[0] += revenue_cents
+            total[1] += quantity
+            total[2] += 1
+    return [
+        (product_id, day, revenue_cents, quantity, transactions)
+        for (product_id, day), (revenue_cents, quantity, transactions) in totals.items()
+    ]
+
+
+async def rebuild_sales_rollups() -> None:
+    """
+    Recompute the daily revenue rollups from the sales transactions.
+
+    The version of the sales transactions is bumped as for a rewrite, so
+    every process builds its indexes again, see
+    :class:`gobble_cube.services.data_versions.VersionedIndex`.
+    """
+    async with in_write_transaction():
+        await sales_rollup.rebuild_sales_rollups()
+        await bump_data_versions([table_name(SalesTransaction)], rewritten=True)
+    revenue_index.reset()
+
+
+async def check_sales_rollups() -> List[Dict[str, Any]]:
+    """
+    Compare the daily revenue rollups with the sales transactions.
+
+    :return: differing rows, empty when the rollups are consistent.
+    """
+    return await sales_rollup.find_sales_rollup_differences()
+
+
+async def ensure_sales_rollups() -> None:
+    """Build the rollups of a database holding transactions but no rollups."""
+    if await sales_rollup.rollups_are_missing():
+        logger.info("Building the daily revenue rollups")
+        await rebuild_sales_rollups()
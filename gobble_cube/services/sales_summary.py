@@ -0,0 +1,579 @@
+import logging
+import math
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from gobble_cube.db.dao import sales_summary
+from gobble_cube.db.dao.data_versions import bump_data_versions
+from gobble_cube.db.dao.sales_rollup import fetch_daily_revenue
+from gobble_cube.db.dao.sales_summary import DailySalesSketchRow
+from gobble_cube.db.models import ProductCategory, SalesTransaction, table_name
+from gobble_cube.db.transactions import in_write_transaction
+from gobble_cube.services.data_versions import VersionedIndex, Versions
+from gobble_cube.services.result_cache import result_cache
+from gobble_cube.services.revenue_index import parse_day
+from gobble_cube.services.sketches import HeavyHitters, HyperLogLog, TDigest
+from gobble_cube.settings import settings
+from gobble_cube.state import on_reset
+
+logger = logging.getLogger(__name__)
+
+# Quantiles of a summary when none are asked for
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+# Standard normal quantile of a 95% confidence interval
+CONFIDENCE_Z = 1.96
+
+# Days of sales transactions read at a time when sketches are rebuilt
+REBUILD_CHUNK_DAYS = 100
+
+
+def top_sales_summary() -> HeavyHitters:
+    """
+    Get an empty summary of the products or categories of largest revenue.
+
+    :return: summary of ``settings.top_sales_capacity`` counters.
+    """
+    return HeavyHitters(settings.top_sales_capacity)
+
+
+@dataclass
+class SalesSketch:
+    """Sketches of the sales transactions of a day or of a period."""
+
+    transactions: int = 0
+    products: HyperLogLog = field(default_factory=HyperLogLog)
+    categories: HyperLogLog = field(default_factory=HyperLogLog)
+    # Revenue is in cents
+    revenue: TDigest = field(default_factory=TDigest)
+    quantity: TDigest = field(default_factory=TDigest)
+    # Products and categories by revenue in cents
+    top_products: HeavyHitters = field(default_factory=top_sales_summary)
+    top_categories: HeavyHitters = field(default_factory=top_sales_summary)
+
+    @staticmethod
+    def merge_all(sketches: Sequence["SalesSketch"]) -> "SalesSketch":
+        """
+        Get the sketch of the transactions of any of some sketches.
+
+        :param sketches: sketches, at least one.
+        :return: new sketch.
+        """
+        first = sketches[0]
+        products, categories = first.products, first.categories
+        top_products, top_categories = first.top_products, first.top_categories
+        for sketch in sketches[1:]:
+            products = products.merge(sketch.products)
+            categories = categories.merge(sketch.categories)
+            top_products = top_products.merge(sketch.top_products)
+            top_categories = top_categories.merge(sketch.top_categories)
+        return SalesSketch(
+            sum(sketch.transactions for sketch in sketches),
+            products,
+            categories,
+            TDigest.merge_all([sketch.revenue for sketch in sketches]),
+            TDigest.merge_all([sketch.quantity for sketch in sketches]),
+            top_products,
+            top_categories,
+        )
+
+    def to_row(self, day: str) -> DailySalesSketchRow:
+        """
+        Serialize the sketch of a day.
+
+        :param day: date.
+        :return: row of the daily sales sketch table.
+        """
+        return (
+            day,
+            self.transactions,
+            self.products.to_bytes(),
+            self.categories.to_bytes(),
+            self.revenue.to_bytes(),
+            self.quantity.to_bytes(),
+            self.top_products.to_bytes(),
+            self.top_categories.to_bytes(),
+        )
+
+    @classmethod
+    def from_row(cls, row: DailySalesSketchRow) -> "SalesSketch":
+        """
+        Read the sketch of a day.
+
+        :param row: row of the daily sales sketch table.
+        :return: sketch.
+        """
+        _, transactions, products, categories, revenue, quantity, *top = row
+        return cls(
+            transactions,
+            HyperLogLog.from_bytes(products),
+            HyperLogLog.from_bytes(categories),
+            TDigest.from_bytes(revenue),
+            TDigest.from_bytes(quantity),
+            HeavyHitters.from_bytes(top[0]),
+            HeavyHitters.from_bytes(top[1]),
+        )
+
+
+class SketchSegmentTree:
+    """
+    Merged sketch of any range of days, merging a logarithmic number of nodes.
+
+    Leaves hold the sketches of the days, every other node the merge of
+    its two children, as in ``MinMaxSegmentTree``.
+    """
+
+    def __init__(self, sketches: List[SalesSketch]) -> None:
+        self.size = len(sketches)
+        self._nodes = [SalesSketch()] * self.size + sketches
+        for node in range(self.size - 1, 0, -1):
+            self._nodes[node] = self._merge(2 * node)
+
+    def update(self, position: int, sketch: SalesSketch) -> None:
+        """
+        Set the sketch of a day.
+
+        :param position: index of the day.
+        :param sketch: sketch.
+        """
+        node = position + self.size
+        self._nodes[node] = sketch
+        while node > 1:
+            node //= 2
+            self._nodes[node] = self._merge(2 * node)
+
+    def query(self, start: int, stop: int) -> SalesSketch:
+        """
+        Get the merged sketch of a range of days.
+
+        :param start: index of the first day.
+        :param stop: index after the last day, greater than ``start``.
+        :return: merged sketch.
+        """
+        first, last = start + self.size, stop + self.size
+        nodes: List[SalesSketch] = []
+        while first < last:
+            if first & 1:
+                nodes.append(self._nodes[first])
+                first += 1
+            if last & 1:
+                last -= 1
+                nodes.append(self._nodes[last])
+            first //= 2
+            last //= 2
+        return SalesSketch.merge_all(nodes)
+
+    def _merge(self, left: int) -> SalesSketch:
+        children = [self._nodes[left], self._nodes[left + 1]]
+        return SalesSketch.merge_all(children)
+
+
+class SalesSketchIndex(VersionedIndex):
+    """
+    In-process daily sales sketches, merged for any period.
+
+    The daily sales sketch table is loaded on first use or at startup, and
+    again after sales or product categories were written by another
+    process, under a :class:`SketchSegmentTree`. Uploads of this process
+    refresh the days they touched once their transaction is committed, see
+    :meth:`refresh_days`. Days missing from the tree are added by building
+    it again on the next query.
+    """
+
+    tables = (table_name(SalesTransaction), table_name(ProductCategory))
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._days: List[int] = []
+        self._sketches: Dict[int, SalesSketch] = {}
+        self._tree: Optional[SketchSegmentTree] = None
+
+    async def period(self, start_date: str, end_date: str) -> Optional[SalesSketch]:
+        """
+        Get the merged sketch of the transactions of a period.
+
+        :param start_date: first day, ``YYYY-MM-DD``.
+        :param end_date: last day, ``YYYY-MM-DD``.
+        :raises ValueError: if a date is not in ``YYYY-MM-DD`` format.
+        :return: sketch, None if there is no transaction in the period.
+        """
+        start, end = parse_day(start_date), parse_day(end_date)
+        await self.load()
+        if self._tree is None:
+            self._days = sorted(self._sketches)
+            self._tree = SketchSegmentTree(
+                [self._sketches[day] for day in self._days],
+            )
+        first = bisect_left(self._days, start)
+        stop = bisect_right(self._days, end)
+        if first >= stop:
+            return None
+        return self._tree.query(first, stop)
+
+    async def refresh_days(self, days: Iterable[str], versions: Versions) -> None:
+        """
+        Read again the sketches of some days, after their sales changed.
+
+        :param days: changed days.
+        :param versions: versions the upload bumped its tables to.
+        """
+        if not self.advance(versions):
+            return
+        days = list(days)
+        if not days:
+            return
+        rows = await sales_summary.fetch_daily_sales_sketches(days)
+        found = {str(row[0]) for row in rows}
+        for day in days:
+            if day in found:
+                continue
+            if self._sketches.pop(parse_day(day), None) is not None:
+                # Days without transactions left are dropped from the tree
+                self._tree = None
+        self._set_rows(rows)
+
+    async def _build(self) -> bool:
+        self._clear()
+        self._set_rows(await sales_summary.fetch_daily_sales_sketches())
+        return True
+
+    def _clear(self) -> None:
+        self._days, self._sketches, self._tree = [], {}, None
+
+    def _set_rows(self, rows: List[DailySalesSketchRow]) -> None:
+        for row in rows:
+            day = parse_day(str(row[0]))
+            sketch = SalesSketch.from_row(row)
+            self._sketches[day] = sketch
+            position = bisect_left(self._days, day)
+            if (
+                self._tree is not None
+                and position < len(self._days)
+                and self._days[position] == day
+            ):
+                self._tree.update(position, sketch)
+            else:
+                self._tree = None
+
+
+sales_sketch_index = SalesSketchIndex()
+on_reset(sales_sketch_index.reset)
+
+
+def digest_sales_batch(
+    batch: Sequence[Tuple[Any, ...]],
+) -> Dict[str, Tuple[TDigest, TDigest]]:
+    """
+    Digest the revenue and quantity of a batch of uploaded sales transactions.
+
+    :param batch: rows in the order of the sales transaction upload schema,
+        product id, quantity, revenue in cents and date.
+    :return: revenue in cents and quantity digests, by date.
+    """
+    digests: Dict[str, Tuple[TDigest, TDigest]] = {}
+    for _, quantity, revenue_cents, day in batch:
+        day_digests = digests.get(day)
+        if day_digests is None:
+            day_digests = digests[day] = (TDigest(), TDigest())
+        day_digests[0].add(revenue_cents)
+        day_digests[1].add(quantity)
+    return digests
+
+
+def merge_digests(
+    digests: Dict[str, Tuple[TDigest, TDigest]],
+    others: Dict[str, Tuple[TDigest, TDigest]],
+) -> None:
+    """
+    Merge digests of days into others, such as those of an upload.
+
+    :param digests: revenue and quantity digests by date, updated.
+    :param others: revenue and quantity digests by date.
+    """
+    for day, (revenue, quantity) in others.items():
+        mine = digests.get(day)
+        digests[day] = (
+            (revenue, quantity)
+            if mine is None
+            else (mine[0].merge(revenue), mine[1].merge(quantity))
+        )
+
+
+async def refresh_sales_sketches(
+    days: Iterable[str],
+    added: Optional[Dict[str, Tuple[TDigest, TDigest]]] = None,
+    rebuild: bool = False,
+) -> None:
+    """
+    Update the sketches of some days, after their sales or products changed.
+
+    Transactions, products and categories of a day are read from the
+    rollups, so the rollups must be up to date. Revenue and quantity
+    digests cannot forget values, they are either added to, or rebuilt
+    from the sales transactions of the day.
+
+    :param days: changed days.
+    :param added: revenue and quantity digests of added transactions, by date.
+    :param rebuild: digest the sales transactions of the days again.
+    """
+    days = sorted(set(days))
+    if not days:
+        return
+
+    sketches = {day: SalesSketch() for day in days}
+    if rebuild:
+        for day, revenue_cents, quantity in await sales_summary.fetch_sales_of_days(
+            days,
+        ):
+            sketch = sketches[str(day)]
+            sketch.revenue.add(revenue_cents)
+            sketch.quantity.add(quantity)
+    else:
+        for row in await sales_summary.fetch_daily_sales_sketches(days):
+            stored = SalesSketch.from_row(row)
+            sketch = sketches[str(row[0])]
+            sketch.revenue, sketch.quantity = stored.revenue, stored.quantity
+        for day, (added_revenue, added_quantity) in (added or {}).items():
+            sketch = sketches[day]
+            sketch.revenue = sketch.revenue.merge(added_revenue)
+            sketch.quantity = sketch.quantity.merge(added_quantity)
+
+    # Rows are by category of a product, so a product comes once per category
+    products: Set[Tuple[str, int]] = set()
+    for (
+        day,
+        product_id,
+        category_id,
+        revenue_cents,
+    ) in await sales_summary.fetch_products_of_days(days):
+        sketch = sketches[str(day)]
+        if (day, product_id) not in products:
+            products.add((day, product_id))
+            sketch.products.add(product_id)
+            sketch.top_products.add(product_id, revenue_cents)
+        if category_id is not None:
+            sketch.categories.add(category_id)
+            sketch.top_categories.add(category_id, revenue_cents)
+    for sketch in sketches.values():
+        sketch.transactions = int(sketch.revenue.count)
+
+    await sales_summary.save_daily_sales_sketches(
+        [sketch.to_row(day) for day, sketch in sketches.items() if sketch.transactions],
+        [day for day, sketch in sketches.items() if not sketch.transactions],
+    )
+
+
+async def refresh_sales_sketches_of_products(product_ids: Iterable[int]) -> List[str]:
+    """
+    Count again the categories sold on the days some products were sold.
+
+    :param product_ids: products whose categories changed.
+    :return: updated days.
+    """
+    days = await sales_summary.fetch_days_of_products(product_ids)
+    await refresh_sales_sketches(days)
+    return days
+
+
+async def rebuild_sales_sketches() -> None:
+    """
+    Recompute the daily sales sketches from the sales transactions.
+
+    The version of the sales transactions is bumped as for a rewrite, so
+    every process builds its index again.
+    """
+    async with in_write_transaction():
+        await sales_summary.delete_daily_sales_sketches()
+        # Days with sales, the rollups are built first
+        days = [str(row[0]) for row in await fetch_daily_revenue()]
+        for start in range(0, len(days), REBUILD_CHUNK_DAYS):
+            await refresh_sales_sketches(
+                days[start : start + REBUILD_CHUNK_DAYS],
+                rebuild=True,
+            )
+        await bump_data_versions([table_name(SalesTransaction)], rewritten=True)
+    sales_sketch_index.reset()
+
+
+async def ensure_sales_sketches() -> None:
+    """Build the sketches of a database holding transactions but no sketches."""
+    if await sales_summary.sales_sketches_are_missing():
+        logger.info("Building the daily sales sketches")
+        await rebuild_sales_sketches()
+
+
+def parse_quantiles(quantiles: str) -> List[float]:
+    """
+    Parse comma separated quantiles.
+
+    :param quantiles: quantiles such as ``0.5,0.99``.
+    :raises ValueError: if a quantile is not a number between 0 and 1.
+    :return: quantiles.
+    """
+    try:
+        values = [float(value) for value in quantiles.split(",")]
+    except ValueError:
+        raise ValueError(f"Invalid quantiles: {quantiles}") from None
+    if not all(0 <= value <= 1 for value in values):
+        raise ValueError(f"Quantiles must be between 0 and 1: {quantiles}")
+    return values
+
+
+async def get_sales_summary(
+    start_date: str,
+    end_date: str,
+    quantiles: Sequence[float] = DEFAULT_QUANTILES,
+    approximate: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """
+    Summarize the sales transactions of a period.
+
+    Summaries are kept in the result cache until the next sales or product
+    upload.
+
+    :param start_date: first day, ``YYYY-MM-DD``.
+    :param end_date: last day, ``YYYY-MM-DD``.
+    :param quantiles: quantiles of revenue and quantity, between 0 and 1.
+    :param approximate: answer from the daily sketches, with intervals.
+    :raises ValueError: if a date is not in ``YYYY-MM-DD`` format.
+    :return: summary, see :func:`format_summary`, None if there is no
+        transaction in the period.
+    """
+    start, end = parse_day(start_date), parse_day(end_date)
+    compute = (
+        compute_approximate_sales_summary
+        if approximate
+        else compute_exact_sales_summary
+    )
+    return await result_cache.get_or_compute(
+        "sales_summary",
+        (start, end, tuple(quantiles), approximate),
+        [table_name(SalesTransaction), table_name(ProductCategory)],
+        lambda: compute(start_date, end_date, quantiles),
+    )
+
+
+async def compute_approximate_sales_summary(
+    start_date: str,
+    end_date: str,
+    quantiles: Sequence[float],
+) -> Optional[Dict[str, Any]]:
+    """
+    Summarize a period from the merged sketches of its days.
+
+    Distinct counts are given with their 95% confidence interval, from the
+    standard error of HyperLogLog. Quantiles are bounded by the weight of
+    the t-digest centroid they fall in, the values it summarizes being only
+    known by their mean.
+
+    :param start_date: first day.
+    :param end_date: last day.
+    :param quantiles: quantiles of revenue and quantity.
+    :return: summary, None if there is no transaction in the period.
+    """
+    sketch = await sales_sketch_index.period(start_date, end_date)
+    if sketch is None:
+        return None
+
+    counts = {}
+    for name, sketch_of_name in (
+        ("products", sketch.products),
+        ("categories", sketch.categories),
+    ):
+        estimate = sketch_of_name.estimate()
+        margin = CONFIDENCE_Z * sketch_of_name.standard_error * estimate
+        # Distinct values cannot outnumber the transactions
+        counts[name] = (
+            min(round(estimate), sketch.transactions),
+            max(math.floor(estimate - margin), 0),
+            min(math.ceil(estimate + margin), sketch.transactions),
+        )
+
+    values: Dict[str, List[Tuple[float, float, float]]] = {}
+    for name, digest in (("revenue", sketch.revenue), ("quantity", sketch.quantity)):
+        values[name] = [digest.quantile_estimate(q) for q in quantiles]
+    return format_summary(sketch.transactions, counts, quantiles, values, True)
+
+
+async def compute_exact_sales_summary(
+    start_date: str,
+    end_date: str,
+    quantiles: Sequence[float],
+) -> Optional[Dict[str, Any]]:
+    """
+    Summarize a period from its sales transactions.
+
+    Quantiles are the values of rank ``ceil(q * transactions)``.
+
+    :param start_date: first day.
+    :param end_date: last day.
+    :param quantiles: quantiles of revenue and quantity.
+    :return: summary, None if there is no transaction in the period.
+    """
+    (
+        transactions,
+        products,
+        categories,
+    ) = await sales_summary.fetch_sales_counts_for_period(start_date, end_date)
+    if not transactions:
+        return None
+
+    values: Dict[str, List[Tuple[float, float, float]]] = {}
+    for name in ("revenue", "quantity"):
+        values[name] = []
+        for q in quantiles:
+            value = await sales_summary.fetch_ranked_sales_value(
+                name,
+                start_date,
+                end_date,
+                max(math.ceil(q * transactions), 1),
+            )
+            values[name].append((value, value, value))
+    counts = {
+        "products": (products, products, products),
+        "categories": (categories, categories, categories),
+    }
+    return format_summary(transactions, counts, quantiles, values, False)
+
+
+def format_summary(
+    transactions: int,
+    counts: Dict[str, Tuple[int, int, int]],
+    quantiles: Sequence[float],
+    values: Dict[str, List[Tuple[float, float, float]]],
+    approximate: bool,
+) -> Dict[str, Any]:
+    """
+    Format a summary of sales transactions.
+
+    :param transactions: number of transactions.
+    :param counts: estimate, lower and upper bound of the distinct
+        ``products`` and ``categories``.
+    :param quantiles: quantiles.
+    :param values: estimate, lower and upper bound of every quantile of
+        ``revenue``, in cents, and ``quantity``.
+    :param approximate: whether the summary is estimated.
+    :return: transactions, products, categories, revenue and quantity
+        quantiles, every estimate with its ``low`` and ``high`` bounds,
+        equal to it for exact summaries.
+    """
+
+    def cents(value: float) -> Decimal:
+        return Decimal(value).scaleb(-2).normalize()
+
+    summary: Dict[str, Any] = {"approximate": approximate, "transactions": transactions}
+    for name, (estimate, low, high) in counts.items():
+        summary[name] = {"estimate": estimate, "low": low, "high": high}
+    for name, rounded in (("revenue", cents), ("quantity", int)):
+        summary[f"{name}_quantiles"] = [
+            {
+                "quantile": q,
+                "estimate": rounded(round(estimate)),
+                "low": rounded(math.floor(low)),
+                "high": rounded(math.ceil(high)),
+            }
+            for q, (estimate, low, high) in zip(quantiles, values[name])
+        ]
+    return summary
@@ -1,11 +1,49 @@
-import csv
-from io import StringIO
-from typing import List
+from decimal import Decimal
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
 
-from tortoise.functions import Sum
-from tortoise.transactions import in_transaction
-
-from gobble_cube.db.models import SalesTransaction
+from gobble_cube.db.dao.bulk import bulk_insert
+from gobble_cube.db.dao.cube import fetch_cuboid, stream_cuboid
+from gobble_cube.db.dao.data_versions import bump_data_versions
+from gobble_cube.db.dao.sales_rollup import (
+    add_to_sales_rollups,
+    fetch_revenue_cents_for_period,
+    refresh_sales_rollups,
+)
+from gobble_cube.db.models import ProductCategory, SalesTransaction, table_name
+from gobble_cube.db.transactions import in_write_transaction
+from gobble_cube.services.cube import (
+    cell_formatter,
+    format_cells,
+    ordered,
+    sales_cube,
+)
+from gobble_cube.services.data_versions import Versions
+from gobble_cube.services.formats import iter_upload_batches
+from gobble_cube.services.idempotency import (
+    NaturalKeyReplacer,
+    UploadMode,
+    UploadResult,
+    is_known_upload,
+    record_upload,
+)
+from gobble_cube.services.ingest import (
+    CSVSchema,
+    CSVSource,
+    ProgressCallback,
+    parse_date,
+    scaled_integer_converter,
+)
+from gobble_cube.services.result_cache import date_key, result_cache
+from gobble_cube.services.revenue_index import revenue_index
+from gobble_cube.services.sales_rollup import aggregate_sales_batch
+from gobble_cube.services.sales_summary import (
+    digest_sales_batch,
+    merge_digests,
+    refresh_sales_sketches,
+    sales_sketch_index,
+)
+from gobble_cube.services.sketches import TDigest
+from gobble_cube.services.utils import decode_cursor, encode_cursor
 
 AVAILABLE_DIMENTIONS = ["category", "product", "quantity", "revenue", "date"]
 
@@ -17,107 +55,295 @@ AVAILABLE_DIMENTIONS_TO_MODELS_MAP = {
     "date": "date",
 }
 
-ALLOWED_FIELDS_IN_SALES_TRANSACTION_CSV = ["product_id", "quantity", "revenue", "date"]
+SALES_TRANSACTION_CSV_SCHEMA: CSVSchema = {
+    "product_id": int,
+    "quantity": int,
+    "revenue": scaled_integer_converter(2),
+    "date": parse_date,
+}
+
+ALLOWED_FIELDS_IN_SALES_TRANSACTION_CSV = list(SALES_TRANSACTION_CSV_SCHEMA)
+
+# Rows of a product on a day are replaced together in replace mode
+SALES_TRANSACTION_NATURAL_KEY = ["product_id", "date"]
+
+# Rows of streamed sales data read from the database at a time
+STREAM_CHUNK_SIZE = 5000
 
 
-async def bulk_upload_sales_transactions_from_csv(data) -> None:
+async def bulk_upload_sales_transactions_from_csv(
+    data: CSVSource,
+    on_progress: Optional[ProgressCallback] = None,
+    mode: UploadMode = UploadMode.APPEND,
+    fingerprint: Optional[str] = None,
+) -> UploadResult:
     """
     Upload sales transactions from a CSV file.
 
-    :param data: data from the CSV file.
+    The file is parsed while it is read and the rows are written
+    in batches, so the whole file is never held in memory. Rows go
+    straight to the database without building model instances.
+    The daily revenue rollups and sales sketches are updated in the same
+    transaction.
+
+    :param data: CSV text, or the uploaded file (CSV, gzip CSV, Parquet, Arrow).
+    :param on_progress: called with the number of rows after every batch.
+    :param mode: append the rows, or replace the stored transactions
+        of the products and days in the file.
+    :param fingerprint: content hash of the file, a file already
+        uploaded with the same hash is skipped.
+
+    :return: number of rows written, or whether the file was skipped.
     """
 
-    # Use StringIO to treat the string as a file object
-    csv_reader = csv.DictReader(StringIO(data))
+    result = UploadResult()
+    replacer = NaturalKeyReplacer(
+        SalesTransaction,
+        ALLOWED_FIELDS_IN_SALES_TRANSACTION_CSV,
+        SALES_TRANSACTION_NATURAL_KEY,
+    )
+    changed_days: Set[str] = set()
+    added_digests: Dict[str, Tuple[TDigest, TDigest]] = {}
+    versions: Versions = {}
+    cube_delta = sales_cube.begin_write()
+    committed = False
 
-    csv_reader.fieldnames = [field.strip() for field in csv_reader.fieldnames]
-    if not all(
-        field in csv_reader.fieldnames
-        for field in ALLOWED_FIELDS_IN_SALES_TRANSACTION_CSV
-    ):
-        raise ValueError(
-            "Invalid CSV file. Please make sure the file contains the "
-            "following columns: product_id, quantity, revenue, date.",
-        )
+    try:
+        async with in_write_transaction():
+            if fingerprint and await is_known_upload("sales_transaction", fingerprint):
+                result.duplicate = True
+                return result
 
-    transactions = []
-    async with in_transaction():
-        for row in csv_reader:
-            product_id = int(row["product_id"])
-            quantity = int(row["quantity"])
-            revenue = float(row["revenue"])
-            date = row["date"]
+            async for batch in iter_upload_batches(data, SALES_TRANSACTION_CSV_SCHEMA):
+                if mode == UploadMode.REPLACE:
+                    await replacer.delete_replaced(batch)
+                await bulk_insert(
+                    SalesTransaction,
+                    ALLOWED_FIELDS_IN_SALES_TRANSACTION_CSV,
+                    batch,
+                )
+                if mode == UploadMode.APPEND:
+                    rollup_rows = aggregate_sales_batch(batch)
+                    await add_to_sales_rollups(rollup_rows)
+                    changed_days.update(row[1] for row in rollup_rows)
+                    merge_digests(added_digests, digest_sales_batch(batch))
+                    cube_delta.add(batch)
+                result.rows += len(batch)
+                if on_progress:
+                    on_progress(len(batch))
 
-            transaction = SalesTransaction(
-                product_id=product_id, quantity=quantity, revenue=revenue, date=date
-            )
-            transactions.append(transaction)
+            if mode == UploadMode.REPLACE:
+                # Replaced rows are gone, their days are summed up again
+                await refresh_sales_rollups(list(replacer.replaced))
+                changed_days.update(day for _, day in replacer.replaced)
+                await refresh_sales_sketches(changed_days, rebuild=True)
+            else:
+                await refresh_sales_sketches(changed_days, added=added_digests)
+            if fingerprint:
+                await record_upload("sales_transaction", fingerprint, result.rows)
+            if result.rows:
+                versions = await bump_data_versions(
+                    [table_name(SalesTransaction)],
+                    rewritten=mode == UploadMode.REPLACE,
+                )
+        committed = True
+    finally:
+        # The cube only sees committed rows
+        sales_cube.end_write(cube_delta, versions if committed else {})
+
+    if versions:
+        await refresh_sales_indexes(changed_days, versions, mode)
+    return result
 
-        await SalesTransaction.bulk_create(transactions)
 
+async def refresh_sales_indexes(
+    changed_days: Set[str],
+    versions: Versions,
+    mode: UploadMode,
+) -> None:
+    """
+    Bring the in-process indexes up to date with a committed sales upload.
 
-async def get_total_revenue_for_period(start_date: str, end_date: str) -> int:
+    :param changed_days: days of the uploaded rows and of the replaced ones.
+    :param versions: versions the upload bumped its tables to.
+    :param mode: mode of the upload.
+    """
+    if mode == UploadMode.REPLACE:
+        sales_cube.invalidate()
+    # Only committed days are read back into the index
+    await revenue_index.refresh_days(changed_days, versions)
+    await sales_sketch_index.refresh_days(changed_days, versions)
+
+
+async def get_total_revenue_for_period(
+    start_date: str,
+    end_date: str,
+) -> Optional[Decimal]:
     """
     Get total revenue for a given period.
 
+    Totals of ``YYYY-MM-DD`` dates are taken from the in-process revenue
+    index, which only reads the data versions. Dates in other formats are
+    compared as text by SQLite, so they are summed from the daily revenue
+    rollup instead, and kept in the result cache until the next sales upload.
+
     :param start_date: start date.
 
     :param end_date: end date.
 
-    :return: total revenue.
+    :return: total revenue, None if there is no transaction in the period.
     """
-    result = (
-        await SalesTransaction.filter(date__range=(start_date, end_date))
-        .annotate(total_revenue=Sum("revenue"))
-        .values("total_revenue")
+    try:
+        return await revenue_index.total(start_date, end_date)
+    except ValueError:
+        pass
+
+    return await result_cache.get_or_compute(
+        "total_revenue",
+        (date_key(start_date), date_key(end_date)),
+        [table_name(SalesTransaction)],
+        lambda: compute_total_revenue_for_period(start_date, end_date),
     )
-    return result[0]["total_revenue"] if result else 0
+
+
+async def compute_total_revenue_for_period(
+    start_date: str,
+    end_date: str,
+) -> Optional[Decimal]:
+    """
+    Compute total revenue for a given period from the daily revenue rollup.
+
+    :param start_date: start date.
+
+    :param end_date: end date.
+
+    :return: total revenue, None if there is no transaction in the period.
+    """
+    revenue_cents = await fetch_revenue_cents_for_period(start_date, end_date)
+    if revenue_cents is None:
+        return None
+    # Same value as the revenue field gives for a SUM of the transactions
+    return Decimal(revenue_cents).scaleb(-2).normalize()
 
 
 async def get_sales_data_by_dimensions(dimensions: list) -> List:
     """
     Get sales data by dimensions.
 
+    Results are kept in the result cache until the next sales or product
+    upload.
+
     :param dimensions: list of dimensions.
 
     :return: sales data.
     """
 
-    for dimension in dimensions:
-        if dimension not in AVAILABLE_DIMENTIONS:
-            raise ValueError(
-                f"Invalid dimension: {dimension}. Available dimensions "
-                f"are: {AVAILABLE_DIMENTIONS}"
-            )
+    validate_dimensions(dimensions)
+
+    # The same dimensions in another order or repeated share a result
+    normalized = ordered(dimensions)
+    rows = await result_cache.get_or_compute(
+        "sales_by_dimensions",
+        normalized,
+        [table_name(SalesTransaction), table_name(ProductCategory)],
+        lambda: compute_sales_data_by_dimensions(normalized),
+    )
 
-    mapped_dimensions = [
-        AVAILABLE_DIMENTIONS_TO_MODELS_MAP[dimension] for dimension in dimensions
+    requested = list(dict.fromkeys(dimensions))
+    if tuple(requested) == normalized:
+        return rows
+    # Keys follow the order of the request
+    names = [AVAILABLE_DIMENTIONS_TO_MODELS_MAP[d] for d in requested]
+    return [
+        {
+            **{name: row[name] for name in names},
+            "total_revenue": row["total_revenue"],
+        }
+        for row in rows
     ]
 
-    query = SalesTransaction.annotate(total_revenue=Sum("revenue"))
 
-    # Apply related fetching conditionally
-    if "category" in dimensions or "product" in dimensions:
-        query = query.prefetch_related("product__product_categories__category")
+async def compute_sales_data_by_dimensions(
+    dimensions: Sequence[str],
+) -> List[Dict[str, Any]]:
+    """
+    Compute sales data by dimensions, without the result cache.
 
-    # Group by dimensions and retrieve values
-    result = await query.group_by(*mapped_dimensions).values(
-        *mapped_dimensions, "total_revenue"
-    )
+    The revenue is rolled up from the in-memory sales cube, see
+    :class:`gobble_cube.services.cube.SalesCube`.
 
-    return result
+    :param dimensions: list of valid dimensions.
+
+    :return: sales data.
+    """
+    cells = await sales_cube.query(dimensions)
+    return format_cells(cells, dimensions, AVAILABLE_DIMENTIONS_TO_MODELS_MAP)
+
+
+async def get_sales_data_page(
+    dimensions: Sequence[str],
+    page_size: int,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Get a page of sales data by dimensions.
+
+    Rows are sorted by the values of the dimensions and a page starts
+    right after the last row of the previous one (keyset pagination),
+    so every page costs the same and is read from the database.
+
+    :param dimensions: list of dimensions.
+    :param page_size: number of rows of the page.
+    :param cursor: cursor of the previous page, None for the first one.
+
+    :return: sales data, and the cursor of the next page if there is one.
+    """
+
+    validate_dimensions(dimensions)
+    normalized = ordered(dimensions)
+    after = decode_cursor(cursor, len(normalized)) if cursor else None
+
+    # One more row tells whether there is a next page
+    cells = await fetch_cuboid(normalized, after, page_size + 1)
+    format_cell = cell_formatter(dimensions, AVAILABLE_DIMENTIONS_TO_MODELS_MAP)
+    rows = [format_cell(cell[:-1], cell[-1]) for cell in cells[:page_size]]
+    next_cursor = None
+    if len(cells) > page_size:
+        next_cursor = encode_cursor(cells[page_size - 1][:-1])
+    return rows, next_cursor
+
+
+async def iter_sales_data_by_dimensions(
+    dimensions: Sequence[str],
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Stream sales data by dimensions.
+
+    Rows are sorted by the values of the dimensions and produced chunk by
+    chunk from the database cursor, so memory does not grow with the
+    number of rows.
+
+    :param dimensions: list of valid dimensions, see :func:`validate_dimensions`.
+
+    :yields: chunks of sales data.
+    """
+
+    format_cell = cell_formatter(dimensions, AVAILABLE_DIMENTIONS_TO_MODELS_MAP)
+    async for cells in stream_cuboid(ordered(dimensions), STREAM_CHUNK_SIZE):
+        yield [format_cell(cell[:-1], cell[-1]) for cell in cells]
+
+
+def validate_dimensions(dimensions: Sequence[str]) -> None:
+    """
+    Check that dimensions can be grouped by.
 
-    # if "category" in dimensions or "product" in dimensions:
-    #     return (
-    #         await SalesTransaction.all()
-    #         .annotate(total_revenue=Sum("revenue"))
-    #         .prefetch_related("product")
-    #         .group_by(*mapped_dimensions)
-    #         .values(*mapped_dimensions, "total_revenue")
-    #     )
-    #
-    # return (
-    #     await SalesTransaction.annotate(total_revenue=Sum("revenue"))
-    #     .group_by(*mapped_dimensions)
-    #     .values(*mapped_dimensions, "total_revenue")
-    # )
+    :param dimensions: list of dimensions.
+    :raises ValueError: if a dimension is unknown.
+    """
+
+    for dimension in dimensions:
+        if dimension not in AVAILABLE_DIMENTIONS:
+            raise ValueError(
+                f"Invalid dimension: {dimension}. Available dimensions "
+                f"are: {AVAILABLE_DIMENTIONS}",
+            )
@@ -0,0 +1,486 @@
+import hashlib
+import math
+import zlib
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MASK_64 = (1 << 64) - 1
+
+# High bit of every byte of a register array, see HyperLogLog.merge
+_HIGH_BITS: Dict[int, int] = {}
+
+# Weight of a register holding a rank, for the harmonic mean of HyperLogLog
+_RANK_WEIGHTS = [2.0**-rank for rank in range(65)]
+
+
+def hash_int(value: int) -> int:
+    """
+    Hash an integer, such as an id, to 64 well mixed bits.
+
+    :param value: integer fitting in 64 bits.
+    :return: hash.
+    """
+    digest = hashlib.blake2b(
+        value.to_bytes(8, "little", signed=True),
+        digest_size=8,
+    ).digest()
+    return int.from_bytes(digest, "little")
+
+
+class HyperLogLog:
+    """
+    Approximate number of distinct integers, in a few kilobytes.
+
+    Every value sets one of ``2 ** precision`` registers to the largest
+    number of leading zeros seen in its hash, so sketches of different
+    days are merged by taking the largest register values. The relative
+    standard error is ``1.04 / sqrt(2 ** precision)``, 1.6% by default.
+    """
+
+    def __init__(self, precision: int = 12, registers: Optional[bytes] = None) -> None:
+        self.precision = precision
+        self.registers = bytearray(registers or bytes(1 << precision))
+
+    def add(self, value: int) -> None:
+        """
+        Count a value.
+
+        :param value: integer fitting in 64 bits.
+        """
+        hashed = hash_int(value)
+        index = hashed >> (64 - self.precision)
+        rest = hashed & (MASK_64 >> self.precision)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable[int]) -> None:
+        """
+        Count values.
+
+        :param values: integers fitting in 64 bits.
+        """
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """
+        Get the sketch of the values counted by either sketch.
+
+        :param other: sketch of the same precision.
+        :return: new sketch.
+        """
+        size = len(self.registers)
+        high = _HIGH_BITS.get(size)
+        if high is None:
+            high = _HIGH_BITS[size] = int.from_bytes(b"\x80" * size, "little")
+        mine = int.from_bytes(self.registers, "little")
+        theirs = int.from_bytes(other.registers, "little")
+        # Registers are below 128, so no byte borrows from the next one, and
+        # the high bit of a byte is left set where this register is larger
+        larger = (((mine | high) - theirs) & high) >> 7
+        keep = larger * 0xFF
+        merged = (mine & keep) | (theirs & ~keep)
+        return HyperLogLog(self.precision, merged.to_bytes(size, "little"))
+
+    def estimate(self) -> float:
+        """
+        Estimate the number of distinct values.
+
+        :return: estimate, exact for an empty sketch.
+        """
+        size = len(self.registers)
+        zeros = self.registers.count(0)
+        if zeros == size:
+            return 0.0
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = (
+            alpha * size * size / sum(map(_RANK_WEIGHTS.__getitem__, self.registers))
+        )
+        if estimate <= 2.5 * size and zeros:
+            # Few values, counting the empty registers is more accurate
+            estimate = size * math.log(size / zeros)
+        return estimate
+
+    @property
+    def standard_error(self) -> float:
+        """Relative standard error of the estimates."""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the sketch.
+
+        :return: compressed registers, see :meth:`from_bytes`.
+        """
+        return zlib.compress(bytes([self.precision]) + bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        """
+        Read a sketch serialized by :meth:`to_bytes`.
+
+        :param data: serialized sketch.
+        :return: sketch.
+        """
+        raw = zlib.decompress(data)
+        return cls(raw[0], raw[1:])
+
+
+class TDigest:
+    """
+    Approximate quantiles of a stream of numbers, in a few kilobytes.
+
+    Values are summarized by centroids, a mean and a weight, kept small
+    near both ends of the distribution so extreme quantiles stay accurate.
+    Digests of different days are merged by compressing their centroids
+    together. This is the merging digest with the ``k1`` scale function.
+    """
+
+    def __init__(self, compression: float = 200.0) -> None:
+        self.compression = compression
+        self.means = array("d")
+        self.weights = array("d")
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer: List[Tuple[float, float]] = []
+
+    def add(self, value: float, weight: float = 1.0) -> None:
+        """
+        Count a value.
+
+        :param value: number.
+        :param weight: number of times it is counted.
+        """
+        self._buffer.append((value, weight))
+        self.count += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) > 10 * self.compression:
+            self.compress()
+
+    def update(self, values: Iterable[float]) -> None:
+        """
+        Count values.
+
+        :param values: numbers.
+        """
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        """
+        Get the digest of the values counted by either digest.
+
+        :param other: digest.
+        :return: new digest.
+        """
+        return TDigest.merge_all([self, other])
+
+    @staticmethod
+    def merge_all(digests: List["TDigest"]) -> "TDigest":
+        """
+        Get the digest of the values counted by any of some digests.
+
+        Centroids are compressed once, which is faster than merging the
+        digests two by two.
+
+        :param digests: digests, at least one.
+        :return: new digest.
+        """
+        merged = TDigest(digests[0].compression)
+        for digest in digests:
+            merged.add_digest(digest)
+        merged.compress()
+        return merged
+
+    def add_digest(self, other: "TDigest") -> None:
+        """
+        Count the values of another digest.
+
+        Its centroids are only buffered, and compressed with the values
+        added before them on next use.
+
+        :param other: digest.
+        """
+        self._buffer.extend(other.centroids())
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def centroids(self) -> List[Tuple[float, float]]:
+        """
+        Get the centroids of the digest, and the values not yet compressed.
+
+        :return: mean and weight of every centroid, values being of their
+            weight.
+        """
+        return [*zip(self.means, self.weights), *self._buffer]
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile.
+
+        :param q: quantile, between 0 and 1.
+        :return: estimate, None for an empty digest.
+        """
+        self.compress()
+        if not self.count:
+            return None
+        index = q * self.count
+        if index < 1:
+            return self.min
+        if index > self.count - 1:
+            return self.max
+        first = self.weights[0]
+        if first > 1 and index < first / 2:
+            # Between the smallest value and the first centroid
+            return self.min + (index - 1) / (first / 2 - 1) * (self.means[0] - self.min)
+        return self._interpolate(index)
+
+    def _interpolate(self, index: float) -> float:
+        # Rank of the middle of the first centroid
+        seen = self.weights[0] / 2
+        for i in range(len(self.means) - 1):
+            step = (self.weights[i] + self.weights[i + 1]) / 2
+            if seen + step > index:
+                return self._between(i, index - seen, seen + step - index)
+            seen += step
+        last = self.weights[-1]
+        if last > 1 and self.count - index <= last / 2:
+            # Between the last centroid and the largest value
+            return self.max - (self.count - index - 1) / (last / 2 - 1) * (
+                self.max - self.means[-1]
+            )
+        return self.max
+
+    def _between(self, i: int, before: float, after: float) -> float:
+        # Interpolates between centroids i and i + 1, before and after being
+        # the distances in rank from their middles
+        means, weights = self.means, self.weights
+        # Singletons are exact values
+        if weights[i] == 1:
+            if before < 0.5:
+                return means[i]
+            before -= 0.5
+        if weights[i + 1] == 1:
+            if after <= 0.5:
+                return means[i + 1]
+            after -= 0.5
+        return (means[i] * after + means[i + 1] * before) / (before + after)
+
+    def quantile_bounds(self, q: float) -> Tuple[Optional[float], Optional[float]]:
+        """
+        Bound a quantile by the uncertainty on the rank of its centroid.
+
+        The values summarized by a centroid are only known by their mean,
+        so the quantile is searched a centroid weight below and above.
+
+        :param q: quantile, between 0 and 1.
+        :return: lower and upper bounds, None for an empty digest.
+        """
+        self.compress()
+        if not self.count:
+            return None, None
+        index, seen = q * self.count, 0.0
+        weight = self.weights[-1]
+        for centroid_weight in self.weights:
+            seen += centroid_weight
+            if seen >= index:
+                weight = centroid_weight
+                break
+        spread = weight / self.count
+        return self.quantile(max(q - spread, 0.0)), self.quantile(min(q + spread, 1.0))
+
+    def quantile_estimate(self, q: float) -> Tuple[float, float, float]:
+        """
+        Estimate a quantile of a digest known to count values, with its bounds.
+
+        :param q: quantile, between 0 and 1.
+        :raises ValueError: for an empty digest.
+        :return: estimate, lower and upper bounds.
+        """
+        estimate = self.quantile(q)
+        low, high = self.quantile_bounds(q)
+        if estimate is None or low is None or high is None:
+            raise ValueError("An empty digest has no quantile")
+        return estimate, low, high
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the digest.
+
+        :return: compression, count, bounds and centroids, see :meth:`from_bytes`.
+        """
+        self.compress()
+        header = array("d", [self.compression, self.count, self.min, self.max])
+        return header.tobytes() + self.means.tobytes() + self.weights.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TDigest":
+        """
+        Read a digest serialized by :meth:`to_bytes`.
+
+        :param data: serialized digest.
+        :return: digest.
+        """
+        values = array("d")
+        values.frombytes(data)
+        digest = cls(values[0])
+        digest.count, digest.min, digest.max = values[1], values[2], values[3]
+        centroids = (len(values) - 4) // 2
+        digest.means = values[4 : 4 + centroids]
+        digest.weights = values[4 + centroids :]
+        return digest
+
+    def compress(self) -> None:
+        """Fold the values added since the last compression into the centroids."""
+        if not self._buffer:
+            return
+        items = sorted(self.centroids())
+        self._buffer = []
+        normalizer = self.compression / (2 * math.pi)
+        total = self.count
+
+        def weight_limit(seen: float) -> float:
+            # Weight up to which a centroid grows, one unit of k further
+            k = normalizer * math.asin(2 * seen / total - 1) + 1
+            return total * (math.sin(min(k / normalizer, math.pi / 2)) + 1) / 2
+
+        means, weights = array("d"), array("d")
+        mean, weight = items[0]
+        seen = 0.0
+        limit = weight_limit(seen)
+        for value, value_weight in items[1:]:
+            if seen + weight + value_weight <= limit:
+                weight += value_weight
+                mean += (value - mean) * value_weight / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                seen += weight
+                limit = weight_limit(min(seen, total))
+                mean, weight = value, value_weight
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+
+class HeavyHitters:
+    """
+    Integers with the largest weights in a stream, in ``capacity`` counters.
+
+    Counters are added up, and when there are too many only the largest
+    are kept, the largest dropped counter being added to ``error``. For
+    non-negative weights, the weight of any integer, listed or not, is
+    then between its counter, 0 if unlisted, and its counter plus
+    ``error``. Summaries of different days are merged by adding their
+    counters and errors.
+
+    A negative weight, such as a refund, can make a dropped counter hide
+    weight taken away rather than added, the bounds then no longer hold
+    and the summary is marked ``uncertain``.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 256,
+        counts: Optional[Dict[int, int]] = None,
+        error: int = 0,
+        uncertain: bool = False,
+    ) -> None:
+        self.capacity = capacity
+        self.counts: Dict[int, int] = counts or {}
+        self.error = error
+        self.uncertain = uncertain
+
+    def add(self, value: int, weight: int = 1) -> None:
+        """
+        Count a value.
+
+        :param value: integer fitting in 64 bits.
+        :param weight: weight added to it, a negative one makes the summary
+            uncertain.
+        """
+        if weight < 0:
+            self.uncertain = True
+        self.counts[value] = self.counts.get(value, 0) + weight
+        # Counters are dropped in bulk, keeping additions constant time
+        if len(self.counts) > 2 * self.capacity:
+            self.truncate()
+
+    def merge(self, other: "HeavyHitters") -> "HeavyHitters":
+        """
+        Get the summary of the values counted by either summary.
+
+        :param other: summary.
+        :return: new summary, of the capacity of this one.
+        """
+        counts = dict(self.counts)
+        for value, weight in other.counts.items():
+            counts[value] = counts.get(value, 0) + weight
+        merged = HeavyHitters(
+            self.capacity,
+            counts,
+            self.error + other.error,
+            self.uncertain or other.uncertain,
+        )
+        merged.truncate()
+        return merged
+
+    def top(self, count: int) -> Tuple[List[Tuple[int, int]], bool]:
+        """
+        Get the values with the largest counters.
+
+        :param count: number of values.
+        :return: values and their counters, largest first, then by value,
+            and whether they are surely the ``count`` values of largest
+            weight, though maybe not in order, never when ``uncertain``.
+        """
+        self.truncate()
+        ranked = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        if self.uncertain:
+            return ranked[:count], False
+        if not self.error:
+            return ranked[:count], True
+        if len(ranked) < count:
+            return ranked, False
+        # Any other value weighs at most the next counter plus the error
+        next_count = ranked[count][1] if len(ranked) > count else 0
+        return ranked[:count], ranked[count - 1][1] > next_count + self.error
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the summary.
+
+        :return: capacity, error, whether uncertain and counters, see
+            :meth:`from_bytes`.
+        """
+        self.truncate()
+        values = array("q", [self.capacity, self.error, int(self.uncertain)])
+        values.extend(self.counts)
+        values.extend(self.counts.values())
+        return zlib.compress(values.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HeavyHitters":
+        """
+        Read a summary serialized by :meth:`to_bytes`.
+
+        :param data: serialized summary.
+        :return: summary.
+        """
+        values = array("q")
+        values.frombytes(zlib.decompress(data))
+        size = (len(values) - 3) // 2
+        counts = dict(zip(values[3 : 3 + size], values[3 + size :]))
+        return cls(values[0], counts, values[1], bool(values[2]))
+
+    def truncate(self) -> None:
+        """Drop the smallest counters beyond the capacity, into the error."""
+        if len(self.counts) <= self.capacity:
+            return
+        ranked = sorted(self.counts.items(), key=lambda item: -item[1])
+        self.error += ranked[self.capacity][1]
+        self.counts = dict(ranked[: self.capacity])
@@ -0,0 +1,149 @@
+import enum
+import heapq
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from gobble_cube.db.dao.sales_summary import (
+    fetch_product_revenue_for_period,
+    fetch_top_products_for_period,
+)
+from gobble_cube.db.models import ProductCategory, SalesTransaction, table_name
+from gobble_cube.services.product_categories import product_category_index
+from gobble_cube.services.result_cache import result_cache
+from gobble_cube.services.revenue_index import parse_day
+from gobble_cube.services.sales_summary import sales_sketch_index
+
+
+class TopSalesDimension(str, enum.Enum):
+    """What the top sales are ranked by."""
+
+    PRODUCT = "product"
+    CATEGORY = "category"
+
+
+async def get_top_sales(
+    dimension: TopSalesDimension,
+    start_date: str,
+    end_date: str,
+    limit: int = 20,
+) -> Dict[str, Any]:
+    """
+    Get the products or categories of largest revenue over a period.
+
+    Rankings are kept in the result cache until the next sales or product
+    upload.
+
+    :param dimension: rank products or categories.
+    :param start_date: first day, ``YYYY-MM-DD``.
+    :param end_date: last day, ``YYYY-MM-DD``.
+    :param limit: number of products or categories.
+    :raises ValueError: if a date is not in ``YYYY-MM-DD`` format.
+    :return: ranking, see :func:`compute_top_sales`.
+    """
+    start, end = parse_day(start_date), parse_day(end_date)
+    return await result_cache.get_or_compute(
+        "top_sales",
+        (dimension.value, start, end, limit),
+        [table_name(SalesTransaction), table_name(ProductCategory)],
+        lambda: compute_top_sales(dimension, start_date, end_date, limit),
+    )
+
+
+async def compute_top_sales(
+    dimension: TopSalesDimension,
+    start_date: str,
+    end_date: str,
+    limit: int,
+) -> Dict[str, Any]:
+    """
+    Rank products or categories by revenue, without the result cache.
+
+    The heavy hitter summaries of the days of the period are merged
+    through the sales sketch index, whatever the number of products. When
+    they prove which ids are the top ones, only the revenue of those is
+    read, to rank them exactly. Otherwise, such as when more ids are asked
+    for than the summaries keep, every id of the period is ranked. The
+    revenue of categories is summed from the revenue of their products,
+    through the product category index rather than a join.
+
+    :param dimension: rank products or categories.
+    :param start_date: first day.
+    :param end_date: last day.
+    :param limit: number of products or categories.
+    :return: id and revenue, largest revenue first, then by id, and whether
+        the summaries could not answer and every id was ranked.
+    """
+    sketch = await sales_sketch_index.period(start_date, end_date)
+    ranked: Optional[List[Tuple[int, int]]] = []
+    if sketch is not None:
+        summary = (
+            sketch.top_products
+            if dimension == TopSalesDimension.PRODUCT
+            else sketch.top_categories
+        )
+        ranked, certain = summary.top(limit)
+        if not certain:
+            ranked = None
+        elif summary.error:
+            # Counters are lower bounds, the exact revenue may change the order
+            revenue = await sum_revenue(
+                dimension,
+                start_date,
+                end_date,
+                [value for value, _ in ranked],
+            )
+            ranked = sorted(revenue.items(), key=lambda item: (-item[1], item[0]))
+
+    fallback = ranked is None
+    if ranked is None:
+        if dimension == TopSalesDimension.PRODUCT:
+            ranked = await fetch_top_products_for_period(start_date, end_date, limit)
+        else:
+            revenue = await sum_revenue(dimension, start_date, end_date)
+            ranked = heapq.nsmallest(
+                limit,
+                revenue.items(),
+                key=lambda item: (-item[1], item[0]),
+            )
+
+    return {
+        "fallback": fallback,
+        "top": [
+            {
+                f"{dimension.value}_id": value,
+                "revenue": Decimal(revenue_cents).scaleb(-2).normalize(),
+            }
+            for value, revenue_cents in ranked
+        ],
+    }
+
+
+async def sum_revenue(
+    dimension: TopSalesDimension,
+    start_date: str,
+    end_date: str,
+    ids: Optional[List[int]] = None,
+) -> Dict[int, int]:
+    """
+    Sum the revenue of products or categories over a period.
+
+    :param dimension: products or categories.
+    :param start_date: first day.
+    :param end_date: last day.
+    :param ids: product or category ids, every one by default.
+    :return: revenue in cents by id, ids without sales are left out.
+    """
+    if dimension == TopSalesDimension.PRODUCT:
+        return await fetch_product_revenue_for_period(start_date, end_date, ids)
+
+    categories = await product_category_index.current()
+    products = None if ids is None else categories.products_of(ids)
+    product_revenue = await fetch_product_revenue_for_period(
+        start_date,
+        end_date,
+        products,
+    )
+    revenue = categories.scatter_add(product_revenue.items())
+    if ids is not None:
+        revenue = {value: revenue[value] for value in ids if value in revenue}
+    return revenue
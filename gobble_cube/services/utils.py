@@ -1,17 +1,35 @@
-from tortoise.queryset import QuerySet
+import base64
+import json
+from typing import Any, List, Sequence
 
 
-def apply_pagination(
-    queryset: QuerySet, page: int = 1, page_size: int = 10
-) -> QuerySet:
+def encode_cursor(values: Sequence[Any]) -> str:
     """
-    Apply pagination to a Tortoise QuerySet.
+    Encode the sort key of the last row of a page.
 
-    :param queryset: The queryset to paginate.
-    :param page: The page number.
-    :param page_size: The size of each page.
+    :param values: values of the sort key, JSON serializable.
+    :return: opaque cursor to send back for the next page.
+    """
+    payload = json.dumps(list(values), separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, length: int) -> List[Any]:
+    """
+    Decode a cursor given by :func:`encode_cursor`.
 
-    :return: The paginated queryset.
+    :param cursor: cursor sent by the client.
+    :param length: number of values of the sort key.
+    :raises ValueError: if the cursor is invalid.
+    :return: values of the sort key.
     """
-    offset = (page - 1) * page_size
-    return queryset.offset(offset).limit(page_size)
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor") from None
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid cursor")
+    if any(not isinstance(value, (int, str, type(None))) for value in values):
+        raise ValueError("Invalid cursor")
+    return values
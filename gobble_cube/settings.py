@@ -1,6 +1,7 @@
 import enum
 from pathlib import Path
 from tempfile import gettempdir
+from typing import Any, Dict
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from yarl import URL
@@ -19,6 +20,41 @@ class LogLevel(str, enum.Enum):
     FATAL = "FATAL"
 
 
+class AnalyticsEngine(str, enum.Enum):
+    """Engines the wide aggregations can run on."""
+
+    SQLITE = "sqlite"
+    DUCKDB = "duckdb"
+
+
+class JournalMode(str, enum.Enum):
+    """Possible SQLite journal modes."""
+
+    DELETE = "DELETE"
+    TRUNCATE = "TRUNCATE"
+    PERSIST = "PERSIST"
+    MEMORY = "MEMORY"
+    WAL = "WAL"
+    OFF = "OFF"
+
+
+class Synchronous(str, enum.Enum):
+    """Possible SQLite synchronous levels."""
+
+    OFF = "OFF"
+    NORMAL = "NORMAL"
+    FULL = "FULL"
+    EXTRA = "EXTRA"
+
+
+class TempStore(str, enum.Enum):
+    """Possible places of the SQLite temporary tables and indexes."""
+
+    DEFAULT = "DEFAULT"
+    FILE = "FILE"
+    MEMORY = "MEMORY"
+
+
 class Settings(BaseSettings):
     """
     Application settings.
@@ -41,15 +77,79 @@ class Settings(BaseSettings):
     # Variables for the database
     db_file: Path = TEMP_DIR / "db.sqlite3"
     db_echo: bool = False
+    # Journal of the database, in WAL mode readers do not wait for the writer
+    db_journal_mode: JournalMode = JournalMode.WAL
+    # Syncs to disk on commit, NORMAL only syncs the WAL at checkpoints
+    db_synchronous: Synchronous = Synchronous.NORMAL
+    # Page cache of every connection, in KiB when negative as in SQLite
+    db_cache_size: int = -32_768
+    # Bytes of the database file read through a memory map, 0 disables it
+    db_mmap_size: int = 256 * 1024 * 1024
+    # Where the temporary tables and indexes of the queries are kept
+    db_temp_store: TempStore = TempStore.MEMORY
+    # Milliseconds a connection waits for a lock before "database is locked"
+    db_busy_timeout: int = 5000
+    # Read-only connections of the analytics queries, 0 runs them on the shared one
+    db_read_pool_size: int = 4
+
+    # Rows written to the database at a time by the CSV uploads
+    ingest_batch_size: int = 5000
+    # Uploads processed concurrently by the background ingestion jobs
+    ingest_workers: int = 2
+    # Seconds between checks for jobs queued by other worker processes
+    ingest_poll_interval: float = 1.0
+    # Where files of background ingestion jobs are kept until processed
+    ingest_upload_dir: Path = TEMP_DIR / "gobble_cube_uploads"
+    # Processes parsing large stored uploads in parallel, 0 uses every CPU
+    ingest_parse_processes: int = 0
+    # Stored uploads at least this large are parsed in parallel
+    ingest_parallel_min_bytes: int = 64 * 1024 * 1024
+    # Cells of the dimension cuboids kept in memory by the sales cube, about
+    # 200 bytes each, held by every worker process
+    cube_max_cells: int = 500_000
+    # Results of the analytics queries kept in memory, 0 disables the cache
+    result_cache_max_entries: int = 1024
+    # Seconds a cached result is kept, uploads also discard it
+    result_cache_ttl: float = 300.0
+    # Points of a revenue time series, longer series are refused
+    revenue_series_max_points: int = 1000
+    # Queries sent at once to the analytics batch endpoint, more are refused
+    analytics_batch_max_queries: int = 100
+    # Products and categories of largest revenue kept by day for top queries
+    top_sales_capacity: int = 256
+    # Engine of the GROUP BYs over every row, duckdb needs the `analytics` extra
+    analytics_engine: AnalyticsEngine = AnalyticsEngine.SQLITE
+
+    @property
+    def db_pragmas(self) -> Dict[str, Any]:
+        """
+        Assemble the PRAGMAs every database connection starts with.
+
+        :return: PRAGMA name to value.
+        """
+        return {
+            "busy_timeout": self.db_busy_timeout,
+            "journal_mode": self.db_journal_mode.value,
+            "synchronous": self.db_synchronous.value,
+            "cache_size": self.db_cache_size,
+            "mmap_size": self.db_mmap_size,
+            "temp_store": self.db_temp_store.value,
+        }
 
     @property
     def db_url(self) -> URL:
         """
         Assemble database URL from settings.
 
+        Tortoise runs the query parameters as PRAGMAs on connecting.
+
         :return: database URL.
         """
-        return URL.build(scheme="sqlite", path=f"//{self.db_file}")
+        return URL.build(
+            scheme="sqlite",
+            path=f"//{self.db_file}",
+            query=self.db_pragmas,
+        )
 
     model_config = SettingsConfigDict(
         env_file=".env",
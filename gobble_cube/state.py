@@ -0,0 +1,36 @@
+import inspect
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+Reset = Callable[[], Optional[Awaitable[None]]]
+ResetT = TypeVar("ResetT", bound=Reset)
+
+_resets: List[Reset] = []
+
+
+def on_reset(reset: ResetT) -> ResetT:
+    """
+    Register how to drop some state kept by the process between requests.
+
+    Indexes, caches and pools are module-level singletons, each registering
+    its ``reset`` next to its creation, so tests can start every case from
+    an empty process with :func:`reset_process_state`.
+
+    :param reset: function or coroutine function dropping the state.
+    :return: the same function.
+    """
+    _resets.append(reset)
+    return reset
+
+
+async def reset_process_state() -> None:
+    """
+    Drop the state of every registered singleton, last registered first.
+
+    A module registers after the modules it imports, so a singleton is
+    dropped before the ones it uses, such as the ingest workers before the
+    read pool they query.
+    """
+    for reset in reversed(_resets):
+        result = reset()
+        if inspect.isawaitable(result):
+            await result
@@ -0,0 +1,5 @@
+"""API for running many analytics queries at once."""
+
+from gobble_cube.web.api.analytics.views import router
+
+__all__ = ["router"]
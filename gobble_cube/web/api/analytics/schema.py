@@ -0,0 +1,35 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from gobble_cube.services.analytics_batch import AnalyticsQuery, AnalyticsQueryKind
+
+
+class AnalyticsQuerySchema(BaseModel):
+    """An analytics query, with the parameters of its endpoint."""
+
+    kind: AnalyticsQueryKind
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    dimensions: List[str] = []
+    limit: int = 10
+
+    def to_query(self) -> AnalyticsQuery:
+        """
+        Get the query run by the batch service.
+
+        :return: query.
+        """
+        return AnalyticsQuery(
+            kind=self.kind,
+            start_date=self.start_date,
+            end_date=self.end_date,
+            dimensions=tuple(dimension.strip() for dimension in self.dimensions),
+            limit=self.limit,
+        )
+
+
+class AnalyticsBatchSchema(BaseModel):
+    """Analytics queries answered in one response."""
+
+    queries: List[AnalyticsQuerySchema]
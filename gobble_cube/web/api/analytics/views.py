@@ -0,0 +1,35 @@
+from typing import Any, Dict
+
+from fastapi import APIRouter, HTTPException
+from starlette import status
+
+from gobble_cube.services.analytics_batch import run_analytics_batch
+from gobble_cube.web.api.analytics.schema import AnalyticsBatchSchema
+
+router = APIRouter()
+
+
+@router.post("/batch", response_model=None)
+async def run_analytics_queries(batch: AnalyticsBatchSchema) -> Dict[str, Any]:
+    """
+    Answer many analytics queries in one request.
+
+    Every query is a ``total``, ``dimensions`` or
+    ``significant_category_shares`` query with the parameters of its
+    endpoint. Duplicates are answered once, and significant category
+    shares of the same period once for every limit. Results come in the
+    order of the queries, each with its ``elapsed_ms``, a failing query
+    getting an ``error`` status without failing the others.
+    """
+
+    try:
+        results = await run_analytics_batch(
+            [query.to_query() for query in batch.queries],
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        ) from e
+
+    return {"status": "success", "results": results}
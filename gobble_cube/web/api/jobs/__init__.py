@@ -0,0 +1,5 @@
+"""API for following background ingestion jobs."""
+
+from gobble_cube.web.api.jobs.views import router
+
+__all__ = ["router"]
@@ -0,0 +1,28 @@
+from typing import Any, Dict
+
+from fastapi import APIRouter, HTTPException
+from starlette import status
+
+from gobble_cube.services.jobs import ingest_jobs
+
+router = APIRouter()
+
+
+@router.get("/{job_id}")
+async def get_ingest_job(job_id: str) -> Dict[str, Any]:
+    """
+    Get the progress of a background upload.
+
+    Reports the rows processed so far, the throughput, the elapsed
+    time and, once finished, whether the upload succeeded.
+
+    param job_id: id returned by one of the ``/csv/jobs`` endpoints.
+    """
+    job = await ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown job: {job_id}",
+        )
+
+    return {"status": "success", "job": job.to_dict()}
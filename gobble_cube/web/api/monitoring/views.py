@@ -1,5 +1,10 @@
+from typing import Any, Dict
+
 from fastapi import APIRouter
 
+from gobble_cube.db.dao.queries import queries
+from gobble_cube.services.result_cache import result_cache
+
 router = APIRouter()
 
 
@@ -10,3 +15,23 @@ def health_check() -> None:
 
     It returns 200 if the project is healthy.
     """
+
+
+@router.get("/cache")
+def cache_stats() -> Dict[str, Any]:
+    """
+    Counters of the result cache of the analytics endpoints.
+
+    :return: hits, misses, evictions, expirations, entries and table versions.
+    """
+    return result_cache.stats()
+
+
+@router.get("/queries")
+def query_stats() -> Dict[str, Any]:
+    """
+    Timings of the registered analytics queries since startup.
+
+    :return: calls, rows, and total, mean and max milliseconds by query name.
+    """
+    return queries.stats()
@@ -1,36 +1,82 @@
-from fastapi import APIRouter, UploadFile, HTTPException
-from fastapi.params import File
+from typing import Dict
+
+from fastapi import APIRouter, File, HTTPException, UploadFile
 from starlette import status
+from tortoise.exceptions import BaseORMException
 
+from gobble_cube.services.formats import INVALID_FORMAT_DETAIL, is_supported_upload
+from gobble_cube.services.idempotency import UploadMode, fingerprint_upload
+from gobble_cube.services.jobs import ingest_jobs
 from gobble_cube.services.product import bulk_upload_products_from_csv
 
 router = APIRouter()
 
 
 @router.post("/csv")
-async def get_product_upload_csv(file: UploadFile = File(...)):
+async def get_product_upload_csv(
+    file: UploadFile = File(...),
+    mode: UploadMode = UploadMode.APPEND,
+) -> Dict[str, str]:
     """
     Upload products from a CSV file.
     """
-    if not file.filename.endswith(".csv"):
+    if not is_supported_upload(file.filename):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid file format. Please upload a CSV file.",
+            detail=INVALID_FORMAT_DETAIL,
         )
 
     try:
-        # Read and decode the file contents
-        contents = await file.read()
-        decoded = contents.decode("utf-8")
+        # Re-sent files are recognized by their content
+        fingerprint = await fingerprint_upload(file)
+        # The file is streamed into the database batch by batch
+        result = await bulk_upload_products_from_csv(
+            file,
+            mode=mode,
+            fingerprint=fingerprint,
+        )
 
-        await bulk_upload_products_from_csv(decoded)
+        if result.duplicate:
+            return {
+                "status": "success",
+                "detail": "This file was already uploaded, it was skipped.",
+            }
 
         return {
             "status": "success",
             "detail": f"Products were successfully uploaded.",
         }
 
-    except Exception as e:
+    except ValueError as e:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        ) from e
+
+    except (BaseORMException, OSError) as e:
+        # The database or the stored file failed, the upload was rolled back
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e),
+        ) from e
+
+
+@router.post("/csv/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def product_upload_csv_job(
+    file: UploadFile = File(...),
+    mode: UploadMode = UploadMode.APPEND,
+) -> Dict[str, str]:
+    """
+    Upload products from a CSV file in the background.
+
+    The file is stored and a job id is returned right away,
+    the progress can be followed with ``/api/jobs/{job_id}``.
+    """
+    if not is_supported_upload(file.filename):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=INVALID_FORMAT_DETAIL,
         )
+
+    job = await ingest_jobs.submit("product", file, mode)
+    return {"status": "accepted", "job_id": job.id}
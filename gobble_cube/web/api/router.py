@@ -1,11 +1,13 @@
 from fastapi.routing import APIRouter
 
 from gobble_cube.web.api import (
+    analytics,
+    category_share,
     docs,
+    jobs,
     monitoring,
-    sales_transaction,
-    category_share,
     product,
+    sales_transaction,
 )
 
 api_router = APIRouter()
@@ -15,6 +17,8 @@ api_router.include_router(monitoring.router)
 api_router.include_router(sales_transaction.router, prefix="/sales-transaction")
 api_router.include_router(category_share.router, prefix="/category-share")
 api_router.include_router(product.router, prefix="/product")
+api_router.include_router(jobs.router, prefix="/jobs")
+api_router.include_router(analytics.router, prefix="/analytics")
 
 
 # docs
@@ -1,47 +1,105 @@
 import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
 
-from fastapi import APIRouter, UploadFile, HTTPException
-from fastapi.params import File
+import ujson
+from fastapi import APIRouter, File, HTTPException, Query, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from starlette import status
 from starlette.status import HTTP_400_BAD_REQUEST
+from tortoise.exceptions import BaseORMException
 
+from gobble_cube.services.formats import INVALID_FORMAT_DETAIL, is_supported_upload
+from gobble_cube.services.idempotency import UploadMode, fingerprint_upload
+from gobble_cube.services.jobs import ingest_jobs
+from gobble_cube.services.revenue_series import Bucket, get_revenue_series
+from gobble_cube.services.sales_summary import get_sales_summary, parse_quantiles
 from gobble_cube.services.service_transaction import (
-    get_total_revenue_for_period,
-    get_sales_data_by_dimensions,
     bulk_upload_sales_transactions_from_csv,
+    get_sales_data_by_dimensions,
+    get_sales_data_page,
+    get_total_revenue_for_period,
+    iter_sales_data_by_dimensions,
+    validate_dimensions,
 )
+from gobble_cube.services.top_sales import TopSalesDimension, get_top_sales
 
 router = APIRouter()
 
+# Rows of a page of sales data, when only a cursor is given
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10_000
+
+# Products or categories of a top sales ranking
+MAX_TOP_SALES = 1000
+
 
 @router.post("/csv")
-async def sales_transaction_upload_csv(file: UploadFile = File(...)):
+async def sales_transaction_upload_csv(
+    file: UploadFile = File(...),
+    mode: UploadMode = UploadMode.APPEND,
+) -> Dict[str, str]:
     """
     Upload sales transactions from a CSV file.
     """
-    if not file.filename.endswith(".csv"):
+    if not is_supported_upload(file.filename):
         raise HTTPException(
             status_code=HTTP_400_BAD_REQUEST,
-            detail="Invalid file format. Please upload a CSV file.",
+            detail=INVALID_FORMAT_DETAIL,
         )
 
     try:
-        # Read and decode the file contents
-        contents = await file.read()
-        decoded = contents.decode("utf-8")
+        # Re-sent files are recognized by their content
+        fingerprint = await fingerprint_upload(file)
+        # The file is streamed into the database batch by batch
+        result = await bulk_upload_sales_transactions_from_csv(
+            file,
+            mode=mode,
+            fingerprint=fingerprint,
+        )
 
-        await bulk_upload_sales_transactions_from_csv(decoded)
+        if result.duplicate:
+            return {
+                "status": "success",
+                "detail": "This file was already uploaded, it was skipped.",
+            }
 
         return {
             "status": "success",
             "detail": f"Transactions were successfully uploaded.",
         }
 
-    except Exception as e:
+    except ValueError as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e)) from e
+
+    except (BaseORMException, OSError) as e:
+        # The database or the stored file failed, the upload was rolled back
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e),
+        ) from e
+
+
+@router.post("/csv/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def sales_transaction_upload_csv_job(
+    file: UploadFile = File(...),
+    mode: UploadMode = UploadMode.APPEND,
+) -> Dict[str, str]:
+    """
+    Upload sales transactions from a CSV file in the background.
+
+    The file is stored and a job id is returned right away,
+    the progress can be followed with ``/api/jobs/{job_id}``.
+    """
+    if not is_supported_upload(file.filename):
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST,
+            detail=INVALID_FORMAT_DETAIL,
         )
 
+    job = await ingest_jobs.submit("sales_transaction", file, mode)
+    return {"status": "accepted", "job_id": job.id}
+
 
 @router.get("/total")
 async def get_total_sales(start_date: str, end_date: str):
@@ -53,27 +111,163 @@ async def get_total_sales(start_date: str, end_date: str):
     """
 
     if not start_date or not end_date:
-        raise ValueError("Start date and End date are required")
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST,
+            detail="Start date and End date are required",
+        )
 
-    total_sales = await get_total_revenue_for_period(start_date, end_date)
+    try:
+        total_sales = await get_total_revenue_for_period(start_date, end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e)) from e
     return {"status": "success", "total_sales": total_sales}
 
 
-@router.get("/dimentions")
-async def get_sales_dimensions(dimensions: str):
+@router.get("/timeseries", response_model=None)
+async def get_sales_timeseries(
+    start_date: str,
+    end_date: str,
+    bucket: Bucket = Bucket.DAY,
+    product_id: Optional[int] = None,
+    category_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Get revenue over time.
+
+    Returns a point per day, week or month of the period, with its revenue
+    and number of transactions, optionally for a product or a category only.
+    Series longer than the configured maximum number of points are refused.
+    """
+
+    try:
+        series = await get_revenue_series(
+            start_date,
+            end_date,
+            bucket,
+            product_id,
+            category_id,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e)) from e
+
+    return {"status": "success", "series": series}
+
+
+@router.get("/summary", response_model=None)
+async def get_sales_period_summary(
+    start_date: str,
+    end_date: str,
+    quantiles: str = "0.5,0.9,0.99",
+    approximate: bool = False,
+) -> Dict[str, Any]:
+    """
+    Get distinct products and categories, revenue and quantity quantiles.
+
+    With ``approximate=true`` the summary is merged from sketches kept for
+    every day, in milliseconds whatever the period, and every estimate
+    comes with ``low`` and ``high`` bounds.
+    """
+
+    try:
+        summary = await get_sales_summary(
+            start_date,
+            end_date,
+            parse_quantiles(quantiles),
+            approximate,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e)) from e
+
+    return {"status": "success", "summary": summary}
+
+
+@router.get("/top", response_model=None)
+async def get_top_sales_for_period(
+    start_date: str,
+    end_date: str,
+    dimension: TopSalesDimension = TopSalesDimension.PRODUCT,
+    limit: int = Query(20, ge=1, le=MAX_TOP_SALES),
+) -> Dict[str, Any]:
+    """
+    Get the products or categories of largest revenue over a period.
+
+    Answered from heavy hitter summaries kept for every day, so the time
+    taken does not grow with the number of products. ``fallback`` is true
+    when the summaries could not prove the ranking and every product or
+    category of the period was ranked instead.
+    """
+
+    try:
+        top_sales = await get_top_sales(dimension, start_date, end_date, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e)) from e
+
+    return {"status": "success", **top_sales}
+
+
+@router.get("/dimentions", response_model=None)
+async def get_sales_dimensions(
+    dimensions: str,
+    page_size: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+) -> Union[Dict[str, Any], StreamingResponse]:
     """
     Get sales distribution.
 
     Takes in a list of dimensions and returns sales of each dimensions.
 
     AVAILABLE_DIMENTIONS = ["category", "product", "quantity", "revenue", "date"]
+
+    Large results can be read by pages of ``page_size`` rows, passing the
+    ``next_cursor`` of a page as ``cursor`` to get the next one, or streamed
+    with ``stream=true`` as newline delimited JSON, one row per line.
     """
 
-    dimensions = dimensions.split(",")
-    cleaned_dimensions = list(set([dimension.strip() for dimension in dimensions]))
+    requested_dimensions = dimensions.split(",")
+    cleaned_dimensions = list(
+        set([dimension.strip() for dimension in requested_dimensions]),
+    )
 
-    if len(dimensions) != len(cleaned_dimensions):
+    if len(requested_dimensions) != len(cleaned_dimensions):
         logging.warning("Duplicate dimensions found in the query")
 
-    sales_by_dimensions = await get_sales_data_by_dimensions(dimensions)
+    try:
+        if stream:
+            validate_dimensions(requested_dimensions)
+            return StreamingResponse(
+                iter_ndjson(iter_sales_data_by_dimensions(requested_dimensions)),
+                media_type="application/x-ndjson",
+            )
+
+        if page_size is not None or cursor is not None:
+            sales_by_dimensions, next_cursor = await get_sales_data_page(
+                requested_dimensions,
+                page_size or DEFAULT_PAGE_SIZE,
+                cursor,
+            )
+            return {
+                "status": "success",
+                "sales_by_dimensions": sales_by_dimensions,
+                "next_cursor": next_cursor,
+            }
+
+        sales_by_dimensions = await get_sales_data_by_dimensions(requested_dimensions)
+
+    except ValueError as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e)) from e
+
     return {"status": "success", "sales_by_dimensions": sales_by_dimensions}
+
+
+async def iter_ndjson(
+    chunks: AsyncIterator[List[Dict[str, Any]]],
+) -> AsyncIterator[str]:
+    """
+    Serialize chunks of rows as newline delimited JSON.
+
+    :param chunks: chunks of rows.
+    :yields: a line per row, a chunk at a time.
+    """
+    async for rows in chunks:
+        yield "".join(f"{ujson.dumps(jsonable_encoder(row))}\n" for row in rows)
@@ -3,6 +3,23 @@ from typing import AsyncGenerator
 
 from fastapi import FastAPI
 
+from gobble_cube.db.dao.queries import read_pool
+from gobble_cube.db.migrate import apply_migrations
+from gobble_cube.services.category_share_index import category_share_index
+from gobble_cube.services.category_share_summary import (
+    ensure_category_share_summary,
+)
+from gobble_cube.services.cube import sales_cube
+from gobble_cube.services.ingest import shutdown_process_pool
+from gobble_cube.services.jobs import ingest_jobs
+from gobble_cube.services.product_categories import product_category_index
+from gobble_cube.services.revenue_index import revenue_index
+from gobble_cube.services.sales_rollup import ensure_sales_rollups
+from gobble_cube.services.sales_summary import (
+    ensure_sales_sketches,
+    sales_sketch_index,
+)
+
 
 @asynccontextmanager
 async def lifespan_setup(
@@ -21,4 +38,19 @@ async def lifespan_setup(
     app.middleware_stack = None
     app.middleware_stack = app.build_middleware_stack()
 
+    await apply_migrations()
+    await ensure_sales_rollups()
+    await revenue_index.load()
+    await product_category_index.load()
+    await sales_cube.load()
+    await ensure_category_share_summary()
+    await category_share_index.load()
+    await ensure_sales_sketches()
+    await sales_sketch_index.load()
+    await ingest_jobs.start()
+
     yield
+
+    await ingest_jobs.stop()
+    await read_pool.close()
+    shutdown_process_pool()
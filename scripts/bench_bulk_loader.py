@@ -0,0 +1,136 @@
+"""
+Compare the rows/sec of the sales transaction upload paths.
+
+The "models" path builds one SalesTransaction per row and calls bulk_create,
+as the uploads used to do. The "loader" path is the current one: rows are
+converted column by column and inserted with a single prepared statement per
+batch. Both run against a temporary SQLite file.
+
+    poetry run python scripts/bench_bulk_loader.py --rows 200000
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from gobble_cube.db.models import Product, SalesTransaction
+from gobble_cube.services.ingest import iter_csv_batches
+from gobble_cube.services.service_transaction import (
+    SALES_TRANSACTION_CSV_SCHEMA,
+    bulk_upload_sales_transactions_from_csv,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+NO_OF_PRODUCTS = 1000
+
+
+def generate_sales_csv(no_of_rows: int) -> str:
+    """
+    Generate sales transactions CSV text.
+
+    :param no_of_rows: number of rows.
+    :return: CSV text.
+    """
+    rng = random.Random(42)
+    lines = ["transaction_id,date,product_id,quantity,revenue"]
+    for i in range(no_of_rows):
+        lines.append(
+            f"{i},2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d},"
+            f"{rng.randint(1, NO_OF_PRODUCTS)},{rng.randint(1, 10)},"
+            f"{rng.uniform(1, 1000):.2f}",
+        )
+    return "\n".join(lines) + "\n"
+
+
+async def upload_with_models(data: str) -> None:
+    """
+    Upload sales transactions building a model instance per row.
+
+    :param data: CSV text.
+    """
+    async with in_transaction():
+        async for batch in iter_csv_batches(
+            data,
+            {**SALES_TRANSACTION_CSV_SCHEMA, "date": str},
+        ):
+            await SalesTransaction.bulk_create(
+                [
+                    SalesTransaction(
+                        product_id=product_id,
+                        quantity=quantity,
+                        revenue=revenue,
+                        date=date,
+                    )
+                    for product_id, quantity, revenue, date in batch
+                ],
+            )
+
+
+async def measure(
+    name: str,
+    upload: Callable[[str], Awaitable[None]],
+    data: str,
+    no_of_rows: int,
+) -> float:
+    """
+    Run an upload against an empty table and log its throughput.
+
+    :param name: name of the path.
+    :param upload: upload coroutine function.
+    :param data: CSV text.
+    :param no_of_rows: number of rows in the CSV.
+    :return: rows per second.
+    """
+    await SalesTransaction.all().delete()
+
+    started = time.perf_counter()
+    await upload(data)
+    elapsed = time.perf_counter() - started
+
+    rows_per_second = no_of_rows / elapsed
+    logging.info(f"{name:>7}: {elapsed:7.2f}s {rows_per_second:12,.0f} rows/s")
+    return rows_per_second
+
+
+async def main(no_of_rows: int) -> None:
+    """
+    Run both upload paths on the same data.
+
+    :param no_of_rows: number of rows to upload.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        await Tortoise.init(
+            db_url=f"sqlite://{Path(directory) / 'bench.sqlite3'}",
+            modules={"models": ["gobble_cube.db.models"]},
+        )
+        await Tortoise.generate_schemas()
+        await Product.bulk_create(
+            [Product(id=i, name=f"Product {i}") for i in range(1, NO_OF_PRODUCTS + 1)],
+        )
+
+        data = generate_sales_csv(no_of_rows)
+        models = await measure("models", upload_with_models, data, no_of_rows)
+        loader = await measure(
+            "loader",
+            bulk_upload_sales_transactions_from_csv,
+            data,
+            no_of_rows,
+        )
+        logging.info(f"speedup: {loader / models:.2f}x")
+
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    asyncio.run(main(parser.parse_args().rows))
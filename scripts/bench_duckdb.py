@@ -0,0 +1,119 @@
+"""
+Compare the wide aggregations on SQLite and on the DuckDB mirror.
+
+A generated dataset is seeded into a temporary SQLite file, as
+``datagen.py --format db`` does. Every cuboid the cube builds with a full
+GROUP BY, and the category share changes of the whole period, are then
+run by the DAO functions with each analytics engine. The time DuckDB
+takes to copy the tables, and the best time of each query, are logged.
+
+    poetry run python scripts/bench_duckdb.py --rows 10000000
+"""
+
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+from itertools import combinations
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+from tortoise import Tortoise
+
+from datagen import DataGenerator, GeneratorConfig, seed_database
+from gobble_cube.db.dao.category_share import fetch_category_share_data_for_period
+from gobble_cube.db.dao.cube import DIMENSION_COLUMNS, fetch_cuboid
+from gobble_cube.db.dao.duckdb_mirror import duckdb_mirror
+from gobble_cube.settings import AnalyticsEngine, settings
+
+logging.basicConfig(level=logging.INFO)
+
+
+def build_queries(start: str, end: str) -> Dict[str, Callable[[], Awaitable]]:
+    """
+    List the queries to time.
+
+    :param start: first day of the data.
+    :param end: last day of the data.
+    :return: query name to a coroutine function running it.
+    """
+    dimensions = list(DIMENSION_COLUMNS)
+    benchmarks: Dict[str, Callable[[], Awaitable]] = {}
+    for size in range(len(dimensions) + 1):
+        for group in combinations(dimensions, size):
+            # Bind the group now, not when the loop is done
+            benchmarks[",".join(group) or "total"] = lambda group=group: fetch_cuboid(
+                group
+            )
+    benchmarks["category shares"] = lambda: fetch_category_share_data_for_period(
+        start, end, 0
+    )
+    return benchmarks
+
+
+async def time_queries(
+    benchmarks: Dict[str, Callable[[], Awaitable]],
+    repeat: int,
+) -> Dict[str, float]:
+    """
+    Time every query with the current analytics engine.
+
+    :param benchmarks: query name to a coroutine function running it.
+    :param repeat: number of runs, the best is kept.
+    :return: query name to its best time in seconds.
+    """
+    timings = {}
+    for name, run in benchmarks.items():
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await run()
+            best = min(best, time.perf_counter() - started)
+        timings[name] = best
+    return timings
+
+
+async def main(no_of_rows: int, repeat: int) -> None:
+    """
+    Measure both engines on the same data.
+
+    :param no_of_rows: number of sales transactions and category shares.
+    :param repeat: number of runs of every query.
+    """
+    generator = DataGenerator(GeneratorConfig())
+    labels: List[str] = generator.day_labels.tolist()
+    benchmarks = build_queries(labels[0], labels[-1])
+    with tempfile.TemporaryDirectory() as directory:
+        db_url = f"sqlite://{Path(directory) / 'bench.sqlite3'}"
+        await seed_database(generator, no_of_rows, db_url)
+        await Tortoise.init(
+            db_url=db_url, modules={"models": ["gobble_cube.db.models"]}
+        )
+
+        settings.analytics_engine = AnalyticsEngine.SQLITE
+        sqlite = await time_queries(benchmarks, repeat)
+
+        settings.analytics_engine = AnalyticsEngine.DUCKDB
+        started = time.perf_counter()
+        await duckdb_mirror.sync()
+        logging.info(f"mirror copy: {time.perf_counter() - started:.2f}s")
+        duckdb = await time_queries(benchmarks, repeat)
+
+        duckdb_mirror.reset()
+        await Tortoise.close_connections()
+
+    for name in benchmarks:
+        logging.info(
+            f"{name:>32}: sqlite {sqlite[name] * 1000:9.1f}ms, "
+            f"duckdb {duckdb[name] * 1000:9.1f}ms "
+            f"({sqlite[name] / duckdb[name]:.2f}x)",
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    arguments = parser.parse_args()
+    asyncio.run(main(arguments.rows, arguments.repeat))
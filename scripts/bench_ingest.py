@@ -0,0 +1,326 @@
+"""
+Benchmark the three upload services on generated files.
+
+For every size, products, sales transactions and category shares files are
+generated with ``datagen.py`` and uploaded, in that order, into a temporary
+SQLite file. Each upload runs in a fresh process, so its peak RSS is its
+own. tracemalloc slows allocations down several times, so the high-water
+mark is taken by a second run of the upload on a copy of the database,
+for sizes up to ``--tracemalloc-max-rows``. Rows/sec, transaction time,
+peak RSS and the tracemalloc high-water mark are saved as JSON. Given a
+baseline JSON, the run fails when throughput drops, or memory grows, by
+more than the threshold.
+
+    poetry run python scripts/bench_ingest.py --sizes 10k,1M --output bench.json
+    poetry run python scripts/bench_ingest.py --baseline bench.json --threshold 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from datagen import (
+    CATEGORY_SHARE_COLUMNS,
+    PRODUCT_CATEGORY_COLUMNS,
+    SALES_COLUMNS,
+    DataGenerator,
+    GeneratorConfig,
+    to_file_columns,
+    write_csv,
+    write_parquet,
+)
+from tortoise import Tortoise
+
+from gobble_cube.services.category_share import bulk_upload_category_share_from_csv
+from gobble_cube.services.product import bulk_upload_products_from_csv
+from gobble_cube.services.service_transaction import (
+    bulk_upload_sales_transactions_from_csv,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+# Uploads in the order they must run, with the file they read
+SERVICES = [
+    ("product", "product_category"),
+    ("sales_transaction", "sales_data"),
+    ("category_share", "category_share_data"),
+]
+
+UPLOADERS = {
+    "product": bulk_upload_products_from_csv,
+    "sales_transaction": bulk_upload_sales_transactions_from_csv,
+    "category_share": bulk_upload_category_share_from_csv,
+}
+
+SIZE_SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+
+def parse_size(value: str) -> int:
+    """
+    Parse a number of rows such as ``10k`` or ``1M``.
+
+    :param value: number, optionally suffixed with k or M.
+    :return: number of rows.
+    """
+    multiplier = SIZE_SUFFIXES.get(value[-1].lower(), 1)
+    return int(float(value.rstrip("kKmM")) * multiplier)
+
+
+def generate_files(rows: int, directory: Path, file_format: str) -> Dict[str, Path]:
+    """
+    Generate the upload files of a benchmark size.
+
+    :param rows: number of sales transactions and category shares.
+    :param directory: output directory.
+    :param file_format: ``csv`` or ``parquet``.
+    :return: file name to path.
+    """
+    generator = DataGenerator(GeneratorConfig())
+    write = write_parquet if file_format == "parquet" else write_csv
+    tables = {
+        "product_category": (generator.product_categories(), PRODUCT_CATEGORY_COLUMNS),
+        "sales_data": (generator.sales(rows), SALES_COLUMNS),
+        "category_share_data": (
+            generator.category_shares(rows),
+            CATEGORY_SHARE_COLUMNS,
+        ),
+    }
+    paths = {}
+    for name, (chunks, columns) in tables.items():
+        paths[name] = directory / f"{name}.{file_format}"
+        write(
+            paths[name],
+            (to_file_columns(generator, chunk, columns) for chunk in chunks),
+            columns,
+        )
+    return paths
+
+
+async def run_upload(service: str, path: Path, db_file: Path) -> Dict[str, Any]:
+    """
+    Upload a file with one of the services and measure it.
+
+    :param service: upload service to run.
+    :param path: file to upload.
+    :param db_file: SQLite database.
+    :return: measurements.
+    """
+    await Tortoise.init(
+        db_url=f"sqlite://{db_file}",
+        modules={"models": ["gobble_cube.db.models"]},
+    )
+    await Tortoise.generate_schemas()
+
+    started = time.perf_counter()
+    result = await UPLOADERS[service](path)
+    elapsed = time.perf_counter() - started
+
+    await Tortoise.close_connections()
+    return {"rows": result.rows, "transaction_seconds": elapsed}
+
+
+def measure_upload(
+    service: str,
+    path: Path,
+    db_file: Path,
+    trace: bool,
+) -> Dict[str, Any]:
+    """
+    Run an upload in the current process, recording its memory use.
+
+    :param service: upload service to run.
+    :param path: file to upload.
+    :param db_file: SQLite database.
+    :param trace: record the tracemalloc high-water mark.
+    :return: measurements.
+    """
+    if trace:
+        tracemalloc.start()
+    measurement = asyncio.run(run_upload(service, path, db_file))
+    if trace:
+        measurement["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    measurement["peak_rss_bytes"] = (
+        max_rss if sys.platform == "darwin" else max_rss * 1024
+    )
+    return measurement
+
+
+def run_in_child(
+    service: str,
+    path: Path,
+    db_file: Path,
+    trace: bool,
+) -> Dict[str, Any]:
+    """
+    Run an upload in a fresh process.
+
+    :param service: upload service to run.
+    :param path: file to upload.
+    :param db_file: SQLite database.
+    :param trace: record the tracemalloc high-water mark.
+    :return: measurements.
+    """
+    with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(measure_upload, service, path, db_file, trace).result()
+
+
+def run_size(rows: int, file_format: str, trace_max_rows: int) -> List[Dict[str, Any]]:
+    """
+    Benchmark the three uploads for one size, on an empty database.
+
+    :param rows: number of sales transactions and category shares.
+    :param file_format: ``csv`` or ``parquet``.
+    :param trace_max_rows: largest size traced with tracemalloc.
+    :return: one result per service.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        paths = generate_files(rows, Path(directory), file_format)
+        logging.info(f"{rows:,} rows generated in {time.perf_counter() - started:.1f}s")
+
+        db_file = Path(directory) / "bench.sqlite3"
+        traced_db_file = Path(directory) / "traced.sqlite3"
+        for service, file_name in SERVICES:
+            path = paths[file_name]
+            traced = {}
+            if rows <= trace_max_rows:
+                if db_file.exists():
+                    shutil.copy(db_file, traced_db_file)
+                traced = run_in_child(service, path, traced_db_file, trace=True)
+                traced_db_file.unlink()
+            measurement = run_in_child(service, path, db_file, trace=False)
+
+            seconds = measurement["transaction_seconds"]
+            result = {
+                "service": service,
+                "size": rows,
+                "file_bytes": path.stat().st_size,
+                "rows_per_second": measurement["rows"] / seconds if seconds else 0.0,
+                **measurement,
+            }
+            if "tracemalloc_peak_bytes" in traced:
+                result["tracemalloc_peak_bytes"] = traced["tracemalloc_peak_bytes"]
+            logging.info(
+                f"{service:>17} {result['rows']:>12,} rows {seconds:8.2f}s "
+                f"{result['rows_per_second']:>12,.0f} rows/s "
+                f"rss {result['peak_rss_bytes'] / 2**20:8.1f} MiB",
+            )
+            results.append(result)
+    return results
+
+
+def find_regressions(
+    results: List[Dict[str, Any]],
+    baseline: List[Dict[str, Any]],
+    threshold: float,
+) -> List[str]:
+    """
+    Compare results with a baseline run.
+
+    :param results: current results.
+    :param baseline: results of the baseline run.
+    :param threshold: tolerated relative change, 0.2 is 20%.
+    :return: description of every regression.
+    """
+    previous = {(result["service"], result["size"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get((result["service"], result["size"]))
+        if base is None:
+            continue
+        name = f"{result['service']} at {result['size']:,} rows"
+        if result["rows_per_second"] < base["rows_per_second"] * (1 - threshold):
+            regressions.append(
+                f"{name}: {result['rows_per_second']:,.0f} rows/s, "
+                f"baseline {base['rows_per_second']:,.0f} rows/s",
+            )
+        for metric in ("peak_rss_bytes", "tracemalloc_peak_bytes"):
+            if (
+                metric in result
+                and metric in base
+                and result[metric] > base[metric] * (1 + threshold)
+            ):
+                regressions.append(
+                    f"{name}: {metric} {result[metric]:,}, baseline {base[metric]:,}",
+                )
+    return regressions
+
+
+def main(args: argparse.Namespace) -> int:
+    """
+    Run the benchmark and compare it with the baseline.
+
+    :param args: command line arguments.
+    :return: exit status, 1 on regression.
+    """
+    results = []
+    for rows in args.sizes:
+        results.extend(run_size(rows, args.format, args.tracemalloc_max_rows))
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "format": args.format,
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    logging.info(f"Results saved to {args.output}")
+
+    if args.baseline is None:
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get("format") != args.format:
+        logging.warning("The baseline was run on another format, compare with care")
+    regressions = find_regressions(results, baseline["results"], args.threshold)
+    for regression in regressions:
+        logging.error(f"Regression: {regression}")
+    return 1 if regressions else 0
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parse the command line.
+
+    :param argv: arguments, ``sys.argv`` by default.
+    :return: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [parse_size(size) for size in value.split(",")],
+        default=[10_000, 1_000_000, 10_000_000],
+    )
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--output", type=Path, default=Path("bench_ingest.json"))
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument(
+        "--tracemalloc-max-rows",
+        type=parse_size,
+        default=1_000_000,
+        help="sizes above are not traced, 0 disables tracemalloc",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
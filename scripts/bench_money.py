@@ -0,0 +1,144 @@
+"""
+Compare revenues stored as decimal text and as integer cents.
+
+The same sales transactions are written to two SQLite files: one with
+revenue as the text the decimal fields used to store, summed in cents the
+way the rollups did, the other with revenue in cents, summed as stored.
+The size of each file, and the best time of each query, are logged.
+
+    poetry run python scripts/bench_money.py --rows 1000000
+"""
+
+import argparse
+import logging
+import random
+import sqlite3
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+logging.basicConfig(level=logging.INFO)
+
+# Revenue column type and the SQL summing it in cents
+LAYOUTS = {
+    "text": ("VARCHAR(40)", "CAST(ROUND(revenue * 100) AS INTEGER)"),
+    "cents": ("BIGINT", "revenue"),
+}
+
+QUERIES = {
+    "total": "SELECT SUM({cents}) FROM sales_transactions",
+    "by day": "SELECT date, SUM({cents}) FROM sales_transactions GROUP BY date",
+    "period": (
+        "SELECT SUM({cents}) FROM sales_transactions "
+        "WHERE date BETWEEN '2024-03-01' AND '2024-05-31'"
+    ),
+}
+
+
+def generate_rows(no_of_rows: int) -> List[Tuple[str, int, int]]:
+    """
+    Generate sales transactions.
+
+    :param no_of_rows: number of rows.
+    :return: date, quantity and revenue in cents of every row.
+    """
+    rng = random.Random(42)
+    return [
+        (
+            f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            rng.randint(1, 10),
+            rng.randint(100, 100_000),
+        )
+        for _ in range(no_of_rows)
+    ]
+
+
+def build(path: Path, layout: str, rows: List[Tuple[str, int, int]]) -> int:
+    """
+    Write the rows to a new database.
+
+    :param path: database file.
+    :param layout: key of ``LAYOUTS``.
+    :param rows: rows to write.
+    :return: size of the file in bytes.
+    """
+    column_type, _ = LAYOUTS[layout]
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE sales_transactions (id INTEGER PRIMARY KEY, "
+        f"date DATE NOT NULL, quantity INT NOT NULL, revenue {column_type} NOT NULL)",
+    )
+    connection.execute("CREATE INDEX idx_date ON sales_transactions (date)")
+    if layout == "text":
+        values = [
+            (day, quantity, str(Decimal(cents).scaleb(-2).normalize()))
+            for day, quantity, cents in rows
+        ]
+    else:
+        values = rows
+    connection.executemany(
+        "INSERT INTO sales_transactions (date, quantity, revenue) VALUES (?, ?, ?)",
+        values,
+    )
+    connection.commit()
+    connection.execute("VACUUM")
+    connection.close()
+    return path.stat().st_size
+
+
+def time_queries(path: Path, layout: str, repeat: int) -> Dict[str, float]:
+    """
+    Time every query on a database.
+
+    :param path: database file.
+    :param layout: key of ``LAYOUTS``.
+    :param repeat: number of runs, the best is kept.
+    :return: query name to its best time in seconds.
+    """
+    _, cents = LAYOUTS[layout]
+    connection = sqlite3.connect(path)
+    timings = {}
+    for name, sql in QUERIES.items():
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            connection.execute(sql.format(cents=cents)).fetchall()
+            best = min(best, time.perf_counter() - started)
+        timings[name] = best
+    connection.close()
+    return timings
+
+
+def main(no_of_rows: int, repeat: int) -> None:
+    """
+    Measure both layouts on the same data.
+
+    :param no_of_rows: number of sales transactions.
+    :param repeat: number of runs of every query.
+    """
+    rows = generate_rows(no_of_rows)
+    with tempfile.TemporaryDirectory() as directory:
+        sizes, timings = {}, {}
+        for layout in LAYOUTS:
+            path = Path(directory) / f"{layout}.sqlite3"
+            sizes[layout] = build(path, layout, rows)
+            timings[layout] = time_queries(path, layout, repeat)
+
+    for layout in LAYOUTS:
+        logging.info(f"{layout:>5}: {sizes[layout] / 2**20:8.1f} MiB")
+    for name in QUERIES:
+        text, cents = timings["text"][name], timings["cents"][name]
+        logging.info(
+            f"{name:>6}: text {text * 1000:8.1f}ms, cents {cents * 1000:8.1f}ms "
+            f"({text / cents:.2f}x)",
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+    main(arguments.rows, arguments.repeat)
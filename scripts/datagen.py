@@ -0,0 +1,476 @@
+"""
+Generate large synthetic datasets, chunk by chunk, with NumPy.
+
+Every table is produced as NumPy arrays of ``--chunk-size`` rows, so memory
+stays flat whatever the number of rows. Each chunk has its own random
+stream derived from ``--seed``, so the same arguments always produce the
+same data. Product popularity follows a Zipf law, sales follow a yearly
+and weekly seasonality, and every product belongs to one or more
+categories. The data is written to CSV or Parquet files, or inserted
+straight into the database in bulk batches.
+
+    poetry run python scripts/datagen.py --rows 50000000 --format parquet
+    poetry run python scripts/datagen.py --rows 1000000 --format db
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from gobble_cube.db.dao.bulk import bulk_insert
+from gobble_cube.db.dao.data_versions import bump_data_versions
+from gobble_cube.db.models import (
+    Category,
+    CategoryShare,
+    Product,
+    ProductCategory,
+    SalesTransaction,
+    table_name,
+)
+from gobble_cube.settings import settings
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+logging.basicConfig(level=logging.INFO)
+
+Chunk = Dict[str, np.ndarray]
+
+# Columns of the generated files, in the order the upload routes document
+SALES_COLUMNS = ["transaction_id", "date", "product_id", "quantity", "revenue"]
+CATEGORY_SHARE_COLUMNS = ["date", "product_id", "market_share"]
+PRODUCT_CATEGORY_COLUMNS = ["product_id", "category_id"]
+
+# Stream ids keeping the random streams of the tables apart
+PRODUCT_STREAM = 0
+SALES_STREAM = 1
+CATEGORY_SHARE_STREAM = 2
+
+
+@dataclass
+class GeneratorConfig:
+    """Shape of the generated dataset."""
+
+    seed: int = 42
+    products: int = 10_000
+    categories: int = 500
+    start_date: date = date(2024, 1, 1)
+    days: int = 365
+    # Exponent of the Zipf law of product popularity, 0 is uniform
+    zipf_exponent: float = 1.1
+    # Relative swing of the daily volume over the year, 0 is flat
+    seasonality: float = 0.3
+    # Extra weight of Saturdays and Sundays
+    weekend_boost: float = 0.2
+    # Categories of a product are drawn between 1 and this number
+    max_categories_per_product: int = 3
+    chunk_size: int = 1_000_000
+
+
+class DataGenerator:
+    """
+    Vectorized generator of products, sales and category shares.
+
+    Sampling distributions are computed once, then every chunk is drawn
+    with a handful of NumPy calls. Chunk ``i`` of a table always uses the
+    same random stream, so a dataset can be regenerated, or extended,
+    deterministically.
+    """
+
+    def __init__(self, config: GeneratorConfig) -> None:
+        self.config = config
+        setup = self._rng(PRODUCT_STREAM, -1)
+
+        ranks = np.arange(1, config.products + 1, dtype=np.float64)
+        popularity = ranks**-config.zipf_exponent
+        self.product_cdf = np.cumsum(popularity / popularity.sum())
+        # The most popular products are spread over the id range
+        self.product_by_rank = setup.permutation(config.products) + 1
+        # Each product has a unit price, log-normally distributed, in cents
+        self.unit_price = np.clip(
+            np.rint(setup.lognormal(mean=7.5, sigma=1.0, size=config.products)),
+            1,
+            500_000,
+        ).astype(np.int64)
+
+        offsets = np.arange(config.days)
+        day_of_year = np.array(
+            [
+                (config.start_date + timedelta(days=int(d))).timetuple().tm_yday
+                for d in offsets
+            ],
+        )
+        weekday = (config.start_date.weekday() + offsets) % 7
+        weights = 1 + config.seasonality * np.sin(2 * np.pi * day_of_year / 365.25)
+        weights = weights * (1 + config.weekend_boost * (weekday >= 5))
+        self.day_cdf = np.cumsum(weights / weights.sum())
+        self.day_labels = np.array(
+            [(config.start_date + timedelta(days=int(d))).isoformat() for d in offsets],
+            dtype=object,
+        )
+
+    def _rng(self, stream: int, chunk: int) -> np.random.Generator:
+        return np.random.default_rng([self.config.seed, stream, chunk + 1])
+
+    def _chunks(self, rows: int) -> Iterator[tuple]:
+        size = self.config.chunk_size
+        for index, start in enumerate(range(0, rows, size)):
+            yield index, start, min(size, rows - start)
+
+    def sample_products(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        """
+        Draw product ids following the popularity law.
+
+        :param rng: random stream.
+        :param size: number of ids.
+        :return: product ids.
+        """
+        ranks = np.searchsorted(self.product_cdf, rng.random(size), side="right")
+        return self.product_by_rank[np.minimum(ranks, self.config.products - 1)]
+
+    def sample_days(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        """
+        Draw day offsets following the seasonality.
+
+        :param rng: random stream.
+        :param size: number of days.
+        :return: offsets from the start date.
+        """
+        days = np.searchsorted(self.day_cdf, rng.random(size), side="right")
+        return np.minimum(days, self.config.days - 1)
+
+    def product_categories(self) -> Iterator[Chunk]:
+        """
+        Generate the product to category relations.
+
+        :yield: chunks with ``product_id`` and ``category_id`` arrays.
+        """
+        config = self.config
+        for index, start, size in self._chunks(config.products):
+            rng = self._rng(PRODUCT_STREAM, index)
+            product_ids = np.arange(start + 1, start + size + 1)
+            fan_out = rng.integers(1, config.max_categories_per_product + 1, size)
+            product_ids = np.repeat(product_ids, fan_out)
+            category_ids = rng.integers(1, config.categories + 1, len(product_ids))
+            # A product is listed once per category
+            pairs = np.unique(np.stack([product_ids, category_ids], axis=1), axis=0)
+            yield {"product_id": pairs[:, 0], "category_id": pairs[:, 1]}
+
+    def sales(self, rows: int) -> Iterator[Chunk]:
+        """
+        Generate sales transactions.
+
+        :param rows: number of transactions.
+        :yield: chunks of arrays, revenue is in cents.
+        """
+        for index, start, size in self._chunks(rows):
+            rng = self._rng(SALES_STREAM, index)
+            product_ids = self.sample_products(rng, size)
+            quantity = rng.geometric(0.4, size).astype(np.int64)
+            yield {
+                "transaction_id": np.arange(start + 1, start + size + 1),
+                "day": self.sample_days(rng, size),
+                "product_id": product_ids,
+                "quantity": quantity,
+                "revenue": quantity * self.unit_price[product_ids - 1],
+            }
+
+    def category_shares(self, rows: int) -> Iterator[Chunk]:
+        """
+        Generate category shares.
+
+        :param rows: number of shares.
+        :yield: chunks of arrays, market share is in basis points.
+        """
+        for index, _, size in self._chunks(rows):
+            rng = self._rng(CATEGORY_SHARE_STREAM, index)
+            yield {
+                "day": self.sample_days(rng, size),
+                "product_id": self.sample_products(rng, size),
+                "market_share": rng.integers(1, 10_001, size),
+            }
+
+
+def scaled_labels(values: np.ndarray, places: int) -> np.ndarray:
+    """
+    Render integers scaled by ``10**places`` as decimal text.
+
+    Only the distinct values of the chunk are rendered.
+
+    :param values: scaled integers.
+    :param places: number of decimal places.
+    :return: object array of text.
+    """
+    unique, inverse = np.unique(values, return_inverse=True)
+    labels = [f"{v // 10**places}.{v % 10**places:0{places}d}" for v in unique]
+    return np.array(labels, dtype=object)[inverse]
+
+
+def to_file_columns(
+    generator: DataGenerator,
+    chunk: Chunk,
+    columns: List[str],
+) -> Dict[str, Any]:
+    """
+    Turn a generated chunk into the columns of the upload files.
+
+    :param generator: generator of the chunk.
+    :param chunk: generated arrays.
+    :param columns: columns of the file.
+    :return: column name to values.
+    """
+    converted: Dict[str, Any] = dict(chunk)
+    if "day" in chunk:
+        converted["date"] = generator.day_labels[chunk["day"]]
+    if "revenue" in chunk:
+        converted["revenue"] = scaled_labels(chunk["revenue"], 2)
+    if "market_share" in chunk:
+        converted["market_share"] = scaled_labels(chunk["market_share"], 2)
+    return {column: converted[column] for column in columns}
+
+
+def write_csv(path: Path, chunks: Iterator[Dict[str, Any]], columns: List[str]) -> int:
+    """
+    Write chunks of columns to a CSV file.
+
+    :param path: output file.
+    :param chunks: column name to values.
+    :param columns: columns of the file.
+    :return: number of rows written.
+    """
+    rows = 0
+    with path.open("wb") as file:
+        file.write((",".join(columns) + "\n").encode())
+        for chunk in chunks:
+            if pa is not None:
+                table = pa.table({column: chunk[column] for column in columns})
+                pa_csv.write_csv(
+                    table,
+                    file,
+                    pa_csv.WriteOptions(include_header=False, quoting_style="none"),
+                )
+                rows += table.num_rows
+                continue
+
+            values = [chunk[column].tolist() for column in columns]
+            line = ",".join("{}" for _ in columns) + "\n"
+            file.write("".join(line.format(*row) for row in zip(*values)).encode())
+            rows += len(values[0])
+    return rows
+
+
+def write_parquet(
+    path: Path,
+    chunks: Iterator[Dict[str, Any]],
+    columns: List[str],
+) -> int:
+    """
+    Write chunks of columns to a Parquet file, a row group per chunk.
+
+    :param path: output file.
+    :param chunks: column name to values.
+    :param columns: columns of the file.
+    :raises RuntimeError: if pyarrow is not installed.
+    :return: number of rows written.
+    """
+    if pa is None:
+        raise RuntimeError("Parquet output needs the `columnar` extra (pyarrow).")
+
+    rows = 0
+    writer: Optional[Any] = None
+    for chunk in chunks:
+        table = pa.table({column: chunk[column] for column in columns})
+        if writer is None:
+            writer = pq.ParquetWriter(str(path), table.schema)
+        writer.write_table(table)
+        rows += table.num_rows
+    if writer is not None:
+        writer.close()
+    return rows
+
+
+def write_files(
+    generator: DataGenerator,
+    rows: int,
+    output: Path,
+    file_format: str,
+) -> None:
+    """
+    Write the product, sales and category share files.
+
+    :param generator: data generator.
+    :param rows: number of sales transactions and category shares.
+    :param output: output directory.
+    :param file_format: ``csv`` or ``parquet``.
+    """
+    output.mkdir(parents=True, exist_ok=True)
+    write = write_parquet if file_format == "parquet" else write_csv
+    tables = [
+        ("product_category", generator.product_categories(), PRODUCT_CATEGORY_COLUMNS),
+        ("sales_data", generator.sales(rows), SALES_COLUMNS),
+        (
+            "category_share_data",
+            generator.category_shares(rows),
+            CATEGORY_SHARE_COLUMNS,
+        ),
+    ]
+    for name, chunks, columns in tables:
+        path = output / f"{name}.{file_format}"
+        started = time.perf_counter()
+        written = write(
+            path,
+            (to_file_columns(generator, chunk, columns) for chunk in chunks),
+            columns,
+        )
+        elapsed = time.perf_counter() - started
+        logging.info(
+            f"{path}: {written:,} rows in {elapsed:.1f}s "
+            f"({written / max(elapsed, 1e-9):,.0f} rows/s)",
+        )
+
+
+async def insert_chunk(model: Any, columns: List[str], values: List[Any]) -> int:
+    """
+    Insert a chunk in one transaction, in batches of the upload batch size.
+
+    The data version of the table is bumped as an upload would do.
+
+    :param model: model of the table.
+    :param columns: database columns.
+    :param values: one sequence of values per column.
+    :return: number of rows inserted.
+    """
+    rows = list(zip(*values))
+    batch_size = settings.ingest_batch_size
+    async with in_transaction():
+        for start in range(0, len(rows), batch_size):
+            await bulk_insert(model, columns, rows[start : start + batch_size])
+        await bump_data_versions([table_name(model)])
+    return len(rows)
+
+
+async def seed_database(generator: DataGenerator, rows: int, db_url: str) -> None:
+    """
+    Insert a generated dataset straight into the database.
+
+    Values are rendered the way the model fields store them and inserted
+    with the bulk loader of the uploads, without model instances.
+
+    :param generator: data generator.
+    :param rows: number of sales transactions and category shares.
+    :param db_url: database to seed.
+    """
+    config = generator.config
+    await Tortoise.init(db_url=db_url, modules={"models": ["gobble_cube.db.models"]})
+    await Tortoise.generate_schemas()
+
+    ids = list(range(1, config.products + 1))
+    await insert_chunk(Product, ["id", "name"], [ids, [f"Product {i}" for i in ids]])
+    ids = list(range(1, config.categories + 1))
+    await insert_chunk(Category, ["id", "name"], [ids, [f"Category {i}" for i in ids]])
+    for chunk in generator.product_categories():
+        await insert_chunk(
+            ProductCategory,
+            PRODUCT_CATEGORY_COLUMNS,
+            [chunk["product_id"].tolist(), chunk["category_id"].tolist()],
+        )
+
+    started = time.perf_counter()
+    inserted = 0
+    for chunk in generator.sales(rows):
+        inserted += await insert_chunk(
+            SalesTransaction,
+            ["product_id", "quantity", "revenue", "date"],
+            [
+                chunk["product_id"].tolist(),
+                chunk["quantity"].tolist(),
+                # Stored as generated, in cents and basis points
+                chunk["revenue"].tolist(),
+                generator.day_labels[chunk["day"]].tolist(),
+            ],
+        )
+    for chunk in generator.category_shares(rows):
+        inserted += await insert_chunk(
+            CategoryShare,
+            ["market_share", "product_id", "date"],
+            [
+                chunk["market_share"].tolist(),
+                chunk["product_id"].tolist(),
+                generator.day_labels[chunk["day"]].tolist(),
+            ],
+        )
+    elapsed = time.perf_counter() - started
+    logging.info(
+        f"{db_url}: {inserted:,} rows in {elapsed:.1f}s "
+        f"({inserted / max(elapsed, 1e-9):,.0f} rows/s)",
+    )
+
+    await Tortoise.close_connections()
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse the command line.
+
+    :return: parsed arguments.
+    """
+    defaults = GeneratorConfig()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--format", choices=["csv", "parquet", "db"], default="csv")
+    parser.add_argument("--output", type=Path, default=Path())
+    parser.add_argument("--db-url", default=str(settings.db_url))
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--products", type=int, default=defaults.products)
+    parser.add_argument("--categories", type=int, default=defaults.categories)
+    parser.add_argument(
+        "--start-date",
+        type=date.fromisoformat,
+        default=defaults.start_date,
+    )
+    parser.add_argument("--days", type=int, default=defaults.days)
+    parser.add_argument("--zipf", type=float, default=defaults.zipf_exponent)
+    parser.add_argument("--seasonality", type=float, default=defaults.seasonality)
+    parser.add_argument("--weekend-boost", type=float, default=defaults.weekend_boost)
+    parser.add_argument(
+        "--max-categories",
+        type=int,
+        default=defaults.max_categories_per_product,
+    )
+    parser.add_argument("--chunk-size", type=int, default=defaults.chunk_size)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    generator = DataGenerator(
+        GeneratorConfig(
+            seed=args.seed,
+            products=args.products,
+            categories=args.categories,
+            start_date=args.start_date,
+            days=args.days,
+            zipf_exponent=args.zipf,
+            seasonality=args.seasonality,
+            weekend_boost=args.weekend_boost,
+            max_categories_per_product=args.max_categories,
+            chunk_size=args.chunk_size,
+        ),
+    )
+    if args.format == "db":
+        asyncio.run(seed_database(generator, args.rows, args.db_url))
+    else:
+        write_files(generator, args.rows, args.output, args.format)
@@ -1,12 +1,23 @@
 """
 Generate fake data for testing purposes.
 This script generates fake data for the Gobble Cube application.
+
+The rows come from the vectorized generator in ``datagen.py``, use it
+directly for larger datasets or Parquet files.
 """
 
 import logging
-from faker import Faker
-
-fake = Faker()
+from pathlib import Path
+
+from datagen import (
+    CATEGORY_SHARE_COLUMNS,
+    PRODUCT_CATEGORY_COLUMNS,
+    SALES_COLUMNS,
+    DataGenerator,
+    GeneratorConfig,
+    to_file_columns,
+    write_csv,
+)
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -16,16 +27,15 @@ def generate_sales_csv(filename: str = "sales_data.csv", no_of_entries: int = 10
     Generate a CSV file with fake sales data.
     """
 
-    with open(f"{filename}", "w") as f:
-        f.write("transaction_id,date,product_id,quantity,revenue\n")
-        for i in range(no_of_entries):
-            f.write(
-                f"{i},"
-                f"{fake.date_this_year()},"
-                f"{fake.random_int(min=1, max=no_of_entries-1)},"
-                f"{fake.random_int(min=1, max=no_of_entries-1)},"
-                f"{fake.pydecimal(left_digits=3, right_digits=2, positive=True)}\n"
-            )
+    generator = DataGenerator(GeneratorConfig(products=no_of_entries - 1))
+    write_csv(
+        Path(filename),
+        (
+            to_file_columns(generator, chunk, SALES_COLUMNS)
+            for chunk in generator.sales(no_of_entries)
+        ),
+        SALES_COLUMNS,
+    )
 
     logging.info("Sales data generated.You can find the file at: " + filename)
 
@@ -37,14 +47,15 @@ def generate_category_share_data_csv(
     Generate a CSV file with fake category share data.
     """
 
-    with open(f"{filename}", "w") as f:
-        f.write("date,product_id,market_share\n")
-        for i in range(no_of_entries):
-            f.write(
-                f"{fake.date_this_year()},"
-                f"{fake.random_int(min=1, max=no_of_entries-1)},"
-                f"{fake.pydecimal(left_digits=2, right_digits=2, positive=True)}\n"
-            )
+    generator = DataGenerator(GeneratorConfig(products=no_of_entries - 1))
+    write_csv(
+        Path(filename),
+        (
+            to_file_columns(generator, chunk, CATEGORY_SHARE_COLUMNS)
+            for chunk in generator.category_shares(no_of_entries)
+        ),
+        CATEGORY_SHARE_COLUMNS,
+    )
 
     logging.info("Category share data generated. you can find the file at: " + filename)
 
@@ -56,10 +67,17 @@ def generate_product_category_csv(
     Generate a CSV file with fake product category data.
     """
 
-    with open(f"{filename}", "w") as f:
-        f.write("product_id,category_id\n")
-        for i in range(no_of_entries):
-            f.write(f"{i}," f"{fake.random_int(min=1, max=no_of_entries-1)}\n")
+    generator = DataGenerator(
+        GeneratorConfig(products=no_of_entries, categories=no_of_entries - 1),
+    )
+    write_csv(
+        Path(filename),
+        (
+            to_file_columns(generator, chunk, PRODUCT_CATEGORY_COLUMNS)
+            for chunk in generator.product_categories()
+        ),
+        PRODUCT_CATEGORY_COLUMNS,
+    )
 
     logging.info(
         "Product category data generated.You can find the file at: " + filename
@@ -0,0 +1,33 @@
+"""
+Apply the schema migrations the configured database is missing.
+
+The application applies them at startup, run this to migrate a database
+without starting it.
+
+    poetry run python scripts/migrate.py
+"""
+
+import asyncio
+import logging
+
+from tortoise import Tortoise
+
+from gobble_cube.db.config import TORTOISE_CONFIG
+from gobble_cube.db.migrate import apply_migrations
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def main() -> None:
+    """Create the missing tables and indexes, then apply the migrations."""
+    await Tortoise.init(config=TORTOISE_CONFIG)
+    await Tortoise.generate_schemas()
+    try:
+        applied = await apply_migrations()
+        logging.info(f"{len(applied)} migrations applied")
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""
+Rebuild or check the daily revenue rollups and the category share summary.
+
+They are kept up to date by the uploads. Rebuild them after writing to
+``sales_transactions``, ``category_shares`` or ``product_categories`` by
+other means, and check them to compare every row with the raw tables.
+Rebuilding also rebuilds the daily sales sketches, which are estimates
+and not checked. It bumps the data versions of the tables, so running
+servers load their in-process indexes again on their next request.
+
+    poetry run python scripts/rollups.py check
+    poetry run python scripts/rollups.py rebuild
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+
+from tortoise import Tortoise
+
+from gobble_cube.db.config import TORTOISE_CONFIG
+from gobble_cube.services.category_share_summary import (
+    check_category_share_summary,
+    rebuild_category_share_summary,
+)
+from gobble_cube.services.sales_rollup import (
+    check_sales_rollups,
+    rebuild_sales_rollups,
+)
+from gobble_cube.services.sales_summary import rebuild_sales_sketches
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def main(command: str) -> int:
+    """
+    Run a rollup command against the configured database.
+
+    :param command: ``rebuild`` or ``check``.
+    :return: exit status, 1 when the check finds differences.
+    """
+    await Tortoise.init(config=TORTOISE_CONFIG)
+    await Tortoise.generate_schemas()
+    try:
+        if command == "rebuild":
+            await rebuild_sales_rollups()
+            await rebuild_category_share_summary()
+            await rebuild_sales_sketches()
+            logging.info("Rollups, category share summary and sales sketches rebuilt")
+            return 0
+
+        differences = await check_sales_rollups()
+        differences += await check_category_share_summary()
+        for difference in differences:
+            logging.error(
+                f"{difference['table']} {difference['side']}: {difference['row']}",
+            )
+        logging.info(f"{len(differences)} differing rows")
+        return 1 if differences else 0
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=["rebuild", "check"])
+    sys.exit(asyncio.run(main(parser.parse_args().command)))
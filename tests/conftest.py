@@ -9,6 +9,7 @@ from tortoise.contrib.test import finalizer, initializer
 
 from gobble_cube.db.config import MODELS_MODULES, TORTOISE_CONFIG
 from gobble_cube.settings import settings
+from gobble_cube.state import reset_process_state
 from gobble_cube.web.application import get_app
 
 nest_asyncio.apply()
@@ -40,6 +41,8 @@ async def initialize_db() -> AsyncGenerator[None, None]:
 
     yield
 
+    # Singletons registered with on_reset, the read pool included
+    await reset_process_state()
     await Tortoise.close_connections()
     finalizer()
 
@@ -0,0 +1,161 @@
+from decimal import Decimal
+from typing import List
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from starlette import status
+
+from gobble_cube.db.dao.category_share import fetch_category_share_data_for_period
+from gobble_cube.db.models import CategoryShare, ProductCategory
+from gobble_cube.services.category_share import (
+    bulk_upload_category_share_from_csv,
+    get_significant_category_shares_for_period,
+)
+from gobble_cube.services.category_share_index import (
+    MinMaxSegmentTree,
+    category_share_index,
+)
+from gobble_cube.services.category_share_summary import (
+    check_category_share_summary,
+    rebuild_category_share_summary,
+)
+from gobble_cube.services.idempotency import UploadMode
+from gobble_cube.services.product import bulk_upload_products_from_csv
+from tests.utils import write_as_other_process
+
+
+@pytest.mark.anyio
+async def test_min_max_segment_tree() -> None:
+    """Checks every range of the segment tree against min and max."""
+    lows = [5, 3, 8, 1, 9, 2, 7]
+    highs = [6, 4, 9, 10, 9, 3, 8]
+    tree = MinMaxSegmentTree(list(lows), list(highs))
+    tree.update(3, 4, 4)
+    lows[3] = highs[3] = 4
+
+    for start in range(len(lows)):
+        for stop in range(start + 1, len(lows) + 1):
+            assert tree.query(start, stop) == (
+                min(lows[start:stop]),
+                max(highs[start:stop]),
+            )
+
+
+async def expected_share_changes(start: str, end: str) -> List[tuple]:
+    """
+    Compute the market share changes of the categories from the raw rows.
+
+    :param start: first day.
+    :param end: last day.
+    :return: category id and change, largest change first.
+    """
+    shares = await CategoryShare.filter(date__range=(start, end)).values_list(
+        "product_id",
+        "market_share",
+    )
+    links = await ProductCategory.all().values_list("product_id", "category_id")
+    by_category: dict = {}
+    for product_id, market_share in shares:
+        for linked_product, category_id in set(links):
+            if linked_product == product_id:
+                by_category.setdefault(category_id, []).append(market_share)
+    # Market shares are stored in basis points
+    changes = [(c, Decimal(max(v) - min(v)).scaleb(-2)) for c, v in by_category.items()]
+    return sorted(changes, key=lambda item: (-item[1], item[0]))
+
+
+@pytest.mark.anyio
+async def test_significant_category_shares_follow_uploads() -> None:
+    """Checks the range index against the raw category shares."""
+    await bulk_upload_products_from_csv(
+        "product_id,category_id\n1,10\n2,10\n2,11\n3,12\n",
+    )
+    await bulk_upload_category_share_from_csv(
+        "market_share,product_id,date\n"
+        "9.5,1,2024-01-01\n15,2,2024-01-01\n20,3,2024-01-02\n"
+        "30,1,2024-01-03\n12.25,3,2024-01-05\n",
+    )
+    # Loaded now, then kept up to date by the next uploads
+    await category_share_index.load()
+    await bulk_upload_category_share_from_csv(
+        "market_share,product_id,date\n40,2,2024-01-02\n1,1,2024-01-04\n",
+    )
+    await bulk_upload_category_share_from_csv(
+        "market_share,product_id,date\n10,1,2024-01-03\n",
+        mode=UploadMode.REPLACE,
+    )
+    await bulk_upload_products_from_csv(
+        "product_id,category_id\n3,11\n",
+        mode=UploadMode.REPLACE,
+    )
+    assert await check_category_share_summary() == []
+
+    days = [f"2024-01-0{day}" for day in range(1, 7)]
+    for start in days:
+        for end in days[days.index(start) :]:
+            expected = await expected_share_changes(start, end)
+            changes = await get_significant_category_shares_for_period(
+                start,
+                end,
+                limit=0,
+            )
+            assert [
+                (row["category_id"], row["market_share_change"]) for row in changes
+            ] == expected
+            top = await get_significant_category_shares_for_period(start, end, 2)
+            assert top == changes[:2]
+            raw = await fetch_category_share_data_for_period(start, end, 0)
+            assert [
+                (row["category_id"], row["market_share_change"]) for row in raw
+            ] == [(category_id, float(change)) for category_id, change in expected]
+
+    await rebuild_category_share_summary()
+    assert await check_category_share_summary() == []
+    # Dates SQLite compares as text are answered from the summary table
+    changes = await get_significant_category_shares_for_period(
+        "2024-01-01",
+        "2024-01-6",
+        0,
+    )
+    assert changes == await get_significant_category_shares_for_period(
+        "2024-01-01",
+        "2024-01-05",
+        0,
+    )
+
+
+@pytest.mark.anyio
+async def test_category_share_index_reloads_after_writes_of_other_processes() -> None:
+    """Checks that the index loads again when another process wrote shares."""
+    await bulk_upload_products_from_csv("product_id,category_id\n3,12\n")
+    await bulk_upload_category_share_from_csv(
+        "market_share,product_id,date\n20,3,2024-01-02\n",
+    )
+    assert await category_share_index.top("2024-01-01", "2024-01-31") == [(12, 0)]
+
+    await write_as_other_process(
+        'INSERT INTO "category_daily_share" '
+        '("category_id", "date", "min_share_bp", "max_share_bp") '
+        "VALUES (12, '2024-01-09', 5000, 5000)",
+        ["category_shares"],
+    )
+    assert await category_share_index.top("2024-01-01", "2024-01-31") == [(12, 3000)]
+
+
+@pytest.mark.anyio
+async def test_significant_category_shares_require_dates(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+) -> None:
+    """
+    Checks that significant shares without a period are a bad request.
+
+    :param client: client for the app.
+    :param fastapi_app: current FastAPI application.
+    """
+    response = await client.get(
+        fastapi_app.url_path_for("get_significant_category_shares"),
+        params={"start_date": "2024-01-01", "end_date": ""},
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,352 @@
+import json
+import random
+from datetime import date
+from decimal import Decimal
+from itertools import combinations
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from starlette import status
+
+from gobble_cube.db.dao.cube import fetch_cuboid
+from gobble_cube.db.models import Product, ProductCategory
+from gobble_cube.services.cube import DIMENSIONS, sales_cube, select_cuboids
+from gobble_cube.services.idempotency import UploadMode
+from gobble_cube.services.product import bulk_upload_products_from_csv
+from gobble_cube.services.product_categories import (
+    ProductCategoryMap,
+    product_category_index,
+)
+from gobble_cube.services.service_transaction import (
+    bulk_upload_sales_transactions_from_csv,
+    get_sales_data_by_dimensions,
+    get_sales_data_page,
+)
+from gobble_cube.settings import settings
+from tests.utils import SALES_CSV, write_as_other_process
+
+
+@pytest.mark.anyio
+async def test_select_cuboids_prefers_most_beneficial() -> None:
+    """Checks the greedy selection of the materialized cuboids."""
+    sizes = {
+        frozenset({"product", "date"}): 50.0,
+        frozenset({"product"}): 10.0,
+        frozenset({"date"}): 20.0,
+        frozenset(): 1.0,
+    }
+
+    assert select_cuboids(sizes, raw_rows=100, budget=100) == [
+        frozenset({"product", "date"}),
+        frozenset({"date"}),
+        frozenset({"product"}),
+        frozenset(),
+    ]
+    # Small cuboids save the most per cell, the largest one does not fit
+    assert select_cuboids(sizes, raw_rows=100, budget=31) == [
+        frozenset({"date"}),
+        frozenset({"product"}),
+        frozenset(),
+    ]
+    assert select_cuboids(sizes, raw_rows=1, budget=100) == []
+
+
+@pytest.mark.parametrize("max_cells", [0, 12, 10_000])
+@pytest.mark.anyio
+async def test_sales_cube_matches_sql(
+    monkeypatch: pytest.MonkeyPatch,
+    max_cells: int,
+) -> None:
+    """Checks that every cuboid of the cube holds the SQL aggregates."""
+    monkeypatch.setattr(settings, "cube_max_cells", max_cells)
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n1,11\n2,10\n")
+    await Product.create(id=3, name="no category")
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    # Built now, then kept up to date by the next uploads
+    await sales_cube.load()
+    await bulk_upload_sales_transactions_from_csv(
+        "date,product_id,quantity,revenue\n2024-01-05,3,1,0.30\n2024-01-01,2,2,10.50\n",
+    )
+    await bulk_upload_products_from_csv(
+        "product_id,category_id\n2,12\n",
+        mode=UploadMode.REPLACE,
+    )
+    await bulk_upload_sales_transactions_from_csv(
+        "date,product_id,quantity,revenue\n2024-01-02,1,1,1.10\n",
+        mode=UploadMode.REPLACE,
+    )
+
+    for size in range(len(DIMENSIONS) + 1):
+        for dimensions in combinations(DIMENSIONS, size):
+            expected = await fetch_cuboid(dimensions)
+            cells = await sales_cube.query(dimensions)
+            assert sorted(expected, key=str) == sorted(
+                ((*cell, cents) for cell, cents in cells.items()),
+                key=str,
+            )
+
+
+@pytest.mark.anyio
+async def test_sales_cube_reloads_after_writes_of_other_processes() -> None:
+    """Checks that the cube is built again when another process wrote sales."""
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n2,10\n")
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    await sales_cube.load()
+
+    await write_as_other_process(
+        'INSERT INTO "sales_transactions" '
+        '("product_id", "quantity", "revenue", "date") '
+        "VALUES (2, 1, 300, '2024-01-03')",
+        ["sales_transactions"],
+    )
+    # An upload of this process now follows the other one
+    await bulk_upload_sales_transactions_from_csv(
+        "date,product_id,quantity,revenue\n2024-01-03,1,1,1.00\n",
+    )
+
+    for dimensions in [("date",), ("category", "date"), ()]:
+        expected = await fetch_cuboid(dimensions)
+        cells = await sales_cube.query(dimensions)
+        assert sorted(expected) == sorted(
+            (*cell, cents) for cell, cents in cells.items()
+        )
+    assert sales_cube.loaded
+
+
+@pytest.mark.anyio
+async def test_sales_data_by_dimensions() -> None:
+    """Checks the rows returned for some dimensions."""
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n1,11\n")
+    await Product.create(id=2, name="no category")
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+
+    rows = await get_sales_data_by_dimensions(["date", "category"])
+    assert rows == [
+        {
+            "date": date(2024, 1, 2),
+            "product__product_categories__category_id": None,
+            "total_revenue": Decimal("4.25"),
+        },
+        {
+            "date": date(2024, 1, 1),
+            "product__product_categories__category_id": 10,
+            "total_revenue": Decimal("10.5"),
+        },
+        {
+            "date": date(2024, 1, 2),
+            "product__product_categories__category_id": 10,
+            "total_revenue": Decimal("20"),
+        },
+        {
+            "date": date(2024, 1, 1),
+            "product__product_categories__category_id": 11,
+            "total_revenue": Decimal("10.5"),
+        },
+        {
+            "date": date(2024, 1, 2),
+            "product__product_categories__category_id": 11,
+            "total_revenue": Decimal("20"),
+        },
+    ]
+    with pytest.raises(ValueError):
+        await get_sales_data_by_dimensions(["color"])
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 100])
+@pytest.mark.anyio
+async def test_sales_data_pages_cover_every_row(page_size: int) -> None:
+    """Checks that following the cursors gives every row once, in order."""
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n1,11\n")
+    await Product.create(id=2, name="no category")
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+
+    for dimensions in (["category", "date"], ["revenue", "product"], []):
+        rows, cursor = await get_sales_data_page(dimensions, page_size)
+        while cursor is not None:
+            page, cursor = await get_sales_data_page(dimensions, page_size, cursor)
+            assert page
+            rows += page
+        assert rows == await get_sales_data_by_dimensions(dimensions)
+
+    with pytest.raises(ValueError):
+        await get_sales_data_page(["date"], 10, "bm90IGEgY3Vyc29y")
+
+
+@pytest.mark.anyio
+async def test_sales_dimensions_stream(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+) -> None:
+    """Checks the newline delimited JSON stream and the paginated response."""
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n")
+    await Product.create(id=2, name="no category")
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    url = fastapi_app.url_path_for("get_sales_dimensions")
+
+    response = await client.get(
+        url,
+        params={"dimensions": "category,date", "stream": "true"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    response = await client.get(url, params={"dimensions": "category,date"})
+    assert lines == response.json()["sales_by_dimensions"]
+    assert lines[0]["product__product_categories__category_id"] is None
+
+    response = await client.get(
+        url,
+        params={"dimensions": "category,date", "page_size": 2},
+    )
+    assert response.json()["sales_by_dimensions"] == lines[:2]
+    response = await client.get(
+        url,
+        params={
+            "dimensions": "category,date",
+            "cursor": response.json()["next_cursor"],
+        },
+    )
+    assert response.json()["sales_by_dimensions"] == lines[2:]
+    assert response.json()["next_cursor"] is None
+
+    response = await client.get(url, params={"dimensions": "color", "stream": "true"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.anyio
+async def test_category_revenue_agrees_across_endpoints(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+) -> None:
+    """
+    Checks that every endpoint counts a product once in each of its categories.
+
+    :param client: client for the app.
+    :param fastapi_app: current FastAPI application.
+    """
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n2,10\n")
+    await bulk_upload_products_from_csv("product_id,category_id\n2,11\n1,10\n")
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    period = {"start_date": "2024-01-01", "end_date": "2024-01-02"}
+
+    response = await client.get(
+        fastapi_app.url_path_for("get_sales_dimensions"),
+        params={"dimensions": "category"},
+    )
+    dimensions = {
+        row["product__product_categories__category_id"]: Decimal(
+            str(row["total_revenue"]),
+        )
+        for row in response.json()["sales_by_dimensions"]
+    }
+    response = await client.get(
+        fastapi_app.url_path_for("get_top_sales_for_period"),
+        params={**period, "dimension": "category"},
+    )
+    top = {
+        row["category_id"]: Decimal(str(row["revenue"]))
+        for row in response.json()["top"]
+    }
+    assert dimensions == top == {10: Decimal("34.75"), 11: Decimal("4.25")}
+
+    for category_id, revenue in dimensions.items():
+        response = await client.get(
+            fastapi_app.url_path_for("get_sales_timeseries"),
+            params={**period, "bucket": "month", "category_id": category_id},
+        )
+        series = response.json()["series"]
+        assert sum(Decimal(str(point["revenue"])) for point in series) == revenue
+
+
+@pytest.mark.anyio
+async def test_product_category_map_follows_product_uploads() -> None:
+    """Checks the in-memory links against the table, across product uploads."""
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n1,11\n2,10\n")
+    await product_category_index.load()
+    uploads = [
+        ("product_id,category_id\n3,12\n1,12\n", UploadMode.APPEND),
+        # Linked twice, and ids too sparse to be found by subtraction
+        ("product_id,category_id\n2,11\n2,11\n900000,10\n", UploadMode.APPEND),
+        ("product_id,category_id\n1,13\n", UploadMode.REPLACE),
+    ]
+    for data, mode in uploads:
+        await bulk_upload_products_from_csv(data, mode=mode)
+        links = sorted(
+            await ProductCategory.all().values_list("product_id", "category_id"),
+        )
+        categories = product_category_index.map
+        assert (
+            sorted(
+                (product_id, category_id)
+                for product_id, row in categories.items()
+                for category_id in row
+            )
+            == links
+        )
+        assert categories.get(4, None) is None
+
+        assert len(set(links)) == len(links)
+
+        values = {product_id: product_id * 100 for product_id, _ in links}
+        expected: dict = {}
+        for product_id, category_id in links:
+            expected[category_id] = expected.get(category_id, 0) + product_id * 100
+        assert categories.scatter_add(values.items()) == expected
+        assert categories.products_of([11, 12]) == sorted(
+            {
+                product_id
+                for product_id, category_id in links
+                if category_id in (11, 12)
+            },
+        )
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.anyio
+async def test_product_category_map_patches_match_rebuilds(seed: int) -> None:
+    """Checks that spliced maps hold the links of maps built from scratch."""
+    generator = random.Random(seed)
+    # Ids too sparse to be found by subtraction for even seeds, dense otherwise
+    span = 60 if seed % 2 else 1000
+    rows = {
+        product_id: [generator.randrange(5) for _ in range(generator.randrange(3))]
+        for product_id in generator.sample(range(1, span), 30)
+    }
+    categories = ProductCategoryMap.from_rows(rows)
+    for _ in range(20):
+        patch = {
+            product_id: [generator.randrange(5) for _ in range(generator.randrange(3))]
+            for product_id in generator.sample(range(1, span + 20), 5)
+        }
+        categories = categories.patched(patch)
+        rows.update(patch)
+        expected = ProductCategoryMap.from_rows(rows)
+        assert list(map(list, dict(categories.items()).values())) == list(
+            map(list, dict(expected.items()).values()),
+        )
+        assert [product_id for product_id, _ in categories.items()] == [
+            product_id for product_id, _ in expected.items()
+        ]
+        for product_id in range(span + 30):
+            assert list(categories.get(product_id, ())) == list(
+                expected.get(product_id, ()),
+            )
+
+    # A new product next to a dense range is found by subtraction
+    dense = ProductCategoryMap.from_rows({1: [10], 2: [11]}).patched({4: [12]})
+    assert list(dense.products) == [1, 2, 3, 4]
+    assert list(dense.get(4, ())) == [12]
+
+
+@pytest.mark.anyio
+async def test_product_category_map_reloads_after_writes_of_other_processes() -> None:
+    """Checks that the links are read again when another process wrote some."""
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n2,10\n")
+    assert list((await product_category_index.current()).get(2, ())) == [10]
+
+    await write_as_other_process(
+        'INSERT INTO "product_categories" ("product_id", "category_id") VALUES (2, 11)',
+        ["product_categories"],
+    )
+    assert list((await product_category_index.current()).get(2, ())) == [10, 11]
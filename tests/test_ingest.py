@@ -0,0 +1,545 @@
+import asyncio
+import gzip
+from datetime import date
+from io import BytesIO
+from pathlib import Path
+from typing import Any, List
+
+import aiosqlite
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from starlette import status
+from tortoise import Tortoise
+from tortoise.exceptions import TransactionManagementError
+
+from gobble_cube.db.models import (
+    Category,
+    CategoryShare,
+    IngestJobRecord,
+    Product,
+    ProductCategory,
+    SalesTransaction,
+)
+from gobble_cube.db.transactions import in_write_transaction
+from gobble_cube.services import ingest, jobs
+from gobble_cube.services.category_share import bulk_upload_category_share_from_csv
+from gobble_cube.services.idempotency import UploadMode, fingerprint_upload
+from gobble_cube.services.ingest import CSVRowError, iter_csv_batches
+from gobble_cube.services.jobs import JobStatus, ingest_jobs
+from gobble_cube.services.product import bulk_upload_products_from_csv
+from gobble_cube.services.service_transaction import (
+    bulk_upload_sales_transactions_from_csv,
+)
+from gobble_cube.settings import settings
+from tests.utils import SALES_CSV
+
+
+class ChunkedFile:
+    """Async file returning its content a few bytes at a time."""
+
+    def __init__(self, content: bytes, chunk_size: int) -> None:
+        self.content = content
+        self.chunk_size = chunk_size
+
+    async def read(self, size: int = -1) -> bytes:
+        """
+        Return the next chunk.
+
+        :param size: ignored, chunks always have ``chunk_size`` bytes.
+        :return: next chunk of the content.
+        """
+        chunk = self.content[: self.chunk_size]
+        self.content = self.content[self.chunk_size :]
+        return chunk
+
+
+@pytest.mark.anyio
+async def test_iter_csv_batches_across_chunks() -> None:
+    """Checks that records split between reads are glued back together."""
+    content = 'product_id,name\n1,"multi\nline"\n2,plain\n'.encode()
+    batches: List[list] = [
+        batch
+        async for batch in iter_csv_batches(
+            ChunkedFile(content, chunk_size=3),
+            {"product_id": int, "name": str},
+            batch_size=1,
+        )
+    ]
+    assert batches == [[(1, "multi\nline")], [(2, "plain")]]
+
+
+@pytest.mark.anyio
+async def test_iter_csv_batches_reports_line_number() -> None:
+    """Checks that conversion errors carry the line of the row."""
+    with pytest.raises(CSVRowError, match="line 3"):
+        async for _ in iter_csv_batches("product_id\n1\nabc\n", {"product_id": int}):
+            pass
+
+
+@pytest.mark.anyio
+async def test_sales_transaction_upload_csv(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+) -> None:
+    """
+    Checks that an uploaded file is stored.
+
+    :param client: client for the app.
+    :param fastapi_app: current FastAPI application.
+    """
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+
+    url = fastapi_app.url_path_for("sales_transaction_upload_csv")
+    response = await client.post(url, files={"file": ("sales.csv", SALES_CSV)})
+    assert response.status_code == status.HTTP_200_OK
+    assert await SalesTransaction.all().count() == 3
+
+
+@pytest.mark.anyio
+async def test_bulk_loader_stores_same_values_as_models() -> None:
+    """Checks that the loader stores exactly what bulk_create would."""
+    await Product.create(id=1, name="a")
+    revenues = ["20.00", "2.675", "0.125", "12.3", "7"]
+    # Rounded to cents as the float the CSV value reads as
+    cents = [2000, 267, 12, 1230, 700]
+    await SalesTransaction.bulk_create(
+        [
+            SalesTransaction(
+                product_id=1,
+                quantity=1,
+                revenue=revenue,
+                date="2024-01-01",
+            )
+            for revenue in cents
+        ],
+    )
+    await bulk_upload_sales_transactions_from_csv(
+        "product_id,quantity,revenue,date\n"
+        + "".join(f"1,1,{revenue},2024-01-01\n" for revenue in revenues),
+    )
+
+    rows = await Tortoise.get_connection("default").execute_query_dict(
+        "SELECT revenue, date FROM sales_transactions ORDER BY id",
+    )
+    assert rows[: len(revenues)] == rows[len(revenues) :]
+    assert [row["revenue"] for row in rows[len(revenues) :]] == cents
+
+
+@pytest.mark.parametrize("revenue", ["inf", "-1e400", "nan", "1e30", "-1e17"])
+@pytest.mark.anyio
+async def test_scaled_values_out_of_range_are_rejected(revenue: str) -> None:
+    """Checks that values SQLite can not store are reported with their line."""
+    await Product.create(id=1, name="a")
+    with pytest.raises(CSVRowError, match="line 3"):
+        await bulk_upload_sales_transactions_from_csv(
+            f"product_id,quantity,revenue,date\n1,1,2,2024-01-01\n1,1,{revenue},2024-01-01\n",
+        )
+    assert not await SalesTransaction.exists()
+
+
+@pytest.mark.anyio
+async def test_sales_transaction_upload_csv_job(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+) -> None:
+    """
+    Checks that a background upload reports its progress.
+
+    :param client: client for the app.
+    :param fastapi_app: current FastAPI application.
+    """
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+
+    url = fastapi_app.url_path_for("sales_transaction_upload_csv_job")
+    response = await client.post(url, files={"file": ("sales.csv", SALES_CSV)})
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    job_id = response.json()["job_id"]
+
+    await asyncio.wait_for(ingest_jobs.jobs[job_id].done.wait(), timeout=5)
+    await ingest_jobs.stop()
+
+    url = fastapi_app.url_path_for("get_ingest_job", job_id=job_id)
+    response = await client.get(url)
+    job = response.json()["job"]
+    assert job["status"] == "succeeded"
+    assert job["rows_processed"] == 3
+    assert await SalesTransaction.all().count() == 3
+
+    # As reported by another worker process
+    ingest_jobs.jobs.clear()
+    response = await client.get(url)
+    assert response.json()["job"] == job
+
+
+@pytest.mark.anyio
+async def test_ingest_job_of_exited_process_is_queued_again(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Checks that a job left running by a process which exited is run again.
+
+    :param tmp_path: temporary directory.
+    :param monkeypatch: pytest monkeypatch.
+    """
+    monkeypatch.setattr(settings, "ingest_upload_dir", tmp_path)
+    monkeypatch.setattr(settings, "ingest_poll_interval", 0.01)
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+    (tmp_path / "abandoned.upload").write_text(SALES_CSV)
+    await IngestJobRecord.create(
+        id="abandoned",
+        kind="sales_transaction",
+        mode=UploadMode.APPEND.value,
+        status=JobStatus.RUNNING.value,
+        worker="exited",
+        created_at=0.0,
+        started_at=0.0,
+    )
+
+    await ingest_jobs.start()
+
+    async def finished() -> Any:
+        while True:
+            job = await ingest_jobs.get("abandoned")
+            if job is not None and job.done.is_set():
+                return job
+            await asyncio.sleep(0.01)
+
+    job = await asyncio.wait_for(finished(), timeout=5)
+    assert job.status == JobStatus.SUCCEEDED
+    assert job.rows_processed == 3
+    assert await SalesTransaction.all().count() == 3
+    assert not (tmp_path / "abandoned.upload").exists()
+
+
+@pytest.mark.anyio
+async def test_ingest_job_waits_for_write_lock_of_other_process(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Checks that workers outlast a write lock held beyond the busy timeout.
+
+    The lock is held as the job is claimed, and again as it is saved.
+
+    :param tmp_path: temporary directory.
+    :param monkeypatch: pytest monkeypatch.
+    """
+    monkeypatch.setattr(settings, "ingest_upload_dir", tmp_path)
+    monkeypatch.setattr(settings, "ingest_poll_interval", 0.01)
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+    (tmp_path / "locked.upload").write_text(SALES_CSV)
+    await IngestJobRecord.create(
+        id="locked",
+        kind="sales_transaction",
+        mode=UploadMode.APPEND.value,
+        status=JobStatus.PENDING.value,
+        created_at=0.0,
+    )
+    connection = Tortoise.get_connection("default")
+    await connection.execute_script("PRAGMA busy_timeout = 10")
+    other = await aiosqlite.connect(connection.filename, isolation_level=None)
+
+    async def upload_then_lock(*args: Any, **kwargs: Any) -> Any:
+        result = await bulk_upload_sales_transactions_from_csv(*args, **kwargs)
+        await other.execute("BEGIN IMMEDIATE")
+        return result
+
+    monkeypatch.setitem(jobs.UPLOADERS, "sales_transaction", upload_then_lock)
+
+    async def record_status() -> str:
+        record = await IngestJobRecord.get(id="locked")
+        return record.status
+
+    try:
+        await other.execute("BEGIN IMMEDIATE")
+        await ingest_jobs.start()
+        await asyncio.sleep(0.2)
+        assert await record_status() == JobStatus.PENDING.value
+        await other.execute("ROLLBACK")
+
+        # The rows are written, the job is finished but can not be saved
+        async def locked_again() -> None:
+            while not other.in_transaction:
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(locked_again(), timeout=5)
+        job = ingest_jobs.jobs["locked"]
+        await asyncio.sleep(0.2)
+        assert not job.done.is_set()
+        assert await record_status() == JobStatus.RUNNING.value
+        await other.execute("ROLLBACK")
+
+        await asyncio.wait_for(job.done.wait(), timeout=5)
+    finally:
+        await other.close()
+    assert await record_status() == JobStatus.SUCCEEDED.value
+    assert await SalesTransaction.all().count() == 3
+    assert not (tmp_path / "locked.upload").exists()
+
+
+@pytest.mark.anyio
+async def test_parallel_parse_keeps_order_and_line_numbers(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Checks that a file parsed by several processes reads like a sequential one.
+
+    :param tmp_path: temporary directory.
+    :param monkeypatch: pytest monkeypatch.
+    """
+    monkeypatch.setattr(settings, "ingest_parse_processes", 2)
+    monkeypatch.setattr(settings, "ingest_parallel_min_bytes", 0)
+    monkeypatch.setattr(ingest, "PARALLEL_RANGE_SIZE", 64)
+
+    path = tmp_path / "ids.csv"
+    path.write_text("product_id\n" + "".join(f"{i}\n" for i in range(500)))
+    schema = {"product_id": int}
+    try:
+        rows = [row async for batch in iter_csv_batches(path, schema) for row in batch]
+        assert rows == [(i,) for i in range(500)]
+
+        path.write_text(path.read_text() + "oops\n")
+        with pytest.raises(CSVRowError, match="line 502"):
+            async for _ in iter_csv_batches(path, schema):
+                pass
+    finally:
+        ingest.shutdown_process_pool()
+
+
+@pytest.mark.anyio
+async def test_parallel_parse_keeps_quoted_newlines(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Checks that ranges parsed in parallel do not end inside a quoted field.
+
+    :param tmp_path: temporary directory.
+    :param monkeypatch: pytest monkeypatch.
+    """
+    monkeypatch.setattr(settings, "ingest_parse_processes", 2)
+    monkeypatch.setattr(settings, "ingest_parallel_min_bytes", 0)
+    monkeypatch.setattr(ingest, "PARALLEL_RANGE_SIZE", 64)
+
+    path = tmp_path / "notes.csv"
+    # Notes longer than a range, with newlines where ranges would be cut
+    note = '"a ""quoted"" note,\n' + "spanning lines\n" * 10 + '"'
+    path.write_text(
+        "product_id,note\n" + "".join(f"{i},{note}\n" for i in range(50)),
+    )
+    schema = {"product_id": int}
+    try:
+        for start, end in ingest.split_file(path, 0, 64):
+            with path.open("rb") as file:
+                file.seek(start)
+                assert file.read(end - start).count(b'"') % 2 == 0
+        rows = [row async for batch in iter_csv_batches(path, schema) for row in batch]
+        assert rows == [(i,) for i in range(50)]
+
+        path.write_text(path.read_text() + "oops,x\n")
+        with pytest.raises(CSVRowError, match=f"line {50 * 12 + 2}"):
+            async for _ in iter_csv_batches(path, schema):
+                pass
+    finally:
+        ingest.shutdown_process_pool()
+
+
+@pytest.mark.anyio
+async def test_product_upload_creates_only_new_ids() -> None:
+    """Checks that products and categories are created once, with placeholders."""
+    await Product.create(id=1, name="existing")
+
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n2,10\n")
+    await bulk_upload_products_from_csv("product_id,category_id\n2,11\n3,10\n")
+
+    assert await Product.filter(id=1).values_list("name", flat=True) == ["existing"]
+    assert await Product.all().order_by("id").values_list("id", flat=True) == [1, 2, 3]
+    assert await Category.all().order_by("id").values_list("name", flat=True) == [
+        "Category 10",
+        "Category 11",
+    ]
+    assert await ProductCategory.all().count() == 4
+
+
+@pytest.mark.anyio
+async def test_product_links_uploaded_again_are_stored_once() -> None:
+    """Checks that links of files with other content are not duplicated."""
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n")
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n2,11\n")
+    await bulk_upload_products_from_csv("product_id,category_id\n2,11\n1,10\n")
+
+    links = await ProductCategory.all().values_list("product_id", "category_id")
+    assert sorted(links) == [(1, 10), (2, 11)]
+
+
+@pytest.mark.anyio
+async def test_gzip_csv_upload(client: AsyncClient, fastapi_app: FastAPI) -> None:
+    """
+    Checks that gzip-compressed CSV files are decompressed while uploaded.
+
+    :param client: client for the app.
+    :param fastapi_app: current FastAPI application.
+    """
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+
+    url = fastapi_app.url_path_for("sales_transaction_upload_csv")
+    content = gzip.compress(SALES_CSV.encode())
+    response = await client.post(url, files={"file": ("sales.csv.gz", content)})
+    assert response.status_code == status.HTTP_200_OK
+    assert await SalesTransaction.all().count() == 3
+
+    # Cut within the member, then with a corrupt deflate stream
+    for broken in (content[:-12], content[:10] + b"\xff" * 20 + content[30:]):
+        response = await client.post(url, files={"file": ("sales.csv.gz", broken)})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        with pytest.raises(ValueError, match="gzip"):
+            await bulk_upload_sales_transactions_from_csv(broken)
+    assert await SalesTransaction.all().count() == 3
+
+
+@pytest.mark.anyio
+async def test_parquet_upload() -> None:
+    """Checks that Parquet files are stored like the equivalent CSV."""
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+
+    table = pa.table(
+        {
+            "date": pa.array([date(2024, 1, 1), date(2024, 1, 2)], pa.date32()),
+            "product_id": pa.array([1, 2], pa.int32()),
+            "quantity": [2, 1],
+            "revenue": [10.5, 20.0],
+        },
+    )
+    buffer = BytesIO()
+    pq.write_table(table, buffer)
+    await bulk_upload_sales_transactions_from_csv(buffer.getvalue())
+    await bulk_upload_sales_transactions_from_csv(
+        "product_id,quantity,revenue,date\n1,2,10.5,2024-01-01\n2,1,20.0,2024-01-02\n",
+    )
+
+    rows = await Tortoise.get_connection("default").execute_query_dict(
+        "SELECT product_id, quantity, revenue, date FROM sales_transactions "
+        "ORDER BY id",
+    )
+    assert rows[:2] == rows[2:]
+
+    table = table.set_column(3, "revenue", pa.array(["1.5", "oops"]))
+    buffer = BytesIO()
+    pq.write_table(table, buffer)
+    with pytest.raises(ValueError, match="row 2"):
+        await bulk_upload_sales_transactions_from_csv(buffer.getvalue())
+
+
+@pytest.mark.anyio
+async def test_repeated_upload_is_skipped(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+) -> None:
+    """
+    Checks that a file sent twice is only stored once.
+
+    :param client: client for the app.
+    :param fastapi_app: current FastAPI application.
+    """
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+
+    url = fastapi_app.url_path_for("sales_transaction_upload_csv")
+    for _ in range(2):
+        response = await client.post(url, files={"file": ("sales.csv", SALES_CSV)})
+        assert response.status_code == status.HTTP_200_OK
+    assert "already uploaded" in response.json()["detail"]
+    assert await SalesTransaction.all().count() == 3
+
+
+@pytest.mark.anyio
+async def test_replace_mode_replaces_rows_of_natural_keys() -> None:
+    """Checks that a corrected day replaces the stored shares instead of adding."""
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+    await bulk_upload_category_share_from_csv(
+        "product_id,market_share,date\n"
+        "1,10,2024-01-01\n"
+        "2,20,2024-01-01\n"
+        "1,30,2024-01-02\n",
+    )
+
+    result = await bulk_upload_category_share_from_csv(
+        "product_id,market_share,date\n1,15,2024-01-01\n",
+        mode=UploadMode.REPLACE,
+    )
+
+    assert result.rows == 1
+    shares = await CategoryShare.all().order_by("date", "product_id")
+    assert [(s.product_id, str(s.date), s.market_share) for s in shares] == [
+        (1, "2024-01-01", 1500),
+        (2, "2024-01-01", 2000),
+        (1, "2024-01-02", 3000),
+    ]
+
+
+@pytest.mark.parametrize(
+    ("upload", "data"),
+    [
+        (bulk_upload_sales_transactions_from_csv, SALES_CSV),
+        (bulk_upload_products_from_csv, "product_id,category_id\n1,10\n"),
+        (
+            bulk_upload_category_share_from_csv,
+            "product_id,market_share,date\n1,10,2024-01-01\n",
+        ),
+    ],
+)
+@pytest.mark.anyio
+async def test_uploads_wait_for_another_writer(upload: Any, data: str) -> None:
+    """
+    Checks that an upload waits for the transaction of another process.
+
+    :param upload: upload function.
+    :param data: content of the upload.
+    """
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+    filename = Tortoise.get_connection("default").filename
+    other = await aiosqlite.connect(filename, isolation_level=None)
+    try:
+        await other.execute("BEGIN IMMEDIATE")
+        await other.execute("INSERT INTO products (id, name) VALUES (3, 'c')")
+        # Uploads from the endpoints start with a read, the fingerprint check
+        task = asyncio.create_task(
+            upload(data, fingerprint=await fingerprint_upload(data)),
+        )
+        await asyncio.sleep(0.3)
+        assert not task.done()
+        await other.execute("COMMIT")
+        result = await task
+    finally:
+        await other.close()
+    assert result.rows == data.count("\n") - 1
+    assert await Product.filter(id=3).exists()
+
+
+@pytest.mark.anyio
+async def test_write_transaction_beyond_busy_timeout_fails_cleanly() -> None:
+    """
+    Checks that a write transaction failing to begin leaves the connection usable.
+
+    Another process holds the write lock beyond the busy timeout.
+    """
+    connection = Tortoise.get_connection("default")
+    await connection.execute_script("PRAGMA busy_timeout = 10")
+    other = await aiosqlite.connect(connection.filename, isolation_level=None)
+    try:
+        await other.execute("BEGIN IMMEDIATE")
+        with pytest.raises(TransactionManagementError):
+            async with in_write_transaction():
+                pass
+        await other.execute("ROLLBACK")
+    finally:
+        await other.close()
+
+    assert Tortoise.get_connection("default") is connection
+    async with in_write_transaction():
+        await Product.create(id=1, name="a")
+    assert await Product.filter(id=1).exists()
@@ -0,0 +1,284 @@
+import asyncio
+import random
+import re
+from itertools import combinations
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from starlette import status
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from gobble_cube.db.dao.category_share import fetch_category_share_data_for_period
+from gobble_cube.db.dao.cube import (
+    build_cuboid_query,
+    fetch_cube_statistics,
+    fetch_cuboid,
+)
+from gobble_cube.db.dao.queries import QueryRegistry, queries
+from gobble_cube.db.migrate import apply_migrations, list_migrations
+from gobble_cube.db.models import (
+    CategoryShare,
+    DailySalesSketch,
+    Product,
+    ProductCategory,
+    SalesTransaction,
+)
+from gobble_cube.services.category_share import bulk_upload_category_share_from_csv
+from gobble_cube.services.cube import DIMENSIONS
+from gobble_cube.services.idempotency import UploadMode
+from gobble_cube.services.product import bulk_upload_products_from_csv
+from gobble_cube.services.service_transaction import (
+    bulk_upload_sales_transactions_from_csv,
+    get_sales_data_page,
+)
+from gobble_cube.settings import AnalyticsEngine, settings
+from tests.utils import SALES_CSV, write_as_other_process
+
+
+@pytest.mark.anyio
+async def test_registered_queries_are_timed(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+) -> None:
+    """Checks the query registry and the timings of the monitoring endpoint."""
+    registry = QueryRegistry()
+    name = registry.register("one", "SELECT ?")
+    assert registry.register("one", "SELECT ?") == name
+    with pytest.raises(ValueError):
+        registry.register("one", "SELECT 2")
+    assert await registry.fetch(name, [1]) == [(1,)]
+    assert registry.stats()["one"]["calls"] == 1
+
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    await get_sales_data_page(["category", "date"], 1)
+    response = await client.get(fastapi_app.url_path_for("query_stats"))
+    assert response.status_code == status.HTTP_200_OK
+    timing = response.json()["cuboid:category,date:sorted:limit"]
+    assert timing["calls"] == 1
+    assert timing["rows"] == 2
+    assert queries.stats() == response.json()
+
+
+@pytest.mark.anyio
+async def test_migrations_add_the_indexes() -> None:
+    """Checks that a database created by an earlier version is migrated."""
+    connection = Tortoise.get_connection("default")
+    await connection.execute_script(
+        'DROP TABLE "product_categories";'
+        'CREATE TABLE "product_categories" ('
+        '"id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, '
+        '"category_id" INT NOT NULL REFERENCES "categories" ("id"), '
+        '"product_id" INT NOT NULL REFERENCES "products" ("id"));'
+        'DROP TABLE "sales_transactions";'
+        'CREATE TABLE "sales_transactions" ('
+        '"id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "date" DATE NOT NULL, '
+        '"quantity" INT NOT NULL, "revenue" VARCHAR(40) NOT NULL, '
+        '"product_id" INT NOT NULL REFERENCES "products" ("id"));'
+        'CREATE INDEX "idx_sales_trans_product_692f6b" '
+        'ON "sales_transactions" ("product_id", "date");'
+        'DROP TABLE "category_shares";'
+        'CREATE TABLE "category_shares" ('
+        '"id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "date" DATE NOT NULL, '
+        '"market_share" VARCHAR(40) NOT NULL, '
+        '"product_id" INT NOT NULL REFERENCES "products" ("id"));'
+        "INSERT INTO \"products\" VALUES (1, 'a');"
+        "INSERT INTO \"categories\" VALUES (10, 'c');"
+        'INSERT INTO "product_categories" VALUES (1, 10, 1), (2, 10, 1);'
+        'INSERT INTO "sales_transactions" '
+        "VALUES (1, '2024-01-01', 2, '2.68', 1), (2, '2024-01-01', 1, '19.99', 1);"
+        "INSERT INTO \"category_shares\" VALUES (1, '2024-01-01', '9.5', 1);"
+        'CREATE INDEX "idx_product_cat_product_d5079d" '
+        'ON "product_categories" ("product_id");'
+        'DROP TABLE "daily_sales_sketch";'
+        'CREATE TABLE "daily_sales_sketch" ("id" INTEGER PRIMARY KEY, '
+        '"date" DATE NOT NULL UNIQUE, "transactions" INT NOT NULL, '
+        '"products" BLOB NOT NULL, "categories" BLOB NOT NULL, '
+        '"revenue" BLOB NOT NULL, "quantity" BLOB NOT NULL);'
+        'INSERT INTO "daily_sales_sketch" '
+        "VALUES (1, '2024-01-01', 1, '', '', '', '');",
+    )
+
+    assert await apply_migrations() == [name for name, _ in list_migrations()]
+    assert await apply_migrations() == []
+    _, rows = await connection.execute_query(
+        "SELECT name FROM sqlite_master WHERE type = 'index' "
+        "AND tbl_name IN ('product_categories', 'sales_transactions') "
+        "AND (name LIKE 'idx_%' OR name LIKE 'uid_%') ORDER BY name",
+    )
+    assert [row[0] for row in rows] == [
+        "idx_product_cat_categor_0b497f",
+        "idx_sales_trans_date_427588",
+        "idx_sales_trans_product_692f6b",
+        "uid_product_cat_product_01e387",
+    ]
+    # Links uploaded twice are stored once
+    assert await ProductCategory.all().values_list("id", flat=True) == [1]
+    # Sketches without heavy hitters are dropped, to be built again
+    _, rows = await connection.execute_query(
+        "SELECT name FROM pragma_table_info('daily_sales_sketch')",
+    )
+    assert {"top_products", "top_categories"} <= {row[0] for row in rows}
+    assert not await DailySalesSketch.exists()
+    # Decimal text is stored as cents and basis points
+    assert await SalesTransaction.all().order_by("id").values_list(
+        "revenue",
+        flat=True,
+    ) == [268, 1999]
+    assert await CategoryShare.all().values_list("market_share", flat=True) == [950]
+
+
+@pytest.mark.anyio
+async def test_analytics_queries_use_indexes() -> None:
+    """Checks that no query plan reads a whole table it did not declare."""
+    await apply_migrations()
+    for size in range(len(DIMENSIONS) + 1):
+        for dimensions in combinations(DIMENSIONS, size):
+            build_cuboid_query(dimensions)
+            build_cuboid_query(dimensions, sort=True)
+            build_cuboid_query(dimensions, after=[None] * size, limit=1)
+
+    connection = Tortoise.get_connection("default")
+    _, rows = await connection.execute_query(
+        "SELECT name FROM sqlite_master WHERE type = 'table'",
+    )
+    tables = {row[0] for row in rows}
+    for name in queries.names():
+        sql = queries.sql(name)
+        # Plans name tables by their alias
+        aliases = {table: table for table in tables}
+        for table, alias in re.findall(r'(?:FROM|JOIN) "?(\w+)"? (\w+)', sql):
+            if table in tables:
+                aliases[alias] = table
+        _, plan = await connection.execute_query(
+            f"EXPLAIN QUERY PLAN {sql}",
+            [None] * sql.count("?"),
+        )
+        scanned = {
+            aliases[step[3].split()[1]]
+            for step in plan
+            if step[3].startswith("SCAN ") and step[3].split()[1] in aliases
+        }
+        assert scanned <= queries.scans(name), name
+
+
+@pytest.mark.anyio
+async def test_duckdb_engine_matches_sqlite(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Checks that the aggregations give the same rows on DuckDB as on SQLite.
+
+    :param monkeypatch: pytest monkeypatch.
+    """
+    pytest.importorskip("duckdb")
+    pytest.importorskip("pyarrow")
+    await bulk_upload_products_from_csv(
+        "product_id,category_id\n1,10\n1,11\n2,10\n2,10\n3,12\n4,12\n",
+    )
+    await Product.create(id=5, name="no category")
+    rng = random.Random(24)
+    uploads = [
+        (bulk_upload_sales_transactions_from_csv, UploadMode.APPEND),
+        (bulk_upload_category_share_from_csv, UploadMode.APPEND),
+        # Copied incrementally, then whole after rows were replaced
+        (bulk_upload_sales_transactions_from_csv, UploadMode.APPEND),
+        (bulk_upload_sales_transactions_from_csv, UploadMode.REPLACE),
+        (bulk_upload_category_share_from_csv, UploadMode.REPLACE),
+        (bulk_upload_products_from_csv, UploadMode.REPLACE),
+    ]
+    for upload, mode in uploads:
+        if upload is bulk_upload_products_from_csv:
+            data = "product_id,category_id\n2,11\n5,13\n"
+        else:
+            data = "product_id,quantity,revenue,market_share,date\n" + "".join(
+                f"{rng.randint(1, 5)},{rng.randint(1, 4)},"
+                f"{rng.randint(1, 5000) / 100},{rng.randint(1, 9999) / 100},"
+                f"2024-01-0{rng.randint(1, 6)}\n"
+                for _ in range(40)
+            )
+        await upload(data, mode=mode)
+
+        results = {}
+        for engine in AnalyticsEngine:
+            monkeypatch.setattr(settings, "analytics_engine", engine)
+            results[engine] = [
+                sorted(await fetch_cuboid(dimensions), key=repr)
+                for size in range(len(DIMENSIONS) + 1)
+                for dimensions in combinations(DIMENSIONS, size)
+            ] + [
+                await fetch_category_share_data_for_period(start, end, limit)
+                for start, end in (
+                    ("2024-01-01", "2024-01-06"),
+                    ("2024-01-02", "2024-01-3"),
+                )
+                for limit in (0, 2)
+            ]
+        assert results[AnalyticsEngine.DUCKDB] == results[AnalyticsEngine.SQLITE]
+
+
+@pytest.mark.anyio
+async def test_duckdb_copy_follows_writes_of_other_processes(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Checks that the DuckDB copy takes in the rows other processes wrote.
+
+    :param monkeypatch: pytest monkeypatch.
+    """
+    pytest.importorskip("duckdb")
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(settings, "analytics_engine", AnalyticsEngine.DUCKDB)
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    assert await fetch_cuboid(["product"]) == [(1, 3050), (2, 425)]
+
+    # Appended rows are copied by id, a rewrite copies the table again
+    await write_as_other_process(
+        'INSERT INTO "sales_transactions" '
+        '("product_id", "quantity", "revenue", "date") '
+        "VALUES (2, 1, 75, '2024-01-03')",
+        ["sales_transactions"],
+    )
+    assert await fetch_cuboid(["product"]) == [(1, 3050), (2, 500)]
+    await write_as_other_process(
+        'DELETE FROM "sales_transactions" WHERE "product_id" = 1',
+        ["sales_transactions"],
+        rewritten=True,
+    )
+    assert await fetch_cuboid(["product"]) == [(2, 500)]
+
+
+@pytest.mark.anyio
+async def test_reads_go_on_while_an_upload_writes() -> None:
+    """Checks that registered queries do not wait for an open transaction."""
+    connection = Tortoise.get_connection("default")
+    _, rows = await connection.execute_query("PRAGMA journal_mode")
+    assert rows[0][0] == "wal"
+    _, rows = await connection.execute_query("PRAGMA busy_timeout")
+    assert rows[0][0] == settings.db_busy_timeout
+
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    written, release = asyncio.Event(), asyncio.Event()
+
+    async def upload() -> None:
+        async with in_transaction():
+            await SalesTransaction.create(
+                product_id=2,
+                quantity=1,
+                revenue=100,
+                date="2024-01-03",
+            )
+            assert (await fetch_cube_statistics())["rows"] == 4
+            written.set()
+            await release.wait()
+
+    task = asyncio.create_task(upload())
+    await written.wait()
+    # The shared connection would wait for the commit
+    statistics = await asyncio.wait_for(fetch_cube_statistics(), timeout=1)
+    assert statistics["rows"] == 3
+    release.set()
+    await task
+    assert (await fetch_cube_statistics())["rows"] == 4
@@ -0,0 +1,180 @@
+import asyncio
+from decimal import Decimal
+from typing import List
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from starlette import status
+
+from gobble_cube.db.dao.data_versions import bump_data_versions
+from gobble_cube.db.transactions import in_write_transaction
+from gobble_cube.services.category_share import bulk_upload_category_share_from_csv
+from gobble_cube.services.product import bulk_upload_products_from_csv
+from gobble_cube.services.result_cache import ResultCache, result_cache
+from gobble_cube.services.service_transaction import (
+    bulk_upload_sales_transactions_from_csv,
+    get_sales_data_by_dimensions,
+    get_total_revenue_for_period,
+)
+from gobble_cube.settings import settings
+from tests.utils import SALES_CSV, write_as_other_process
+
+
+@pytest.mark.anyio
+async def test_result_cache_evicts_and_expires() -> None:
+    """Checks the LRU eviction, the expiry and the table versions."""
+    cache = ResultCache(max_entries=2, ttl=60)
+    computed: List[str] = []
+
+    async def compute(name: str, table: str = "t") -> str:
+        async def run() -> str:
+            computed.append(name)
+            return name
+
+        return await cache.get_or_compute(name, (), [table], run)
+
+    for name in ("a", "b", "a", "c", "b"):
+        await compute(name)
+    assert computed == ["a", "b", "c", "b"]
+    assert cache.stats()["evictions"] == 2
+
+    async with in_write_transaction():
+        await bump_data_versions(["t"])
+    await compute("b")
+    await compute("x", table="other")
+    await compute("x", table="other")
+    assert computed == ["a", "b", "c", "b", "b", "x"]
+
+    expired = ResultCache(max_entries=2, ttl=0)
+    await expired.get_or_compute("a", (), [], lambda: asyncio.sleep(0, "a"))
+    await expired.get_or_compute("a", (), [], lambda: asyncio.sleep(0, "a"))
+    assert expired.stats()["expirations"] == 1
+
+
+@pytest.mark.anyio
+async def test_analytics_results_are_cached_until_upload(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+) -> None:
+    """Checks that uploads discard the cached results of their tables."""
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n2,11\n")
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+
+    assert await get_total_revenue_for_period("2024-01-01", "2024-01-31") == Decimal(
+        "34.75",
+    )
+    by_product = await get_sales_data_by_dimensions(["product", "date", "product"])
+    assert await get_sales_data_by_dimensions(["date", "product"]) == [
+        {key: row[key] for key in ("date", "product__id", "total_revenue")}
+        for row in by_product
+    ]
+    await bulk_upload_category_share_from_csv(
+        "market_share,product_id,date\n10,1,2024-01-01\n",
+    )
+    assert await get_total_revenue_for_period("2024-01-01", "2024-01-31") == Decimal(
+        "34.75",
+    )
+
+    # Totals come from the revenue index, without the cache
+    response = await client.get(fastapi_app.url_path_for("cache_stats"))
+    assert response.json()["hits"] == 1
+    assert response.json()["misses"] == 1
+
+    await bulk_upload_sales_transactions_from_csv(
+        "date,product_id,quantity,revenue\n2024-01-05,2,1,0.25\n",
+    )
+    assert await get_total_revenue_for_period("2024-01-01", "2024-01-31") == Decimal(
+        "35",
+    )
+    rows = await get_sales_data_by_dimensions(["date", "product"])
+    assert rows[-1]["total_revenue"] == Decimal("0.25")
+    assert result_cache.stats()["misses"] == 2
+
+
+@pytest.mark.anyio
+async def test_cached_results_follow_writes_of_other_processes() -> None:
+    """Checks that a write of another worker discards the cached results."""
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n2,11\n")
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    rows = await get_sales_data_by_dimensions(["product"])
+    assert [row["total_revenue"] for row in rows] == [Decimal("30.5"), Decimal("4.25")]
+
+    await write_as_other_process(
+        'INSERT INTO "sales_transactions" '
+        '("product_id", "quantity", "revenue", "date") '
+        "VALUES (2, 1, 75, '2024-01-03')",
+        ["sales_transactions"],
+    )
+    rows = await get_sales_data_by_dimensions(["product"])
+    assert [row["total_revenue"] for row in rows] == [Decimal("30.5"), Decimal("5")]
+    assert result_cache.stats()["misses"] == 2
+
+
+@pytest.mark.anyio
+async def test_analytics_batch_matches_single_endpoints(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+) -> None:
+    """Checks a batch answers like the single endpoints, duplicates once."""
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n2,10\n2,11\n")
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    await bulk_upload_category_share_from_csv(
+        "product_id,market_share,date\n"
+        "1,15,2024-01-01\n1,9.5,2024-01-02\n2,20,2024-01-01\n2,40,2024-01-03\n",
+    )
+    period = {"start_date": "2024-01-01", "end_date": "2024-01-03"}
+    batch = [
+        {"kind": "total", **period},
+        {"kind": "total", "start_date": "2024-01-02", "end_date": "2024-01-02"},
+        {"kind": "total", **period},
+        {"kind": "dimensions", "dimensions": ["category", "date"]},
+        {"kind": "dimensions", "dimensions": ["date", "category"]},
+        {"kind": "dimensions", "dimensions": ["colour"]},
+        {"kind": "significant_category_shares", **period, "limit": 1},
+        {"kind": "significant_category_shares", **period, "limit": 0},
+        {"kind": "total", "start_date": "2024-01-01"},
+    ]
+    response = await client.post(
+        fastapi_app.url_path_for("run_analytics_queries"),
+        json={"queries": batch},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    results = response.json()["results"]
+    assert len(results) == len(batch)
+    # Both orders of the dimensions share one computation
+    assert result_cache.stats()["misses"] == 2
+
+    routes = {
+        "total": "get_total_sales",
+        "dimensions": "get_sales_dimensions",
+        "significant_category_shares": "get_significant_category_shares",
+    }
+    for query, result in zip(batch, results):
+        assert result["elapsed_ms"] >= 0
+        params = {key: value for key, value in query.items() if key != "kind"}
+        if "dimensions" in params:
+            params["dimensions"] = ",".join(params["dimensions"])
+        url = fastapi_app.url_path_for(routes[query["kind"]])
+        single = await client.get(url, params=params)
+        if single.status_code != status.HTTP_200_OK:
+            assert result["status"] == "error"
+            continue
+        assert {key: result[key] for key in single.json()} == single.json()
+    assert results[0]["shared"] and results[2]["shared"]
+    assert not results[1]["shared"]
+    assert len(results[6]["significant_category_shares"]) == 1
+    assert len(results[7]["significant_category_shares"]) == 2
+
+    settings.analytics_batch_max_queries, limit = (
+        2,
+        settings.analytics_batch_max_queries,
+    )
+    try:
+        response = await client.post(
+            fastapi_app.url_path_for("run_analytics_queries"),
+            json={"queries": batch},
+        )
+    finally:
+        settings.analytics_batch_max_queries = limit
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
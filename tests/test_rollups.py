@@ -0,0 +1,191 @@
+from decimal import Decimal
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from starlette import status
+from tortoise.functions import Sum
+
+from gobble_cube.db.models import DailyRevenue, Product, SalesTransaction
+from gobble_cube.services.idempotency import UploadMode
+from gobble_cube.services.product import bulk_upload_products_from_csv
+from gobble_cube.services.revenue_index import revenue_index
+from gobble_cube.services.sales_rollup import check_sales_rollups, rebuild_sales_rollups
+from gobble_cube.services.service_transaction import (
+    bulk_upload_sales_transactions_from_csv,
+    get_total_revenue_for_period,
+)
+from tests.utils import SALES_CSV, write_as_other_process
+
+
+@pytest.mark.anyio
+async def test_sales_rollups_follow_uploads() -> None:
+    """Checks that totals come from rollups kept in line with the transactions."""
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    await bulk_upload_sales_transactions_from_csv(
+        "date,product_id,quantity,revenue\n2024-01-02,1,1,0.10\n2024-01-02,1,1,0.20\n",
+        mode=UploadMode.REPLACE,
+    )
+
+    assert await check_sales_rollups() == []
+    raw_total = (
+        await SalesTransaction.filter(date__range=("2024-01-01", "2024-01-02"))
+        .annotate(total=Sum("revenue"))
+        .values_list("total", flat=True)
+    )
+    total = await get_total_revenue_for_period("2024-01-01", "2024-01-02")
+    assert raw_total[0] == 1505
+    assert total == Decimal("15.05")
+    assert await get_total_revenue_for_period("2025-01-01", "2025-01-31") is None
+
+    await DailyRevenue.all().delete()
+    assert await check_sales_rollups() != []
+    await rebuild_sales_rollups()
+    assert await check_sales_rollups() == []
+
+
+@pytest.mark.anyio
+async def test_revenue_index_matches_sql_totals() -> None:
+    """Checks that the prefix sums give the totals the SQL sum gives."""
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    # Loaded now, then kept up to date by the next uploads
+    await revenue_index.load()
+    await bulk_upload_sales_transactions_from_csv(
+        "date,product_id,quantity,revenue\n2024-01-05,2,1,0.30\n2023-12-30,1,1,7\n",
+    )
+    await bulk_upload_sales_transactions_from_csv(
+        "date,product_id,quantity,revenue\n2024-01-02,1,1,1.10\n",
+        mode=UploadMode.REPLACE,
+    )
+
+    days = [f"2023-12-{day}" for day in (29, 30, 31)]
+    days += [f"2024-01-0{day}" for day in range(1, 7)]
+    for start in days:
+        for end in days:
+            expected = (
+                await SalesTransaction.filter(date__range=(start, end))
+                .annotate(total=Sum("revenue"))
+                .values_list("total", flat=True)
+            )
+            total = await revenue_index.total(start, end)
+            if expected[0] is None:
+                assert total is None
+            else:
+                assert total == Decimal(expected[0]).scaleb(-2)
+
+
+@pytest.mark.anyio
+async def test_revenue_index_keeps_outlier_dates() -> None:
+    """Checks totals around sales on the first and the last representable days."""
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    await revenue_index.load()
+    await bulk_upload_sales_transactions_from_csv(
+        "date,product_id,quantity,revenue\n0001-01-01,2,1,0.30\n9999-12-31,1,1,7\n",
+    )
+
+    assert revenue_index.loaded
+    assert await revenue_index.total("0001-01-01", "9999-12-31") == Decimal("42.05")
+    assert await revenue_index.total("0001-01-02", "9999-12-30") == Decimal("34.75")
+    assert await revenue_index.total("9999-12-31", "9999-12-31") == Decimal("7")
+    assert await revenue_index.total("2024-01-03", "9999-12-30") is None
+
+
+@pytest.mark.anyio
+async def test_revenue_index_reloads_after_writes_of_other_processes() -> None:
+    """Checks that the index loads again when another process wrote sales."""
+    await Product.bulk_create([Product(id=1, name="a"), Product(id=2, name="b")])
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    await revenue_index.load()
+    before = await revenue_index.total("2024-01-01", "2024-01-31")
+
+    await write_as_other_process(
+        'INSERT INTO "daily_revenue" '
+        '("date", "revenue_cents", "quantity", "transactions") '
+        "VALUES ('2024-01-20', 500, 1, 1)",
+        ["sales_transactions"],
+    )
+
+    assert await revenue_index.total("2024-01-01", "2024-01-31") == before + 5
+    # An upload of this process now follows the other one
+    await bulk_upload_sales_transactions_from_csv(
+        "date,product_id,quantity,revenue\n2024-01-21,2,1,0.25\n",
+    )
+    assert revenue_index.loaded
+    assert await revenue_index.total("2024-01-20", "2024-01-21") == Decimal("5.25")
+
+
+@pytest.mark.parametrize("bucket", ["day", "week", "month"])
+@pytest.mark.anyio
+async def test_sales_timeseries(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+    bucket: str,
+) -> None:
+    """Checks every point of the revenue series against the raw rows."""
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n2,10\n2,11\n")
+    await bulk_upload_sales_transactions_from_csv(
+        "transaction_id,date,product_id,quantity,revenue\n"
+        "1,2023-12-30,1,2,10.50\n2,2024-01-02,2,1,4.25\n3,2024-01-08,1,5,20\n"
+        "4,2024-02-29,2,1,1.10\n5,2024-03-04,1,1,3\n",
+    )
+    url = fastapi_app.url_path_for("get_sales_timeseries")
+
+    for filters in ({}, {"product_id": 2}, {"category_id": 10}, {"category_id": 11}):
+        params = {"start_date": "2023-12-31", "end_date": "2024-03-04"}
+        response = await client.get(url, params={**params, "bucket": bucket, **filters})
+        assert response.status_code == status.HTTP_200_OK
+        points = response.json()["series"]
+        assert points[0]["date"] <= params["start_date"] < points[1]["date"]
+        assert points[-1]["date"] <= params["end_date"]
+        bounds = [point["date"] for point in points[1:]] + ["9999-12-31"]
+        query = SalesTransaction.filter(date__range=tuple(params.values()))
+        if "product_id" in filters:
+            query = query.filter(product_id=filters["product_id"])
+        if "category_id" in filters:
+            query = query.filter(
+                product__product_categories__category_id=filters["category_id"],
+            )
+        for point, stop in zip(points, bounds):
+            rows = await query.filter(
+                date__gte=max(point["date"], params["start_date"]),
+                date__lt=stop,
+            ).values_list("revenue", flat=True)
+            assert Decimal(str(point["revenue"])) == Decimal(sum(rows)).scaleb(-2)
+            assert point["transactions"] == len(rows)
+
+    response = await client.get(
+        url,
+        params={"start_date": "2000-01-01", "end_date": "2024-01-01"},
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    response = await client.get(
+        url,
+        params={
+            "start_date": "2024-01-01",
+            "end_date": "2024-01-31",
+            "product_id": 1,
+            "category_id": 10,
+        },
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.anyio
+async def test_total_sales_requires_dates(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+) -> None:
+    """
+    Checks that a total without a period is a bad request.
+
+    :param client: client for the app.
+    :param fastapi_app: current FastAPI application.
+    """
+    response = await client.get(
+        fastapi_app.url_path_for("get_total_sales"),
+        params={"start_date": "", "end_date": "2024-01-31"},
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
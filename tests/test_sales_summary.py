@@ -0,0 +1,183 @@
+import random
+from decimal import Decimal
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from starlette import status
+
+from gobble_cube.db.models import ProductCategory, SalesTransaction
+from gobble_cube.services.idempotency import UploadMode
+from gobble_cube.services.product import bulk_upload_products_from_csv
+from gobble_cube.services.sales_summary import sales_sketch_index
+from gobble_cube.services.service_transaction import (
+    bulk_upload_sales_transactions_from_csv,
+)
+from gobble_cube.services.sketches import HeavyHitters
+from gobble_cube.settings import settings
+from tests.utils import SALES_CSV, write_as_other_process
+
+
+@pytest.mark.anyio
+async def test_sales_summary_bounds_contain_exact_values(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+) -> None:
+    """Checks the approximate summary bounds the exact one, across uploads."""
+    rng = random.Random(19)
+    await bulk_upload_products_from_csv(
+        "product_id,category_id\n"
+        + "".join(f"{product},{product % 7}\n" for product in range(1, 81)),
+    )
+
+    def sales(first: int, count: int) -> str:
+        return "transaction_id,date,product_id,quantity,revenue\n" + "".join(
+            f"{first + row},2024-01-{rng.randint(1, 9):02},{rng.randint(1, 80)},"
+            f"{rng.randint(1, 20)},{rng.randint(1, 100_000) / 100}\n"
+            for row in range(count)
+        )
+
+    await bulk_upload_sales_transactions_from_csv(sales(1, 3000))
+    await bulk_upload_sales_transactions_from_csv(sales(3001, 1000))
+    await bulk_upload_sales_transactions_from_csv(
+        sales(1, 500),
+        mode=UploadMode.REPLACE,
+    )
+    await bulk_upload_products_from_csv("product_id,category_id\n5,20\n6,21\n")
+    url = fastapi_app.url_path_for("get_sales_period_summary")
+
+    for start_date, end_date in (
+        ("2024-01-01", "2024-01-09"),
+        ("2024-01-03", "2024-01-05"),
+    ):
+        params = {"start_date": start_date, "end_date": end_date}
+        response = await client.get(url, params=params)
+        assert response.status_code == status.HTTP_200_OK
+        exact = response.json()["summary"]
+        assert not exact["approximate"]
+        response = await client.get(url, params={**params, "approximate": True})
+        assert response.status_code == status.HTTP_200_OK
+        estimated = response.json()["summary"]
+        assert estimated["approximate"]
+        assert estimated["transactions"] == exact["transactions"]
+
+        for name in ("products", "categories"):
+            assert exact[name]["low"] == exact[name]["estimate"] == exact[name]["high"]
+            value = exact[name]["estimate"]
+            assert estimated[name]["low"] <= value <= estimated[name]["high"]
+        for name in ("revenue_quantiles", "quantity_quantiles"):
+            for point, bounds in zip(exact[name], estimated[name]):
+                assert point["low"] == point["estimate"] == point["high"]
+                assert bounds["low"] <= point["estimate"] <= bounds["high"]
+
+    response = await client.get(
+        url,
+        params={"start_date": "2024-01-01", "end_date": "2024-01-09", "quantiles": "2"},
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.anyio
+async def test_top_sales_match_exact_ranking(
+    client: AsyncClient,
+    fastapi_app: FastAPI,
+) -> None:
+    """Checks top products and categories, from summaries or the fallback."""
+    rng = random.Random(21)
+    settings.top_sales_capacity, capacity = 8, settings.top_sales_capacity
+    try:
+        await bulk_upload_products_from_csv(
+            "product_id,category_id\n"
+            + "".join(f"{product},{product % 9}\n" for product in range(1, 201))
+            + "1,20\n",
+        )
+        # A few products make most of the revenue
+        await bulk_upload_sales_transactions_from_csv(
+            "transaction_id,date,product_id,quantity,revenue\n"
+            + "".join(
+                f"{row},2024-01-{rng.randint(1, 9):02},"
+                f"{min(int(rng.paretovariate(1.2)), 200)},1,"
+                f"{rng.randint(1, 10_000) / 100}\n"
+                for row in range(1, 3001)
+            ),
+        )
+    finally:
+        settings.top_sales_capacity = capacity
+    url = fastapi_app.url_path_for("get_top_sales_for_period")
+
+    for dimension, limit, fallback in (
+        ("product", 2, False),
+        ("product", 50, True),
+        ("category", 2, False),
+        ("category", 9, True),
+    ):
+        for start_date, end_date in (
+            ("2024-01-01", "2024-01-09"),
+            ("2024-01-04", "2024-01-04"),
+        ):
+            params = {"start_date": start_date, "end_date": end_date}
+            response = await client.get(
+                url,
+                params={**params, "dimension": dimension, "limit": limit},
+            )
+            assert response.status_code == status.HTTP_200_OK
+            assert response.json()["fallback"] == fallback
+            categories: dict = {}
+            for product_id, category_id in await ProductCategory.all().values_list(
+                "product_id",
+                "category_id",
+            ):
+                categories.setdefault(product_id, set()).add(category_id)
+            revenue: dict = {}
+            for product_id, value in await SalesTransaction.filter(
+                date__range=(start_date, end_date),
+            ).values_list("product_id", "revenue"):
+                keys = (
+                    categories[product_id] if dimension == "category" else [product_id]
+                )
+                for key in keys:
+                    revenue[key] = revenue.get(key, 0) + value
+            expected = sorted(revenue.items(), key=lambda item: (-item[1], item[0]))
+            assert [
+                (item[f"{dimension}_id"], Decimal(str(item["revenue"])))
+                for item in response.json()["top"]
+            ] == [(key, Decimal(cents).scaleb(-2)) for key, cents in expected[:limit]]
+
+    response = await client.get(url, params={"start_date": "2024-01", "end_date": "x"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.anyio
+async def test_heavy_hitters_with_negative_weights_are_uncertain() -> None:
+    """Checks that refunds keep top products from being trusted to the summary."""
+    summary = HeavyHitters(capacity=2)
+    for value, weight in ((1, 100), (2, 90), (3, 80), (1, -60)):
+        summary.add(value, weight)
+    assert summary.top(1) == ([(2, 90)], False)
+
+    merged = HeavyHitters(capacity=2).merge(HeavyHitters.from_bytes(summary.to_bytes()))
+    assert merged.uncertain
+    assert merged.top(1)[1] is False
+
+    exact = HeavyHitters(capacity=2)
+    exact.add(1, 100)
+    assert exact.top(1) == ([(1, 100)], True)
+
+
+@pytest.mark.anyio
+async def test_sales_sketches_reload_after_writes_of_other_processes() -> None:
+    """Checks that the sketches load again when another process wrote sales."""
+    await bulk_upload_products_from_csv("product_id,category_id\n1,10\n2,10\n")
+    await bulk_upload_sales_transactions_from_csv(SALES_CSV)
+    sketch = await sales_sketch_index.period("2024-01-01", "2024-01-31")
+    assert sketch is not None
+    assert sketch.transactions == 3
+
+    # Another worker replaced the transactions of a day by none
+    await write_as_other_process(
+        """DELETE FROM "daily_sales_sketch" WHERE "date" = '2024-01-02'""",
+        ["sales_transactions"],
+    )
+    sketch = await sales_sketch_index.period("2024-01-01", "2024-01-31")
+    assert sketch is not None
+    assert sketch.transactions == 1
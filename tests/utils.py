@@ -0,0 +1,35 @@
+from typing import Sequence
+
+import aiosqlite
+from tortoise import Tortoise
+
+from gobble_cube.db.dao.data_versions import BUMP_DATA_VERSION
+
+SALES_CSV = (
+    "transaction_id,date,product_id,quantity,revenue\n"
+    "1,2024-01-01,1,2,10.50\n"
+    "2,2024-01-02,2,1,4.25\n"
+    "3,2024-01-02,1,5,20.00\n"
+)
+
+
+async def write_as_other_process(
+    sql: str,
+    tables: Sequence[str],
+    rewritten: bool = False,
+) -> None:
+    """
+    Write to the test database as another worker process would.
+
+    :param sql: statement to run.
+    :param tables: tables whose data version is bumped with the statement.
+    :param rewritten: whether the statement deletes or changes rows.
+    """
+    filename = Tortoise.get_connection("default").filename
+    async with aiosqlite.connect(filename) as other:
+        await other.execute(sql)
+        await other.executemany(
+            BUMP_DATA_VERSION,
+            [[table, int(rewritten)] for table in tables],
+        )
+        await other.commit()